@@ -0,0 +1,112 @@
+import os
+import sys
+import json
+import time
+import argparse
+import shutil
+import tempfile
+from pathlib import Path
+from typing import List, Optional
+
+from cosmas.generated.cosmas_pb2 import PatchList
+from processing.executors import BACKENDS
+from processing.memory import MemoryGovernor, parse_size, process_tree_rss
+from processing.patch_processor import AdvancedPatchProcessor
+from benchmarks.run_benchmarks import read_documents
+from benchmarks.synthetic import write_store
+
+
+def run_backend(backend: str, num_workers: int, documents: list, scheduling: str = 'least-loaded',
+                memory_budget: Optional[int] = None) -> dict:
+    start = time.perf_counter()
+    governor = MemoryGovernor(memory_budget, num_workers, poll_interval=0.05) if memory_budget else None
+    processor = AdvancedPatchProcessor(num_cpus=num_workers, backend=backend, scheduling=scheduling,
+                                       memory_governor=governor)
+    started = time.perf_counter()
+    peak_rss = process_tree_rss(os.getpid())
+
+    for content, patch_lists in documents:
+        patches = []
+        for data in patch_lists:
+            patch_list = PatchList()
+            patch_list.ParseFromString(data)
+            patches.extend(patch_list.patches)
+        patches.sort(key=lambda p: p.timestamp)
+        processor.process_patches(content, patches)
+        peak_rss = max(peak_rss, process_tree_rss(os.getpid()))
+    diffs = sorted(processor.get_diffs())
+
+    seconds = time.perf_counter() - start
+    return {
+        'backend': backend,
+        'workers': num_workers,
+        'scheduling': scheduling,
+        'memory_budget': memory_budget,
+        'peak_rss_bytes': max(peak_rss, governor.peak_rss) if governor else peak_rss,
+        'utilisation': processor.scheduler.statistics()['mean_utilisation'],
+        'startup_seconds': started - start,
+        'seconds': seconds,
+        'documents_per_sec': len(documents) / seconds,
+        'sentence_pairs': len(diffs),
+        'diffs': diffs
+    }
+
+
+def main(store_dir: Optional[Path], backends: List[str], workers: List[int], schedulings: List[str],
+         output_path: Optional[Path], docs: int, versions: int, skew: Optional[float],
+         memory_budgets: Optional[List[int]] = None):
+    """
+    Runs the same extraction workload on every backend, number of workers, scheduling and memory budget,
+    checks that results are identical
+    """
+    generated = store_dir is None
+    if generated:
+        store_dir = write_store(Path(tempfile.mkdtemp(prefix='synthetic-store-')), docs, 30, versions, 0.01, skew=skew)
+    try:
+        documents = read_documents(store_dir)
+    finally:
+        if generated:
+            shutil.rmtree(store_dir)
+
+    results, reference = [], None
+    for backend in backends:
+        for num_workers in ([1] if backend == 'serial' else workers):
+            for scheduling in (schedulings[:1] if backend == 'serial' else schedulings):
+                for memory_budget in (memory_budgets or [None]):
+                    result = run_backend(backend, num_workers, documents, scheduling, memory_budget)
+                    diffs = result.pop('diffs')
+                    reference = reference if reference is not None else diffs
+                    result['same_as_first'] = diffs == reference
+                    results.append(result)
+                    print(f'{backend:>10} x{num_workers:<3} {scheduling:>12}: {result["seconds"]:8.3f}s '
+                          f'(startup {result["startup_seconds"]:.3f}s), {result["documents_per_sec"]:.2f} docs/s, '
+                          f'utilisation {result["utilisation"]:.2f}, {result["sentence_pairs"]} pairs, '
+                          f'peak rss {result["peak_rss_bytes"] / 2 ** 20:.0f}M'
+                          f'{f" (budget {memory_budget / 2 ** 20:.0f}M)" if memory_budget else ""}'
+                          f'{"" if result["same_as_first"] else ", DIFFERENT RESULTS"}', file=sys.stderr)
+
+    if output_path:
+        output_path.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--store', type=str, default=None,
+                        help='Existing store to benchmark on, a synthetic one is generated otherwise')
+    parser.add_argument('--backends', type=str, nargs='+', choices=BACKENDS, default=BACKENDS)
+    parser.add_argument('--workers', type=int, nargs='+', default=[2, 4],
+                        help='Numbers of workers to try for parallel backends')
+    parser.add_argument('--scheduling', type=str, nargs='+', choices=['least-loaded', 'round-robin'],
+                        default=['least-loaded', 'round-robin'])
+    parser.add_argument('--docs', type=int, default=8)
+    parser.add_argument('--versions', type=int, default=20)
+    parser.add_argument('--skew', type=float, default=1.5,
+                        help='Shape of the Pareto distribution of synthetic document sizes')
+    parser.add_argument('--memory-budgets', type=str, nargs='+', default=None,
+                        help='Memory budgets to run with, like 512M, no budget by default')
+    parser.add_argument('--output', type=str, default=None,
+                        help='File to save results as json')
+    args = parser.parse_args()
+    main(args.store and Path(args.store), args.backends, args.workers, args.scheduling,
+         args.output and Path(args.output), args.docs, args.versions, args.skew,
+         args.memory_budgets and [parse_size(budget) for budget in args.memory_budgets])
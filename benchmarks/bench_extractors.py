@@ -0,0 +1,145 @@
+import sys
+import json
+import time
+import random
+import argparse
+import shutil
+import tempfile
+from collections import Counter
+from pathlib import Path
+from typing import List, Optional, Tuple
+from diff_match_patch import diff_match_patch
+
+from cosmas.generated.cosmas_pb2 import PatchList
+from processing.patch_parser import parse_patches
+from processing.patch_processor import group_similar_patches_by_timestamps_and_distance, sent_normalize, \
+    extract_one_diff, extract_multiple_diffs, extract_adaptive_diffs
+from processing.tools.latex2text import LatexMarkupProcessor
+from benchmarks.run_benchmarks import read_documents
+from benchmarks.synthetic import write_store, generate_document, edit_document
+
+
+def store_tasks(store_dir: Path) -> List[Tuple[str, str]]:
+    """
+    Pairs of texts before and after every patch group, as AdvancedPatchProcessor sends them to extractors
+    """
+    patcher = diff_match_patch()
+    tasks = []
+    for content, patch_lists in read_documents(store_dir):
+        patches = []
+        for data in patch_lists:
+            patch_list = PatchList()
+            patch_list.ParseFromString(data)
+            patches.extend(patch_list.patches)
+        patches.sort(key=lambda p: p.timestamp)
+        batch = parse_patches([patch.text for patch in patches])
+        timestamps = [patches[i].timestamp for i in batch.text_ids[::-1].tolist()]
+        text = content
+        for group in group_similar_patches_by_timestamps_and_distance(batch.to_patch_objs(inverted=True), timestamps):
+            text_before = patcher.patch_apply(group, text)[0]
+            tasks.append((text_before, text))
+            text = text_before
+    return tasks
+
+
+def sentence_edit_tasks(rng: random.Random, count: int) -> List[Tuple[str, str]]:
+    """
+    Edits that move, repeat, insert and delete whole sentences, around the limits of the alignment window
+    """
+    tasks = []
+    for _ in range(count):
+        sents = generate_document(rng, rng.randint(1, 20)).split('. ')
+        edited = list(sents)
+        for _ in range(rng.randint(1, 4)):
+            action, i = rng.random(), rng.randrange(len(edited) + 1)
+            if action < 0.3 and i < len(edited):
+                edited[i] = edit_document(rng, edited[i], rng.randint(1, 3))
+            elif action < 0.5:
+                edited[i:i] = [rng.choice(sents) for _ in range(rng.randint(1, 12))]
+            elif action < 0.7:
+                del edited[i:i + rng.randint(1, 12)]
+            else:
+                edited.insert(i, rng.choice(edited or sents))
+        tasks.append(('. '.join(sents), '. '.join(edited)))
+    return tasks
+
+
+def main(store_dir: Optional[Path], docs: int, paragraphs: int, versions: int, edit_rate: float, fuzz_size: int,
+         seed: int, min_agreement: float, output_path: Optional[Path]):
+    """
+    Measures the extractors on tasks of a store and checks the quality of the adaptive one on them and on random
+    sentence level edits: its exact paths must give the same sentence pairs as the multiple extractor,
+    and at least min_agreement of the tasks it pairs directly must agree with it too
+    """
+    generated = store_dir is None
+    if generated:
+        store_dir = write_store(Path(tempfile.mkdtemp(prefix='synthetic-store-')), docs, paragraphs, versions,
+                                edit_rate, seed)
+    try:
+        raw_tasks = store_tasks(store_dir)
+    finally:
+        if generated:
+            shutil.rmtree(store_dir)
+    markup_processor = LatexMarkupProcessor()
+    tasks = [(markup_processor.remove_markup(before), markup_processor.remove_markup(after))
+             for before, after in raw_tasks]
+    fuzz_tasks = sentence_edit_tasks(random.Random(seed), fuzz_size)
+
+    results = {}
+    outputs = {}
+    for name, extract in [('multiple', extract_multiple_diffs), ('adaptive', extract_adaptive_diffs),
+                          ('one', extract_one_diff)]:
+        start = time.perf_counter()
+        outputs[name] = [extract(before, after) for before, after in tasks]
+        seconds = time.perf_counter() - start
+        results[name] = {'seconds': seconds, 'tasks_per_sec': len(tasks) / seconds}
+        print(f'{name:>10}: {seconds:8.3f}s  {len(tasks) / seconds:8.1f} tasks/s', file=sys.stderr)
+
+    adaptive = outputs['adaptive'] + [extract_adaptive_diffs(before, after) for before, after in fuzz_tasks]
+    multiple = outputs['multiple'] + [extract_multiple_diffs(before, after) for before, after in fuzz_tasks]
+    paths, agreements = Counter(), Counter()
+    for (diffs, path), reference in zip(adaptive, multiple):
+        paths[path] += 1
+        agreements[path] += diffs == reference
+    mismatches = sum(paths[path] - agreements[path] for path in paths if path != 'in_place')
+    in_place_agreement = agreements['in_place'] / paths['in_place'] if paths['in_place'] else 1.0
+    one_agrees = sum(
+        (one is None and not reference) or
+        (one is not None and [(sent_normalize(one[0]), sent_normalize(one[1]))] == reference)
+        for one, reference in zip(outputs['one'], outputs['multiple'])
+    )
+
+    print(f'Adaptive paths: {dict(paths)}', file=sys.stderr)
+    print(f'Mismatches of exact paths: {mismatches}', file=sys.stderr)
+    print(f'In place path agrees with multiple on {agreements["in_place"]} of {paths["in_place"]} tasks', file=sys.stderr)
+    print(f'One diff agrees with multiple on {one_agrees} of {len(tasks)} tasks', file=sys.stderr)
+
+    if output_path:
+        output_path.write_text(json.dumps({
+            'tasks': len(tasks), 'fuzz_tasks': len(fuzz_tasks), 'paths': dict(paths), 'agreements': dict(agreements),
+            'mismatches': mismatches, 'in_place_agreement': in_place_agreement, 'one_agrees': one_agrees,
+            'extractors': results
+        }, indent=2))
+    if mismatches or in_place_agreement < min_agreement:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--store', type=str, default=None,
+                        help='Existing store to benchmark on, a synthetic one is generated otherwise')
+    parser.add_argument('--docs', type=int, default=5)
+    parser.add_argument('--paragraphs', type=int, default=30)
+    parser.add_argument('--versions', type=int, default=20)
+    parser.add_argument('--edit-rate', type=float, default=0.001,
+                        help='Share of words changed by a patch, at least one word is changed')
+    parser.add_argument('--fuzz-size', type=int, default=300,
+                        help='Number of random sentence level edits to check equivalence on')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--min-agreement', type=float, default=0.95,
+                        help='Minimal share of tasks of the in place path that must agree with the multiple extractor')
+    parser.add_argument('--output', type=str, default=None,
+                        help='File to save results as json')
+    args = parser.parse_args()
+    main(args.store and Path(args.store), args.docs, args.paragraphs, args.versions, args.edit_rate, args.fuzz_size,
+         args.seed, args.min_agreement, args.output and Path(args.output))
@@ -0,0 +1,83 @@
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+from typing import List, Optional
+import pandas as pd
+from langdetect import DetectorFactory
+
+from processing.language import EnglishDetector
+from processing.selector import is_probably_english
+
+
+def load_sentences(path: Path, limit: Optional[int]) -> pd.DataFrame:
+    if path.suffix == '.tsv':
+        df = pd.read_csv(path, sep='\t', keep_default_na=False)
+        sents = pd.concat([df['original_sent'], df['edited_sent']], ignore_index=True)
+        df = pd.DataFrame({'sent': sents})
+    else:
+        with path.open('r') as inp:
+            df = pd.DataFrame({'sent': [line.rstrip('\n') for line in inp]})
+    if limit:
+        df = df.head(limit)
+    return df
+
+
+def measure(sents: List[str], method) -> (List[bool], float):
+    start = time.perf_counter()
+    verdicts = [method(sent) for sent in sents]
+    return verdicts, time.perf_counter() - start
+
+
+def main(dataset_path: Path, labels_path: Optional[Path], limit: Optional[int], output_path: Optional[Path]):
+    """
+    Compares the cached english detector with plain langdetect calls on a dataset TSV or a text file
+    """
+    df = load_sentences(dataset_path, limit)
+    sents = df['sent'].tolist()
+
+    DetectorFactory.seed = 0
+    baseline, baseline_time = measure(sents, is_probably_english)
+
+    detector = EnglishDetector()
+    verdicts, detector_time = measure(sents, detector.is_english)
+    warm_detector_time = measure(sents, detector.is_english)[1]
+
+    agreement = sum(a == b for a, b in zip(baseline, verdicts)) / max(len(sents), 1)
+    results = {
+        'sentences': len(sents),
+        'langdetect_sents_per_sec': len(sents) / baseline_time,
+        'detector_sents_per_sec': len(sents) / detector_time,
+        'detector_cached_sents_per_sec': len(sents) / warm_detector_time,
+        'agreement_with_langdetect': agreement,
+        'detector': detector.statistics()
+    }
+
+    if labels_path:
+        with labels_path.open('r') as inp:
+            labels = [line.strip() == 'en' for line in inp][:len(sents)]
+        results['langdetect_accuracy'] = sum(a == b for a, b in zip(baseline, labels)) / max(len(labels), 1)
+        results['detector_accuracy'] = sum(a == b for a, b in zip(verdicts, labels)) / max(len(labels), 1)
+
+    print(json.dumps(results, indent=2))
+    if output_path:
+        output_path.write_text(json.dumps(results, indent=2))
+
+    disagreements = [(sent, a, b) for sent, a, b in zip(sents, baseline, verdicts) if a != b]
+    for sent, a, b in disagreements[:20]:
+        print(f'langdetect={a} detector={b}: {sent}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dataset', type=str, required=True,
+                        help='Dataset TSV produced by process_patches.py or a text file with one sentence per line')
+    parser.add_argument('--labels', type=str, default=None,
+                        help='Optional file with a language code per sentence for accuracy measurement')
+    parser.add_argument('--limit', type=int, default=None,
+                        help='Maximal number of sentences to use')
+    parser.add_argument('--output', type=str, default=None,
+                        help='File to save results as json')
+    args = parser.parse_args()
+    main(Path(args.dataset), args.labels and Path(args.labels), args.limit, args.output and Path(args.output))
@@ -0,0 +1,92 @@
+import sys
+import json
+import time
+import shutil
+import filecmp
+import argparse
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+from load_patches import BucketLoader
+from local_bucket import LocalClient
+from benchmarks.synthetic import write_bucket
+
+
+def truncate_bucket(source: Path, target: Path, drop: int):
+    """
+    Copies a local bucket without the last drop generations of every object, as it looked before they were written
+    """
+    shutil.copytree(source, target)
+    for object_dir in (path for bucket_dir in target.iterdir() for path in bucket_dir.iterdir()):
+        for generation in sorted(object_dir.iterdir(), key=lambda path: int(path.name))[-drop:]:
+            generation.unlink()
+
+
+def same_trees(left: Path, right: Path) -> bool:
+    comparison = filecmp.dircmp(left, right)
+    stack = [comparison]
+    while stack:
+        comparison = stack.pop()
+        if comparison.left_only or comparison.right_only or comparison.diff_files or comparison.funny_files:
+            return False
+        stack.extend(comparison.subdirs.values())
+    return True
+
+
+def run_loader(bucket_root: Path, store_dir: Path, use_history_window: bool) -> dict:
+    client = LocalClient(bucket_root)
+    loader = BucketLoader(None, 'synthetic', str(store_dir), client=client, use_history_window=use_history_window)
+    start = time.perf_counter()
+    updates = list(loader.iter_updates(persist=True))
+    return {
+        'history_window': use_history_window,
+        'seconds': time.perf_counter() - start,
+        'objects': len(updates),
+        'patches': sum(len(update.patches) for update in updates),
+        'list_requests': client.requests['list'],
+        'download_requests': client.requests['download']
+    }
+
+
+def main(docs: int, versions: int, new_versions: int, history_window: int, output_path: Optional[Path]):
+    """
+    Loads new_versions new versions of every object into a store that has the older ones,
+    with and without planning downloads from historyWindow, and checks that the stores end up identical
+    """
+    work_dir = Path(tempfile.mkdtemp(prefix='bench-loader-'))
+    write_bucket(work_dir / 'bucket', 'synthetic', docs, 10, versions, 0.01, history_window=history_window)
+    truncate_bucket(work_dir / 'bucket', work_dir / 'old-bucket', new_versions)
+    run_loader(work_dir / 'old-bucket', work_dir / 'old-store', use_history_window=False)
+
+    results = []
+    for use_history_window in [False, True]:
+        store_dir = work_dir / f'store-{"window" if use_history_window else "listing"}'
+        shutil.copytree(work_dir / 'old-store', store_dir)
+        result = run_loader(work_dir / 'bucket', store_dir, use_history_window)
+        results.append(result)
+        print(f'history window {str(use_history_window):>5}: {result["seconds"]:.3f}s, '
+              f'{result["objects"]} objects, {result["patches"]} patches, '
+              f'{result["list_requests"]} lists, {result["download_requests"]} downloads', file=sys.stderr)
+
+    same = same_trees(work_dir / 'store-listing', work_dir / 'store-window')
+    print(f'Same stores: {same}', file=sys.stderr)
+    shutil.rmtree(work_dir)
+    if output_path:
+        output_path.write_text(json.dumps({'same_stores': same, 'runs': results}, indent=2))
+    if not same:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--docs', type=int, default=20)
+    parser.add_argument('--versions', type=int, default=100,
+                        help='Number of versions of every object')
+    parser.add_argument('--new-versions', type=int, default=3,
+                        help='Number of versions of every object missing from the store')
+    parser.add_argument('--history-window', type=int, default=10)
+    parser.add_argument('--output', type=str, default=None,
+                        help='File to save results as json')
+    args = parser.parse_args()
+    main(args.docs, args.versions, args.new_versions, args.history_window, args.output and Path(args.output))
@@ -0,0 +1,154 @@
+import sys
+import json
+import time
+import random
+import argparse
+import shutil
+import tempfile
+from pathlib import Path
+from typing import List, Optional
+from diff_match_patch import diff_match_patch
+
+from cosmas.generated.cosmas_pb2 import PatchList
+from processing.patch import invert_patches
+from processing.patch_parser import parse_patches
+from benchmarks.run_benchmarks import read_documents
+from benchmarks.synthetic import write_store
+
+
+FUZZ_ALPHABET = list('abc xyz\n\t%+-@ ,.;:!?#&=~\'"`\\{}$') + ['é', 'ß', '∑', '→', '😀', '%25', '%0A', '%E2%82', '\r']
+
+
+def random_text(rng: random.Random, length: int) -> str:
+    return ''.join(rng.choice(FUZZ_ALPHABET) for _ in range(length))
+
+
+def fuzz_corpus(rng: random.Random, size: int) -> List[str]:
+    """
+    Patch texts of random edits of random texts, plus a few broken ones that must fail in the same way
+    """
+    patcher = diff_match_patch()
+    texts = []
+    for _ in range(size):
+        text = random_text(rng, rng.randint(0, 200))
+        edited = list(text)
+        for _ in range(rng.randint(1, 5)):
+            i = rng.randint(0, len(edited))
+            edited[i:i + rng.randint(0, 10)] = random_text(rng, rng.randint(0, 10))
+        texts.append(patcher.patch_toText(patcher.patch_make(text, ''.join(edited))))
+    texts += ['', '\n', '@@ -1 +1 @@\n', '@@ -0,0 +1,3 @@\n+abc\n', '@@ -1,2 +1,2 @@\n-a\n+b\n\n \n',
+              '@@ -1 +1 @@\n?abc\n', '@@ -x +1 @@\n', 'garbage', '@@ -1,2 +1,2 @@\n-a\n@x\n']
+    return texts
+
+
+def parse_reference(patcher: diff_match_patch, text: str):
+    try:
+        return patcher.patch_fromText(text), None
+    except ValueError as e:
+        return None, str(e)
+
+
+def parse_fast(text: str):
+    try:
+        return parse_patches([text]).to_patch_objs(), None
+    except ValueError as e:
+        return None, str(e)
+
+
+def as_tuples(patches) -> list:
+    return [(p.start1, p.start2, p.length1, p.length2, list(p.diffs)) for p in patches]
+
+
+def check_equivalence(texts: List[str]) -> int:
+    """
+    Compares parse_patches with patch_fromText text by text and on the whole corpus, returns the number of mismatches
+    """
+    patcher = diff_match_patch()
+    mismatches = 0
+    valid = []
+    for text in texts:
+        (expected, expected_error), (actual, actual_error) = parse_reference(patcher, text), parse_fast(text)
+        if expected_error or actual_error:
+            same = expected_error == actual_error
+        else:
+            same = as_tuples(expected) == as_tuples(actual)
+            valid.append(text)
+        if not same:
+            mismatches += 1
+            print(f'Mismatch on {text!r}', file=sys.stderr)
+
+    expected = [patch for text in valid for patch in patcher.patch_fromText(text)]
+    batch = parse_patches(valid)
+    if as_tuples(batch.to_patch_objs()) != as_tuples(expected):
+        mismatches += 1
+        print('Mismatch on the whole corpus', file=sys.stderr)
+    if as_tuples(batch.to_patch_objs(inverted=True)) != as_tuples(invert_patches(expected)):
+        mismatches += 1
+        print('Mismatch of inverted patches on the whole corpus', file=sys.stderr)
+    return mismatches
+
+
+def benchmark(documents: List[List[str]], repeat: int) -> dict:
+    patcher = diff_match_patch()
+    num_patches = sum(map(len, documents))
+    results = {}
+    for name, parse in [
+        ('patch_fromText', lambda texts: [p for text in texts for p in patcher.patch_fromText(text)]),
+        ('patch_fromText+invert', lambda texts: invert_patches([p for text in texts for p in patcher.patch_fromText(text)])),
+        ('parse_patches', lambda texts: parse_patches(texts)),
+        ('parse_patches+to_patch_objs', lambda texts: parse_patches(texts).to_patch_objs(inverted=True)),
+    ]:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for texts in documents:
+                parse(texts)
+            seconds = time.perf_counter() - start
+            best = seconds if best is None else min(best, seconds)
+        results[name] = {'seconds': best, 'patches_per_sec': num_patches / best}
+        print(f'{name:>28}: {best:8.3f}s  {num_patches / best:10.0f} patches/s', file=sys.stderr)
+    return results
+
+
+def main(store_dir: Optional[Path], fuzz_size: int, seed: int, repeat: int, output_path: Optional[Path]):
+    rng = random.Random(seed)
+    texts = fuzz_corpus(rng, fuzz_size)
+
+    generated = store_dir is None
+    if generated:
+        store_dir = write_store(Path(tempfile.mkdtemp(prefix='synthetic-store-')), 10, 30, 30, 0.01, seed)
+    try:
+        stored_documents = read_documents(store_dir)
+    finally:
+        if generated:
+            shutil.rmtree(store_dir)
+    documents = []
+    for _, patch_lists in stored_documents:
+        document = []
+        for data in patch_lists:
+            patch_list = PatchList()
+            patch_list.ParseFromString(data)
+            document.extend(patch.text for patch in patch_list.patches)
+        documents.append(document)
+
+    mismatches = check_equivalence(texts + [text for document in documents for text in document])
+    print(f'Mismatches: {mismatches}', file=sys.stderr)
+    results = {'mismatches': mismatches, 'stages': benchmark(documents, repeat)}
+    if output_path:
+        output_path.write_text(json.dumps(results, indent=2))
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--store', type=str, default=None,
+                        help='Existing store to benchmark on, a synthetic one is generated otherwise')
+    parser.add_argument('--fuzz-size', type=int, default=5000,
+                        help='Number of random patch texts to check equivalence on')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', type=str, default=None,
+                        help='File to save results as json')
+    args = parser.parse_args()
+    main(args.store and Path(args.store), args.fuzz_size, args.seed, args.repeat, args.output and Path(args.output))
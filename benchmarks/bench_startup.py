@@ -0,0 +1,71 @@
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from benchmarks.synthetic import write_store
+
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+IMPORTS = {
+    'import_patch_processor': 'import processing.patch_processor',
+    'import_selector': 'import processing.selector',
+    'import_process_patches': 'import process_patches',
+    'import_ray': 'import ray',
+    'resource_check': 'from processing.resources import ensure_nltk_resources; '
+                      'ensure_nltk_resources(["punkt", "crubadan"], offline=True)',
+}
+
+
+def time_command(command: List[str], cwd: Path, repeat: int) -> Dict[str, float]:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(REPO_DIR), os.environ.get('PYTHONPATH')])))
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=str(cwd), env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return {'median_seconds': statistics.median(timings), 'min_seconds': min(timings)}
+
+
+def main(repeat: int, docs: int, output_path: Optional[Path]):
+    """
+    Measures wall time of starting the pipeline: imports, resource checks and a run on a tiny synthetic store
+    with and without ray
+    """
+    results = {'python_startup': time_command([sys.executable, '-c', 'pass'], REPO_DIR, repeat)}
+    for name, code in IMPORTS.items():
+        results[name] = time_command([sys.executable, '-c', code], REPO_DIR, repeat)
+
+    with tempfile.TemporaryDirectory(prefix='bench-startup-') as work_dir:
+        work_dir = Path(work_dir)
+        write_store(work_dir / 'resources', docs, num_paragraphs=10, num_versions=3, edit_rate=0.01)
+        script = str(REPO_DIR / 'process_patches.py')
+        for name, workers, backend in [('tiny_run_serial', 1, 'serial'), ('tiny_run_ray', 2, 'ray')]:
+            results[name] = time_command([sys.executable, script, '--dataset', str(work_dir / 'dataset.tsv'),
+                                          '--offline', '--num-workers', str(workers), '--backend', backend,
+                                          '--selection-workers', '1'], work_dir, repeat)
+
+    for name, timing in results.items():
+        print(f'{name:>24}: {timing["median_seconds"]:7.3f}s', file=sys.stderr)
+    if output_path:
+        output_path.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of runs of every command, the median is reported')
+    parser.add_argument('--docs', type=int, default=2,
+                        help='Number of documents in the synthetic store of the tiny run')
+    parser.add_argument('--output', type=str, default=None,
+                        help='File to save results as json')
+    args = parser.parse_args()
+    main(args.repeat, args.docs, args.output and Path(args.output))
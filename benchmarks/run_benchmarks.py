@@ -0,0 +1,189 @@
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+import shutil
+import tempfile
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Tuple, Optional
+from diff_match_patch import diff_match_patch
+from nltk import sent_tokenize
+
+from cosmas.generated.cosmas_pb2 import PatchList
+from processing.patch import invert_patches
+from processing.patch_processor import group_similar_patches_by_timestamps_and_distance, sent_join, \
+    extract_multiple_diffs
+from processing.selector import select_sentence_pairs
+from processing.tools.latex2text import LatexMarkupProcessor
+from benchmarks.synthetic import write_store
+
+
+class StageTimer:
+    def __init__(self):
+        self.stages = OrderedDict()
+
+    def add(self, name: str, seconds: float, items: int):
+        stage = self.stages.setdefault(name, {'seconds': 0.0, 'items': 0})
+        stage['seconds'] += seconds
+        stage['items'] += items
+
+    def measure(self, name: str, func, *args, items: int = 1):
+        start = time.perf_counter()
+        result = func(*args)
+        self.add(name, time.perf_counter() - start, items)
+        return result
+
+    def results(self) -> Dict[str, dict]:
+        for stage in self.stages.values():
+            stage['items_per_sec'] = stage['items'] / stage['seconds'] if stage['seconds'] else None
+        return self.stages
+
+
+def read_documents(store_dir: Path) -> List[Tuple[str, List[bytes]]]:
+    documents = []
+    for doc_path in sorted((store_dir / 'content').iterdir()):
+        content = max(doc_path.iterdir(), key=lambda path: int(path.name)).read_text()
+        patch_files = sorted((store_dir / 'patches' / doc_path.name).iterdir(), key=lambda path: int(path.name))
+        documents.append((content, [path.read_bytes() for path in patch_files]))
+    return documents
+
+
+def run(store_dir: Path, selection: bool) -> Dict[str, dict]:
+    """
+    Times every stage of document processing separately on all documents of the store
+    """
+    timer = StageTimer()
+    patcher = diff_match_patch()
+    markup_processor = LatexMarkupProcessor()
+    documents = timer.measure('read', read_documents, store_dir)
+
+    sentence_pairs = []
+    end_to_end_start = time.perf_counter()
+    for content, patch_lists in documents:
+        patches = []
+        for data in patch_lists:
+            patch_list = PatchList()
+            timer.measure('protobuf_parse', patch_list.ParseFromString, data)
+            patches.extend(patch_list.patches)
+        patches.sort(key=lambda p: p.timestamp)
+
+        patch_objs, timestamps = [], []
+        for patch in patches:
+            new_patch_objs = timer.measure('patch_from_text', patcher.patch_fromText, patch.text)
+            patch_objs.extend(new_patch_objs)
+            timestamps.extend(patch.timestamp for _ in new_patch_objs)
+
+        inverted_patch_objs = timer.measure('inversion', invert_patches, patch_objs, items=len(patch_objs))
+        timestamps.reverse()
+        patch_groups = timer.measure('grouping', group_similar_patches_by_timestamps_and_distance,
+                                     inverted_patch_objs, timestamps, items=len(patch_objs))
+
+        text = content
+        for patch_group in patch_groups:
+            text_before = timer.measure('patch_apply', patcher.patch_apply, patch_group, text)[0]
+
+            clean_before = timer.measure('remove_markup', markup_processor.remove_markup, text_before)
+            clean_after = timer.measure('remove_markup', markup_processor.remove_markup, text)
+            timer.measure('sentence_split', lambda t: sent_join(sent_tokenize(' '.join(t.split()))), clean_after)
+            diffs = timer.measure('extraction', extract_multiple_diffs, clean_before, clean_after)
+            sentence_pairs.extend(diffs)
+            text = text_before
+
+    if selection:
+        timer.measure('selection', lambda pairs: select_sentence_pairs(
+            pairs, min_length=1, min_char_levenshtein=1, max_char_levenshtein=25, min_alpha_ratio=0.65
+        ), sentence_pairs, items=len(sentence_pairs))
+
+    results = timer.results()
+    versions = sum(len(patch_lists) for _, patch_lists in documents)
+    seconds = time.perf_counter() - end_to_end_start
+    results['end_to_end'] = {
+        'seconds': seconds,
+        'items': len(documents),
+        'items_per_sec': len(documents) / seconds,
+        'versions_per_sec': versions / seconds,
+        'sentence_pairs': len(sentence_pairs)
+    }
+    return results
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def compare(results: Dict[str, dict], baseline_path: Path, threshold: float) -> bool:
+    """
+    Prints the change of throughput of every stage against a baseline run, returns False on regressions
+    """
+    baseline = json.loads(baseline_path.read_text())['stages']
+    ok = True
+    for name, stage in results.items():
+        if name not in baseline or not baseline[name]['items_per_sec'] or not stage['items_per_sec']:
+            continue
+        ratio = stage['items_per_sec'] / baseline[name]['items_per_sec']
+        regression = ratio < 1 - threshold
+        ok = ok and not regression
+        print(f'{name:>16}: {ratio:6.2f}x{"  REGRESSION" if regression else ""}', file=sys.stderr)
+    return ok
+
+
+def main():
+    """
+    Runs all stages of the pipeline on a synthetic (or an existing) patch store and saves timings as json
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--store', type=str, default=None,
+                        help='Existing store to benchmark on, a synthetic one is generated otherwise')
+    parser.add_argument('--docs', type=int, default=10)
+    parser.add_argument('--paragraphs', type=int, default=30)
+    parser.add_argument('--versions', type=int, default=30)
+    parser.add_argument('--edit-rate', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-selection', action='store_true',
+                        help='Do not benchmark selection of sentence pairs')
+    parser.add_argument('--output', type=str, default='bench_output.json',
+                        help='File to save results to')
+    parser.add_argument('--compare', type=str, default=None,
+                        help='Results of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Relative throughput decrease that is reported as a regression')
+    args = parser.parse_args()
+
+    parameters = {'docs': args.docs, 'paragraphs': args.paragraphs, 'versions': args.versions,
+                  'edit_rate': args.edit_rate, 'seed': args.seed}
+    if args.store:
+        store_dir = Path(args.store)
+        parameters = {'store': args.store}
+    else:
+        store_dir = write_store(Path(tempfile.mkdtemp(prefix='synthetic-store-')), args.docs, args.paragraphs,
+                                args.versions, args.edit_rate, args.seed)
+
+    try:
+        results = run(store_dir, not args.no_selection)
+    finally:
+        if not args.store:
+            shutil.rmtree(store_dir)
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'parameters': parameters,
+        'stages': results
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2))
+    for name, stage in results.items():
+        print(f'{name:>16}: {stage["seconds"]:9.3f}s  {stage["items"]:8d} items', file=sys.stderr)
+
+    if args.compare and not compare(results, Path(args.compare), args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
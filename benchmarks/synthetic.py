@@ -0,0 +1,168 @@
+import random
+import argparse
+from pathlib import Path
+from typing import List, Tuple
+from diff_match_patch import diff_match_patch
+from cosmas.generated.cosmas_pb2 import Patch, PatchList, FileVersion, FileVersionInfo
+
+
+WORDS = (
+    'the of and to in is that for we this with are on as by be an model which method results data it from '
+    'can our these approach each using at show paper proposed set function value not also between two time '
+    'problem based case number first given where learning network training performance error than used new '
+    'section analysis distribution algorithm system order large small high low state space process sample'
+).split()
+
+PREAMBLE = '\\documentclass{article}\n\\usepackage{amsmath}\n\\usepackage{graphicx}\n\\begin{document}\n'
+POSTAMBLE = '\n\\bibliography{refs}\n\\end{document}\n'
+
+
+def generate_sentence(rng: random.Random) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(8, 30))]
+    if rng.random() < 0.15:
+        words.insert(rng.randrange(len(words)), f'${rng.choice("xyzab")}_{rng.randint(1, 9)}$')
+    if rng.random() < 0.1:
+        words.append(f'\\cite{{ref{rng.randint(1, 50)}}}')
+    if rng.random() < 0.1:
+        words.insert(rng.randrange(len(words)), f'\\textbf{{{rng.choice(WORDS)}}}')
+    return ' '.join(words).capitalize() + rng.choice('...?')
+
+
+def generate_paragraph(rng: random.Random) -> str:
+    paragraph = ' '.join(generate_sentence(rng) for _ in range(rng.randint(3, 8)))
+    if rng.random() < 0.2:
+        paragraph += '\n\\begin{equation}\n' + ' + '.join(rng.choice('xyzab') for _ in range(5)) + '\n\\end{equation}'
+    if rng.random() < 0.05:
+        paragraph += '\n\\begin{figure}\\includegraphics[width=\\linewidth]{fig.png}\\caption{' + \
+                     generate_sentence(rng) + '}\\end{figure}'
+    return paragraph
+
+
+def generate_document(rng: random.Random, num_paragraphs: int) -> str:
+    parts = []
+    for i in range(num_paragraphs):
+        if i % 5 == 0:
+            parts.append(f'\\section{{{rng.choice(WORDS).capitalize()} {rng.choice(WORDS)}}}')
+        parts.append(generate_paragraph(rng))
+    return PREAMBLE + '\n\n'.join(parts) + POSTAMBLE
+
+
+def edit_document(rng: random.Random, text: str, num_edits: int) -> str:
+    """
+    Applies word substitutions, insertions and deletions at random places of the text
+    """
+    words = text.split(' ')
+    for _ in range(num_edits):
+        i = rng.randrange(len(words))
+        action = rng.random()
+        if action < 0.5:
+            words[i] = rng.choice(WORDS)
+        elif action < 0.75:
+            words.insert(i, rng.choice(WORDS))
+        elif len(words) > 1:
+            del words[i]
+    return ' '.join(words)
+
+
+def generate_history(rng: random.Random, num_paragraphs: int, num_versions: int, edit_rate: float,
+                     start_timestamp: int = 1500000000000) -> Tuple[str, List[Tuple[int, List[Patch], str]]]:
+    """
+    Generates the latest content of a document and its versions as lists of patches with the content after them,
+    version timestamps are at least a minute apart while patches inside a version are a few seconds apart
+    """
+    patcher = diff_match_patch()
+    text = generate_document(rng, num_paragraphs)
+    timestamp = start_timestamp
+    versions = []
+
+    for _ in range(num_versions):
+        timestamp += rng.randint(60000, 3600000)
+        patches = []
+        for _ in range(rng.randint(1, 4)):
+            num_edits = max(1, int(len(text.split(' ')) * edit_rate * rng.random()))
+            new_text = edit_document(rng, text, num_edits)
+            patch_text = patcher.patch_toText(patcher.patch_make(text, new_text))
+            if patch_text:
+                timestamp += rng.randint(100, 5000)
+                patches.append(Patch(userId=f'user{rng.randint(1, 10)}', userName='synthetic',
+                                     text=patch_text, timestamp=timestamp))
+            text = new_text
+        versions.append((timestamp, patches, text))
+
+    return text, versions
+
+
+def write_store(store_dir: Path, num_docs: int, num_paragraphs: int, num_versions: int, edit_rate: float,
+                seed: int = 0, skew: float = None) -> Path:
+    """
+    Writes synthetic documents in the layout of load_patches.py: patches/<fileId>/<timestamp> and content/<fileId>/<timestamp>.
+    With skew the number of paragraphs of every document is num_paragraphs times a Pareto(skew) variate capped at 20,
+    smaller skew gives heavier tails.
+    """
+    rng = random.Random(seed)
+    for doc in range(num_docs):
+        file_id = f'synthetic{doc:06d}'
+        doc_paragraphs = num_paragraphs
+        if skew:
+            doc_paragraphs = int(num_paragraphs * min(rng.paretovariate(skew), 20))
+        content, versions = generate_history(rng, doc_paragraphs, num_versions, edit_rate)
+        for timestamp, patches, _ in versions:
+            path = store_dir / 'patches' / file_id / str(timestamp)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(PatchList(patches=patches).SerializeToString())
+        content_path = store_dir / 'content' / file_id / str(versions[-1][0])
+        content_path.parent.mkdir(parents=True, exist_ok=True)
+        content_path.write_text(content)
+    return store_dir
+
+
+def write_bucket(root: Path, bucket_name: str, num_docs: int, num_paragraphs: int, num_versions: int, edit_rate: float,
+                 seed: int = 0, history_window: int = 10) -> Path:
+    """
+    Writes synthetic documents as FileVersion generations of objects of a local bucket, see local_bucket.py,
+    every version lists up to history_window previous generations in historyWindow.
+    Uses the same random stream as write_store without skew, so loading the bucket gives the same store.
+    """
+    from local_bucket import LocalClient
+    bucket = LocalClient(root).create_bucket(bucket_name)
+    rng = random.Random(seed)
+    for doc in range(num_docs):
+        file_id = f'synthetic{doc:06d}'
+        _, versions = generate_history(rng, num_paragraphs, num_versions, edit_rate)
+        infos = []
+        for timestamp, patches, text in versions:
+            version = FileVersion(patches=patches, content=text.encode('utf-8'), timestamp=timestamp, fileId=file_id,
+                                  historyWindow=infos[-history_window:] if history_window else [])
+            blob = bucket.blob(file_id, generation=timestamp * 1000).upload_from_string(version.SerializeToString())
+            infos.append(FileVersionInfo(generation=blob.generation, timestamp=timestamp, fileId=file_id,
+                                         userName='synthetic'))
+    return root
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--store', type=str, default=None,
+                        help='Folder to write synthetic patches and content to')
+    parser.add_argument('--bucket-root', type=str, default=None,
+                        help='Folder of a local bucket to write synthetic versions to instead of a store')
+    parser.add_argument('--bucket-name', type=str, default='synthetic')
+    parser.add_argument('--history-window', type=int, default=10,
+                        help='Number of previous generations listed in every version of a bucket object')
+    parser.add_argument('--docs', type=int, default=20)
+    parser.add_argument('--paragraphs', type=int, default=30,
+                        help='Number of paragraphs in every document')
+    parser.add_argument('--versions', type=int, default=50,
+                        help='Number of versions of every document')
+    parser.add_argument('--edit-rate', type=float, default=0.01,
+                        help='Maximal share of words changed by one patch')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skew', type=float, default=None,
+                        help='Shape of the Pareto distribution of document sizes, equal sizes by default')
+    args = parser.parse_args()
+    if args.bucket_root:
+        write_bucket(Path(args.bucket_root), args.bucket_name, args.docs, args.paragraphs, args.versions,
+                     args.edit_rate, args.seed, args.history_window)
+    elif args.store:
+        write_store(Path(args.store), args.docs, args.paragraphs, args.versions, args.edit_rate, args.seed, args.skew)
+    else:
+        parser.error('either --store or --bucket-root is required')
@@ -1,20 +1,44 @@
 import argparse
+import psutil
 from pathlib import Path
-from processing.metrics import NGramPerplexityScorer
+from processing.metrics import NGramPerplexityScorer, CompactNGramPerplexityScorer
+from processing.metrics.ngram_store import fit_streaming
 
 
-def main(dataset_path: Path, model_path: Path, order: int):
+def main(dataset_path: Path, model_path: Path, order: int, from_pickle: Path = None,
+         num_workers: int = 1, chunk_size: int = 100000, tmp_dir: Path = None):
+    if from_pickle:
+        scorer = CompactNGramPerplexityScorer().from_laplace(NGramPerplexityScorer().load(from_pickle).model, order)
+        scorer.save(model_path)
+        return
+
+    if model_path.suffix == '.pkl':
+        with dataset_path.open('r') as inp:
+            sents = inp.readlines()
+        scorer = NGramPerplexityScorer()
+        scorer.fit(sents, order)
+        scorer.save(model_path)
+        return
+
     with dataset_path.open('r') as inp:
-        sents = inp.readlines()
-    scorer = NGramPerplexityScorer()
-    scorer.fit(sents, order)
-    scorer.save(model_path)
+        fit_streaming(inp, order, model_path, num_workers=num_workers, chunk_size=chunk_size, tmp_dir=tmp_dir)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--dataset-path', type=str)
     parser.add_argument('--order', type=int, default=5)
-    parser.add_argument('--model-path', type=str, default='resources/ppl_scorers/ngram_model.pkl')
+    parser.add_argument('--model-path', type=str, default='resources/ppl_scorers/ngram_model.ngram',
+                        help='Compact model is saved unless the path ends with .pkl')
+    parser.add_argument('--from-pickle', type=str, default=None,
+                        help='Convert a pickled nltk model instead of fitting a new one')
+    parser.add_argument('--num-workers', type=int, default=psutil.cpu_count(logical=True),
+                        help='Number of processes counting n-grams')
+    parser.add_argument('--chunk-size', type=int, default=100000,
+                        help='Number of lines counted by a worker at once')
+    parser.add_argument('--tmp-dir', type=str, default=None,
+                        help='Directory for partial counts')
     args = parser.parse_args()
-    main(Path(args.dataset_path), Path(args.model_path), args.order)
+    main(args.dataset_path and Path(args.dataset_path), Path(args.model_path), args.order,
+         args.from_pickle and Path(args.from_pickle), args.num_workers, args.chunk_size,
+         args.tmp_dir and Path(args.tmp_dir))
@@ -1,58 +1,82 @@
 import sys
 import re
 import json
+import shutil
 import argparse
+from multiprocessing import Pool
 from pathlib import Path
+from typing import Tuple
 from tqdm import tqdm
-from nltk import sent_tokenize
-
-
-def install_dependencies():
-    import ssl
-    try:
-        _create_unverified_https_context = ssl._create_unverified_context
-    except AttributeError:
-        pass
-    else:
-        ssl._create_default_https_context = _create_unverified_https_context
-    try:
-        import nltk
-        print('Installing nltk.punkt', file=sys.stderr)
-        nltk.download('punkt', raise_on_error=True)
-    except:
-        print('Unable to download some of dependencies, check your internet connection', file=sys.stderr)
-        return False
-
-
-def main(content_dir: Path, local_path: str):
+
+from processing.resources import ensure_nltk_resources
+
+
+QUOTE_REGEX = re.compile(r'[\'"`]')
+SENT_REGEX = re.compile(r'^[A-Z][a-zA-Z!@#№*()\[\]{}\-_+=;:\',.<>?/ ]*[.?!;]$')
+
+
+def process_shard(paths: Tuple[Path, Path]) -> Path:
     """
-    Prepares wiki dataset from the output of WikiExtractor
+    Extracts sentences from one WikiExtractor output file, the result appears at shard_path only when complete
     """
-    quote_regex = re.compile(r'[\'"`]')
-    sent_regex = re.compile(r'^[A-Z][a-zA-Z!@#№*()\[\]{}\-_+=;:\',.<>?/ ]*[.?!;]$')
+    from nltk import sent_tokenize
+    source_file, shard_path = paths
+    tmp_path = shard_path.with_name(shard_path.name + '.tmp')
 
-    with Path(local_path).open('w') as outp:
-        for i, source_file in enumerate(tqdm(content_dir.rglob('*'))):
-            if not source_file.is_file():
+    with source_file.open('r') as src, tmp_path.open('w') as outp:
+        for line in src:
+            if not line.strip():
                 continue
-            with source_file.open('r') as src:
-                for line in src.readlines():
-                    if not line:
-                        continue
-                    content = json.loads(line)
-                    text = content['text']
+            content = json.loads(line)
+            text = content['text']
+
+            for sent in sent_tokenize(text):
+                sent = sent.strip()
+                sent = QUOTE_REGEX.sub(r'\'', sent)
+                if len(sent) >= 20 and SENT_REGEX.fullmatch(sent):
+                    print(sent, file=outp)
+
+    tmp_path.rename(shard_path)
+    return shard_path
 
-                    for sent in sent_tokenize(text):
-                        sent = sent.strip()
-                        sent = quote_regex.sub(r'\'', sent)
-                        if len(sent) >= 20 and sent_regex.fullmatch(sent):
-                            print(sent, file=outp)
+
+def main(content_dir: Path, local_path: str, num_workers: int = 1, shards_dir: str = None):
+    """
+    Prepares wiki dataset from the output of WikiExtractor, run from the repository root as python -m helpers.prepare_wiki.
+    Every source file is processed into its own shard, shards that already exist are not processed again,
+    so an interrupted run can be resumed. Shards are concatenated into local_path at the end.
+    """
+    shards_dir = Path(shards_dir) if shards_dir else Path(local_path + '.shards')
+    shards_dir.mkdir(parents=True, exist_ok=True)
+
+    source_files = sorted(path for path in content_dir.rglob('*') if path.is_file())
+    shard_paths = [shards_dir / '__'.join(path.relative_to(content_dir).parts) for path in source_files]
+
+    tasks = [(source_file, shard_path) for source_file, shard_path in zip(source_files, shard_paths)
+             if not shard_path.exists()]
+    print(f'{len(source_files) - len(tasks)} of {len(source_files)} shards are already prepared', file=sys.stderr)
+
+    with Pool(num_workers) as pool:
+        for _ in tqdm(pool.imap_unordered(process_shard, tasks), total=len(tasks)):
+            pass
+
+    with Path(local_path).open('w') as outp:
+        for shard_path in shard_paths:
+            with shard_path.open('r') as shard:
+                shutil.copyfileobj(shard, outp)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--content-dir', type=str, default='/home/eranik/wiki/en_wiki_json/')
     parser.add_argument('--local-path', type=str, default='/home/eranik/wiki/en_wiki.txt')
+    parser.add_argument('--num-workers', type=int, default=1,
+                        help='Number of processes preparing shards')
+    parser.add_argument('--shards-dir', type=str, default=None,
+                        help='Directory for per-shard outputs, <local-path>.shards by default')
+    parser.add_argument('--offline', action='store_true',
+                        help='Never download nltk resources, fail if some of them are missing')
     args = parser.parse_args()
-    install_dependencies()
-    main(Path(args.content_dir), args.local_path)
+    if not ensure_nltk_resources(['punkt'], offline=args.offline) and args.offline:
+        sys.exit(1)
+    main(Path(args.content_dir), args.local_path, args.num_workers, args.shards_dir)
@@ -3,10 +3,16 @@ import argparse
 import logging
 from pathlib import Path
 from datetime import datetime
-from typing import List, Optional
-from google.cloud.storage import Client, Blob, Bucket
-from google.cloud.exceptions import NotFound
-from cosmas.generated.cosmas_pb2 import FileVersion, PatchList
+from typing import Iterator, List, NamedTuple, Optional
+from cosmas.generated.cosmas_pb2 import FileVersion, PatchList, Patch
+from processing.instrumentation import metrics
+
+try:
+    from google.cloud.storage import Client, Blob, Bucket
+    from google.cloud.exceptions import NotFound
+except ImportError:
+    Client = Blob = Bucket = None
+    NotFound = ()
 
 
 def get_write_method(logger):
@@ -35,18 +41,39 @@ def set_log_handler(logger: logging.Logger, file_name: str) -> None:
     logger.flush = lambda: None
 
 
+class DocumentUpdate(NamedTuple):
+    """
+    Content of the latest version of an object and patches of its versions that are not in the store yet
+    """
+    file_id: str
+    object_name: str
+    content: str
+    patches: List[Patch]
+
+
 class BucketLoader:
     DEFAULT_LOG_FOLDER = Path('logs')
 
     def __init__(self,
                  project_name: str,
                  bucket_name: str,
-                 download_folder: str):
+                 download_folder: str,
+                 client=None,
+                 use_history_window: bool = True):
         self.project_name = project_name
         self.bucket_name = bucket_name
         self.download_folder = Path(download_folder)
+        self.client = client
+        self.use_history_window = use_history_window
         self.logger = logging.getLogger('BucketLoader')
 
+    def _get_client(self):
+        if self.client is None:
+            if Client is None:
+                raise ImportError('google-cloud-storage is required to load patches from a bucket')
+            self.client = Client(project=self.project_name)
+        return self.client
+
     def _get_bucket(self, client: Client) -> Optional[Bucket]:
         try:
             return client.get_bucket(bucket_or_name=self.bucket_name)
@@ -85,19 +112,104 @@ class BucketLoader:
             self._store_data(self._get_version_path(version), patch_list.SerializeToString())
         self._store_data(self._get_content_path(versions[-1]), versions[-1].content)
 
-    def load(self, continue_from_blob: Optional[str] = None) -> bool:
-        current_date = datetime.now().strftime('%Y.%m.%d %H.%M.%S')
-        file_name = f'loader {current_date}.log'
-        set_log_handler(logger=self.logger, file_name=file_name)
+    def _stored_timestamps(self, file_id: str) -> List[int]:
+        patches_dir = self.download_folder / 'patches' / file_id
+        if not patches_dir.is_dir():
+            return []
+        return [int(path.name) for path in patches_dir.iterdir() if path.is_file()]
 
-        client = Client(project=self.project_name)
-        self.logger.info(f'Created client for project {self.project_name}')
+    def _list_versions(self, client: Client, bucket: Bucket, last_blob: Blob) -> List[FileVersion]:
+        versions = []
+        for blob in client.list_blobs(bucket, prefix=last_blob.name, versions=True):
+            if blob.name != last_blob.name:
+                continue
+            self.logger.info(blob.name)
+            file_version = self._parse_version(blob)
+            metrics.inc('loader_downloads')
+            object_path = self._get_version_path(file_version)
+            self.logger.info(
+                f'fileId={file_version.fileId}, timestamp={file_version.timestamp}, object_path={object_path}')
+            versions.append(file_version)
+        return versions
+
+    def _plan_from_window(self, bucket: Bucket, last_blob: Blob, last_version: FileVersion) \
+            -> Optional[List[FileVersion]]:
+        """
+        Downloads by generation the versions from historyWindow of the latest version that are newer than the stored ones,
+        and the latest stored one, which is stored again like _list_versions does as it could have been damaged.
+        Returns None when nothing is stored or the window does not include the latest stored version,
+        then all generations have to be listed.
+        """
+        stored = self._stored_timestamps(str(last_version.fileId))
+        if not stored:
+            return None
+        latest_stored = max(stored)
+        window = [info for info in last_version.historyWindow if info.timestamp < last_version.timestamp]
+        if not any(info.timestamp == latest_stored for info in window):
+            self.logger.info(f'History window of {last_blob.name} does not include the stored version {latest_stored}')
+            return None
 
-        bucket = self._get_bucket(client)
-        if not bucket:
-            return False
-        self.logger.info(f'Found bucket {self.bucket_name}')
+        versions = [last_version]
+        for info in window:
+            if info.timestamp < latest_stored:
+                continue
+            version = self._parse_version(bucket.blob(last_blob.name, generation=info.generation))
+            metrics.inc('loader_downloads')
+            self.logger.info(f'fileId={version.fileId}, timestamp={version.timestamp}, generation={info.generation}')
+            versions.append(version)
+        metrics.inc('loader_window_plans')
+        return versions
+
+    def _load_object(self, client: Client, bucket: Bucket, last_blob: Blob, persist: bool) -> Optional[DocumentUpdate]:
+        """
+        Downloads versions of an object that are newer than the stored ones,
+        returns None if the store already has the latest version
+        """
+        last_version = self._parse_version(last_blob)
+        metrics.inc('loader_downloads')
+        object_path = self._get_version_path(last_version)
+        if object_path.exists():
+            self.logger.info('No new versions found')
+            return None
 
+        versions = None
+        if self.use_history_window:
+            versions = self._plan_from_window(bucket, last_blob, last_version)
+        if versions is None:
+            metrics.inc('loader_listings')
+            versions = self._list_versions(client, bucket, last_blob)
+
+        new_versions = 0
+        versions_to_load = []
+        for version in sorted(versions, key=lambda v: -v.timestamp):
+            object_path = self._get_version_path(version)
+            new_versions += not object_path.exists()
+            versions_to_load.append(version)
+            if object_path.exists():
+                break
+        self.logger.info(f'{new_versions} new versions of object {last_blob.name} found')
+        if not versions_to_load:
+            return None
+
+        if persist:
+            """
+            We also load the last version among those that are already loaded as it could have been damaged.
+            For example, due to an unexpected interrupt of a loader script.
+            """
+            for version in reversed(versions_to_load):
+                object_path = self._get_version_path(version)
+                patch_list = PatchList(patches=version.patches)
+                self._store_data(object_path, patch_list.SerializeToString())
+            self._store_data(self._get_content_path(versions_to_load[0]), versions_to_load[0].content)
+
+        patches = [patch for version in versions_to_load[:new_versions] for patch in version.patches]
+        patches.sort(key=lambda p: p.timestamp)
+        latest = versions_to_load[0]
+        return DocumentUpdate(file_id=str(latest.fileId), object_name=last_blob.name,
+                              content=latest.content.decode('utf-8'), patches=patches)
+
+    def _iter_objects(self, client: Client, bucket: Bucket, continue_from_blob: Optional[str],
+                      persist: bool) -> Iterator[DocumentUpdate]:
         for last_blob in client.list_blobs(bucket, versions=False):
             last_blob: Blob
 
@@ -106,54 +218,64 @@ class BucketLoader:
 
             self.logger.info(f'Downloading versions of object {last_blob.name}')
             try:
-                last_version = self._parse_version(last_blob)
-                object_path = self._get_version_path(last_version)
-                if object_path.exists():
-                    self.logger.info('No new versions found')
-                    continue
-
-                versions = []
-                for blob in client.list_blobs(bucket, prefix=last_blob.name, versions=True):
-                    self.logger.info(blob.name)
-                    file_version = self._parse_version(blob)
-                    object_path = self._get_version_path(file_version)
-                    self.logger.info(
-                        f'fileId={file_version.fileId}, timestamp={file_version.timestamp}, object_path={object_path}')
-                    versions.append(file_version)
-
-                new_versions = 0
-                versions_to_load = []
-                for version in sorted(versions, key=lambda v: -v.timestamp):
-                    object_path = self._get_version_path(version)
-                    new_versions += not object_path.exists()
-                    versions_to_load.append(version)
-                    if object_path.exists():
-                        break
-
-                """
-                We also load the last version among those that are already loaded as it could have been damaged.
-                For example, due to an unexpected interrupt of a loader script.
-                """
-                for version in reversed(versions_to_load):
-                    object_path = self._get_version_path(version)
-                    patch_list = PatchList(patches=version.patches)
-                    self._store_data(object_path, patch_list.SerializeToString())
-
-                if versions_to_load:
-                    self._store_data(self._get_content_path(versions_to_load[0]), versions_to_load[0].content)
-
-                self.logger.info(f'{new_versions} new versions of object {last_blob.name} found')
-
+                update = self._load_object(client, bucket, last_blob, persist)
             except Exception as error:
                 self.logger.error(f'An unexpected error occurred while downloading objects '
                                   f'from bucket {bucket.name}: {error}')
+                continue
+            if update is not None:
+                yield update
+
+    def iter_updates(self, continue_from_blob: Optional[str] = None, persist: bool = True) -> Iterator[DocumentUpdate]:
+        """
+        Streams new versions of every object of the bucket as parsed documents without reading them back from disk.
+        The store decides which versions are new, with persist they are also saved to it as load does,
+        so the next run only yields later versions.
+        """
+        client = self._get_client()
+        bucket = self._get_bucket(client)
+        if not bucket:
+            raise LookupError(f'Bucket {self.bucket_name} not found')
+        self.logger.info(f'Found bucket {self.bucket_name}')
+        yield from self._iter_objects(client, bucket, continue_from_blob, persist)
+
+    def load(self, continue_from_blob: Optional[str] = None) -> bool:
+        current_date = datetime.now().strftime('%Y.%m.%d %H.%M.%S')
+        file_name = f'loader {current_date}.log'
+        set_log_handler(logger=self.logger, file_name=file_name)
+
+        client = self._get_client()
+        self.logger.info(f'Created client for project {self.project_name}')
+
+        bucket = self._get_bucket(client)
+        if not bucket:
+            return False
+        self.logger.info(f'Found bucket {self.bucket_name}')
+
+        for _ in self._iter_objects(client, bucket, continue_from_blob, persist=True):
+            pass
 
         return True
 
 
-def main():
-    default_download_folder = str(Path('resources'))
+def create_loader(config: dict) -> BucketLoader:
+    """
+    Loader for the bucket of a config, local_bucket_root serves the bucket from a folder instead of Cloud Storage
+    """
+    client = None
+    if config.get('local_bucket_root'):
+        from local_bucket import LocalClient
+        client = LocalClient(Path(config['local_bucket_root']), project=config.get('project_name'))
+    return BucketLoader(
+        project_name=config.get('project_name'),
+        bucket_name=config.get('bucket_name'),
+        download_folder=config.get('download_folder', str(Path('resources'))),
+        client=client,
+        use_history_window=config.get('use_history_window', True)
+    )
 
+
+def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--config', type=str, default='config.json')
     parser.add_argument('--continue-from-blob', help='blod id to continue from', type=str, default=None)
@@ -161,11 +283,7 @@ def main():
 
     config = json.loads(Path(args.config).read_bytes())
 
-    loader = BucketLoader(
-        project_name=config.get('project_name'),
-        bucket_name=config.get('bucket_name'),
-        download_folder=config.get('download_folder', default_download_folder)
-    )
+    loader = create_loader(config)
     loader.load(args.continue_from_blob)
 
 
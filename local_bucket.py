@@ -0,0 +1,106 @@
+from collections import Counter
+from pathlib import Path
+from urllib.parse import quote, unquote
+from typing import Iterator, Optional
+
+
+class LocalBlob:
+    """
+    One generation of an object of a LocalBucket, mirrors the part of google.cloud.storage.Blob used by BucketLoader
+    """
+
+    def __init__(self, name: str, bucket: 'LocalBucket', generation: Optional[int] = None):
+        self.name = name
+        self.bucket = bucket
+        self.generation = generation
+
+    def _path(self) -> Path:
+        generation = self.generation
+        if generation is None:
+            generation = max(self.bucket.generations(self.name))
+        return self.bucket.object_dir(self.name) / str(generation)
+
+    def download_as_string(self) -> bytes:
+        self.bucket.requests['download'] += 1
+        return self._path().read_bytes()
+
+    def upload_from_string(self, data: bytes) -> 'LocalBlob':
+        """
+        Saves data as a new generation of the object, generations only grow like in a versioned bucket
+        """
+        object_dir = self.bucket.object_dir(self.name)
+        object_dir.mkdir(parents=True, exist_ok=True)
+        generations = self.bucket.generations(self.name)
+        if self.generation is None:
+            self.generation = max(generations, default=0) + 1
+        elif generations and self.generation <= max(generations):
+            raise ValueError(f'generation {self.generation} of {self.name} is not newer than {max(generations)}')
+        (object_dir / str(self.generation)).write_bytes(data)
+        return self
+
+
+class LocalBucket:
+    """
+    Versioned bucket kept in a folder as <root>/<bucket>/<quoted object name>/<generation>
+    """
+
+    def __init__(self, root: Path, name: str, requests: Counter = None):
+        self.root = Path(root)
+        self.name = name
+        self.requests = requests if requests is not None else Counter()
+
+    @property
+    def path(self) -> Path:
+        return self.root / self.name
+
+    def object_dir(self, name: str) -> Path:
+        return self.path / quote(name, safe='')
+
+    def generations(self, name: str) -> list:
+        object_dir = self.object_dir(name)
+        if not object_dir.is_dir():
+            return []
+        return sorted(int(path.name) for path in object_dir.iterdir() if path.is_file())
+
+    def blob(self, blob_name: str, generation: Optional[int] = None) -> LocalBlob:
+        return LocalBlob(blob_name, self, generation)
+
+
+class LocalClient:
+    """
+    Stand-in for google.cloud.storage.Client that serves buckets from local folders, for tests and benchmarks.
+    Counts list and download requests like the ones Cloud Storage bills for.
+    """
+
+    def __init__(self, root: Path, project: Optional[str] = None):
+        self.root = Path(root)
+        self.project = project
+        self.requests = Counter()
+
+    def get_bucket(self, bucket_or_name) -> LocalBucket:
+        name = bucket_or_name.name if isinstance(bucket_or_name, LocalBucket) else bucket_or_name
+        bucket = LocalBucket(self.root, name, self.requests)
+        if not bucket.path.is_dir():
+            raise FileNotFoundError(f'Bucket {name} not found in {self.root}')
+        return bucket
+
+    def create_bucket(self, bucket_name: str) -> LocalBucket:
+        bucket = LocalBucket(self.root, bucket_name, self.requests)
+        bucket.path.mkdir(parents=True, exist_ok=True)
+        return bucket
+
+    def list_blobs(self, bucket_or_name, prefix: Optional[str] = None, versions: bool = False) -> Iterator[LocalBlob]:
+        """
+        Objects in lexicographical order of names, every generation of them with versions or the latest one otherwise
+        """
+        bucket = self.get_bucket(bucket_or_name)
+        self.requests['list'] += 1
+        names = sorted(unquote(path.name) for path in bucket.path.iterdir() if path.is_dir())
+        for name in names:
+            if prefix and not name.startswith(prefix):
+                continue
+            generations = bucket.generations(name)
+            if not generations:
+                continue
+            for generation in (generations if versions else generations[-1:]):
+                yield LocalBlob(name, bucket, generation)
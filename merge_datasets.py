@@ -0,0 +1,60 @@
+import sys
+import argparse
+from pathlib import Path
+from typing import List
+import pandas as pd
+
+from processing.sharding import shard_info_path, read_shard_info
+
+
+def order_shards(dataset_paths: List[Path]) -> List[Path]:
+    """
+    Sorts shard datasets by shard index and checks that every shard of the same split of the same snapshot
+    of the store is present exactly once
+    """
+    missing = [str(path) for path in dataset_paths if not shard_info_path(path).exists()]
+    if missing:
+        raise ValueError(f'datasets have no shard info: {missing}')
+
+    infos = {path: read_shard_info(path) for path in dataset_paths}
+    snapshots = {info.get('snapshot') for info in infos.values()}
+    if len(snapshots) != 1:
+        raise ValueError(f'datasets come from different snapshots of the store: {sorted(map(str, snapshots))}')
+    shard_counts = {info['shard_count'] for info in infos.values()}
+    if len(shard_counts) != 1:
+        raise ValueError(f'datasets come from different splits: shard counts {sorted(shard_counts)}')
+    shard_count = shard_counts.pop()
+    indices = sorted(info['shard_index'] for info in infos.values())
+    if indices != list(range(shard_count)):
+        raise ValueError(f'expected shards 0..{shard_count - 1} exactly once, got {indices}')
+    return sorted(dataset_paths, key=lambda path: infos[path]['shard_index'])
+
+
+def main(dataset_paths: List[Path], output_path: Path, chunk_size: int):
+    """
+    Concatenates datasets of all shards in the order of shard indices and numbers sentence pairs from zero
+    """
+    next_id = 0
+    header = True
+    with output_path.open('w') as outp:
+        for path in order_shards(dataset_paths):
+            for chunk in pd.read_csv(path, sep='\t', keep_default_na=False, chunksize=chunk_size):
+                chunk['sent_id'] = range(next_id, next_id + len(chunk))
+                next_id += len(chunk)
+                chunk.to_csv(outp, sep='\t', index=False, header=header)
+                header = False
+            print(f'{path}: done, {next_id} sentence pairs in total', file=sys.stderr)
+    if header:
+        pd.DataFrame(columns=['sent_id', 'original_sent', 'edited_sent']).to_csv(output_path, sep='\t', index=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('datasets', type=str, nargs='+',
+                        help='Datasets produced by process_patches.py with --shard-index/--shard-count')
+    parser.add_argument('--output', type=str, required=True,
+                        help='File to save the merged dataset')
+    parser.add_argument('--chunk-size', type=int, default=100000,
+                        help='Number of rows read at once')
+    args = parser.parse_args()
+    main([Path(path) for path in args.datasets], Path(args.output), args.chunk_size)
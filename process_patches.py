@@ -1,32 +1,24 @@
 import sys
+import json
 import psutil
-import numpy as np
-import pandas as pd
 from dataclasses import dataclass
 from argparse import ArgumentParser
 from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from cosmas.generated.cosmas_pb2 import PatchList
-from processing.patch_processor import SimplePatchProcessor, AdvancedPatchProcessor
-from processing.selector import select_sentence_pairs
+from processing.patch_processor import SimplePatchProcessor, AdvancedPatchProcessor, EXTRACTORS
+from processing.metrics import load_perplexity_scorer
+from processing.selector import select_sentence_pairs, measure_sentence_pairs, PairFilter
+from processing.instrumentation import metrics, MetricsExporter, Profiler
+from processing.resources import ensure_nltk_resources
+from processing.executors import BACKENDS
+from processing.sharding import shard_doc_ids, store_snapshot, write_shard_info
+from processing.ingest import prefetch
+from processing.memory import MemoryGovernor, parse_size
+from processing.dedup import Deduplicator, DocumentDeduplicator
 
 
-def install_dependencies():
-    import ssl
-    try:
-        _create_unverified_https_context = ssl._create_unverified_context
-    except AttributeError:
-        pass
-    else:
-        ssl._create_default_https_context = _create_unverified_https_context
-    try:
-        import nltk
-        print('Installing nltk.punkt', file=sys.stderr)
-        nltk.download('punkt', raise_on_error=True)
-        print('Installing nltk.crubadan', file=sys.stderr)
-        nltk.download('crubadan', raise_on_error=True)
-    except:
-        print('Unable to download some of dependencies, check your internet connection', file=sys.stderr)
-        return False
+SENT_REGEX = r'^[a-zA-Z][a-zA-Z@#№_();:\'"<>,.?!\s=*/+-]+[.?!;]$'
 
 
 @dataclass
@@ -36,6 +28,32 @@ class Parameters:
     min_edit_distance: int = 1
     max_edit_distance: int = None
     min_alpha_ratio: float = 0.65
+    perplexity_model: Path = None
+    selection_workers: int = None
+    prefilter: bool = True
+    spill_dir: Path = None
+    metrics_file: Path = None
+    metrics_format: str = 'json'
+    metrics_interval: float = 30.0
+    profile_dir: Path = None
+    num_workers: int = None
+    backend: str = None
+    scheduling: str = 'least-loaded'
+    extractor: str = 'multiple'
+    shard_index: int = 0
+    shard_count: int = 1
+    from_bucket: Path = None
+    persist: bool = False
+    queue_size: int = 16
+    memory_budget: int = None
+    dedup: bool = True
+    near_dedup: bool = False
+    near_dedup_threshold: float = 0.8
+    dedup_max_items: int = 1000000
+    doc_dedup: bool = False
+    doc_dedup_threshold: float = 0.5
+    doc_dedup_report: Path = None
+    metrics_table: Path = None
 
     def __init__(self, arguments):
         self.min_length = arguments.min_length
@@ -43,65 +61,252 @@ class Parameters:
         self.min_edit_distance = arguments.min_edit_dist
         self.max_edit_distance = arguments.max_edit_dist
         self.min_alpha_ratio = arguments.min_alpha_ratio
+        self.perplexity_model = arguments.perplexity_model and Path(arguments.perplexity_model)
+        self.selection_workers = arguments.selection_workers
+        self.prefilter = not arguments.no_prefilter
+        self.spill_dir = arguments.spill_dir and Path(arguments.spill_dir)
+        self.metrics_file = arguments.metrics_file and Path(arguments.metrics_file)
+        self.metrics_format = arguments.metrics_format
+        self.metrics_interval = arguments.metrics_interval
+        self.profile_dir = arguments.profile_dir and Path(arguments.profile_dir)
+        self.num_workers = arguments.num_workers
+        self.backend = arguments.backend
+        self.scheduling = arguments.scheduling
+        self.extractor = arguments.extractor
+        self.shard_index = arguments.shard_index
+        self.shard_count = arguments.shard_count
+        if not 0 <= self.shard_index < self.shard_count:
+            raise ValueError(f'shard index must be in [0, {self.shard_count}), got {self.shard_index}')
+        self.from_bucket = arguments.from_bucket and Path(arguments.from_bucket)
+        self.persist = arguments.persist
+        self.queue_size = arguments.queue_size
+        self.memory_budget = arguments.memory_budget and parse_size(arguments.memory_budget)
+        self.dedup = not arguments.no_dedup
+        self.near_dedup = arguments.near_dedup
+        self.near_dedup_threshold = arguments.near_dedup_threshold
+        self.dedup_max_items = arguments.dedup_max_items
+        self.doc_dedup = arguments.doc_dedup
+        self.doc_dedup_threshold = arguments.doc_dedup_threshold
+        self.doc_dedup_report = arguments.doc_dedup_report and Path(arguments.doc_dedup_report)
+        if self.doc_dedup and self.from_bucket:
+            raise ValueError('documents streamed from a bucket can not be deduplicated before processing')
+        self.metrics_table = arguments.metrics_table and Path(arguments.metrics_table)
+        if self.metrics_table:
+            # the table has to keep pairs that looser thresholds of a sweep would select
+            self.prefilter = False
+        if self.from_bucket and self.shard_count > 1:
+            raise ValueError('documents streamed from a bucket can not be split into shards')
+        if self.persist and not self.from_bucket:
+            raise ValueError('--persist only applies to documents streamed with --from-bucket')
 
 
-def main(dataset_path: Path, parameters: Parameters):
-    content_dir = Path('resources', 'content')
-    patches_dir = Path('resources', 'patches')
+def iter_document_versions(content_dir: Path, patches_dir: Path, doc_id: str) -> Iterator[Tuple[Path, list]]:
+    """
+    Yields the content file of every saved version of a document with patches made since the previous one,
+    sorted by timestamp
+    """
+    doc_path = content_dir / doc_id
+    patches_path = patches_dir / doc_id
+
+    doc_iter = filter(lambda doc: doc.is_file(), doc_path.rglob('*'))
+    doc_iter = sorted(doc_iter, key=lambda doc: int(doc.name))
 
-    num_cpus = psutil.cpu_count(logical=True)
-    print(f'num_cpus={num_cpus}', file=sys.stderr)
-    processor = AdvancedPatchProcessor(num_cpus=num_cpus)
+    patches_iter = filter(lambda patch: patch.is_file(), patches_path.rglob('*'))
+    patches_iter = sorted(patches_iter, key=lambda patch: int(patch.name))
+    patches_iter = iter(patches_iter)
 
-    for doc_id in content_dir.iterdir():
-        doc_id = doc_id.name
+    for doc in doc_iter:
+        patches = []
+        for patch in patches_iter:
+            data = patch.read_bytes()
+            metrics.inc('patch_files')
+            metrics.inc('patch_file_bytes', len(data))
+            patch_list = PatchList()
+            patch_list.ParseFromString(data)
+            patches.extend(patch_list.patches)
+            if patch.name == doc.name:
+                break
 
-        doc_path = content_dir / doc_id
-        patches_path = patches_dir / doc_id
+        patches.sort(key=lambda p: p.timestamp)
+        yield doc, patches
 
-        doc_iter = filter(lambda doc: doc.is_file(), doc_path.rglob('*'))
-        doc_iter = sorted(doc_iter, key=lambda doc: int(doc.name))
 
-        patches_iter = filter(lambda patch: patch.is_file(), patches_path.rglob('*'))
-        patches_iter = sorted(patches_iter, key=lambda patch: int(patch.name))
-        patches_iter = iter(patches_iter)
+def iter_store_documents(content_dir: Path, patches_dir: Path, doc_ids: Iterable[str],
+                         skip_patches: Dict[str, int] = None) -> Iterator[Tuple[str, list]]:
+    """
+    Yields every saved version of every document with patches made since the previous version, sorted by timestamp.
+    The oldest skip_patches[doc_id] patches of a document are left out, versions made only of them are not yielded.
+    """
+    for doc_id in doc_ids:
+        skip = (skip_patches or {}).get(doc_id, 0)
+        for doc, patches in iter_document_versions(content_dir, patches_dir, doc_id):
+            dropped = min(skip, len(patches))
+            if dropped:
+                skip -= dropped
+                patches = patches[dropped:]
+                metrics.inc('patches_skipped_shared', dropped)
+                if not patches:
+                    continue
+            metrics.inc('versions')
+            yield doc.read_text(), patches
 
-        for doc in doc_iter:
-            content = doc.read_text()
 
-            patches = []
-            for patch in patches_iter:
-                patch_list = PatchList()
-                patch_list.ParseFromString(patch.read_bytes())
-                patches.extend(patch_list.patches)
-                if patch.name == doc.name:
-                    break
+def plan_document_dedup(content_dir: Path, patches_dir: Path, doc_ids: List[str], threshold: float,
+                        report_path: Path = None) -> Dict[str, int]:
+    """
+    Pre-pass over the store that finds documents copied from earlier ones, like forks and projects made from
+    the same template. Returns the number of oldest patches every document shares with an earlier one.
+    """
+    deduplicator = DocumentDeduplicator(threshold=threshold)
+    plans = []
+    with metrics.timer('document_dedup'):
+        for doc_id in doc_ids:
+            latest, patches = None, []
+            for doc, version_patches in iter_document_versions(content_dir, patches_dir, doc_id):
+                latest = doc
+                patches.extend(version_patches)
+            if latest is None:
+                continue
+            plan = deduplicator.add(doc_id, latest.read_text(), patches)
+            if plan.shared_patches:
+                plans.append(plan)
+            if plan.skipped:
+                print(f'{doc_id}: skipped, whole history is shared with {plan.source}', file=sys.stderr)
 
-            patches.sort(key=lambda p: p.timestamp)
-            processor.process_patches(content, patches)
+    groups = deduplicator.groups()
+    skipped = sum(plan.skipped for plan in plans)
+    shared = sum(plan.shared_patches for plan in plans)
+    total = sum(map(len, deduplicator.histories))
+    metrics.inc('documents_skipped_copies', skipped)
+    metrics.inc('documents_shared_history', len(plans) - skipped)
+    print(f'Document dedup: {len(groups)} groups of copies, {skipped} documents skipped, '
+          f'{len(plans) - skipped} replayed partially, {shared} of {total} patches shared', file=sys.stderr)
+    if report_path:
+        report = {'groups': groups, 'documents': [plan._asdict() for plan in plans]}
+        report_path.write_text(json.dumps(report, indent=2))
+    return {plan.doc_id: plan.shared_patches for plan in plans}
 
-    sentence_pairs = list(processor.get_diffs())
+
+def iter_bucket_documents(config_path: Path, persist: bool, queue_size: int) -> Iterator[Tuple[str, list]]:
+    """
+    Yields the latest content of every changed object of the bucket of a load_patches.py config
+    with patches of its new versions. Downloads run ahead of processing by at most queue_size documents.
+    """
+    from load_patches import create_loader
+    loader = create_loader(json.loads(config_path.read_bytes()))
+    for update in prefetch(loader.iter_updates(persist=persist), queue_size):
+        metrics.inc('versions')
+        metrics.inc('bucket_patches', len(update.patches))
+        yield update.content, update.patches
+
+
+def main(dataset_path: Path, parameters: Parameters):
+    content_dir = Path('resources', 'content')
+    patches_dir = Path('resources', 'patches')
+
+    num_cpus = parameters.num_workers or psutil.cpu_count(logical=True)
+    backend = parameters.backend or ('ray' if num_cpus > 1 else 'serial')
+    print(f'num_cpus={num_cpus}, backend={backend}', file=sys.stderr)
+
+    pair_filter = None
+    if parameters.prefilter:
+        pair_filter = PairFilter(
+            sent_regex=SENT_REGEX,
+            min_length=parameters.min_length,
+            max_length=parameters.max_length,
+            min_alpha_ratio=parameters.min_alpha_ratio,
+            drop_identical=bool(parameters.min_edit_distance and parameters.min_edit_distance > 0)
+        )
+    memory_governor = None
+    if parameters.memory_budget:
+        memory_governor = MemoryGovernor(parameters.memory_budget, num_cpus)
+    processor = AdvancedPatchProcessor(num_cpus=num_cpus, pair_filter=pair_filter, spill_dir=parameters.spill_dir,
+                                       profile_dir=parameters.profile_dir, backend=backend,
+                                       scheduling=parameters.scheduling, memory_governor=memory_governor,
+                                       extractor=parameters.extractor)
+
+    if parameters.from_bucket:
+        print(f'Streaming documents from the bucket of {parameters.from_bucket}', file=sys.stderr)
+        doc_ids, snapshot = [], None
+        documents = iter_bucket_documents(parameters.from_bucket, parameters.persist, parameters.queue_size)
+    else:
+        doc_ids = shard_doc_ids(content_dir, patches_dir, parameters.shard_index, parameters.shard_count)
+        snapshot = store_snapshot(content_dir, patches_dir)
+        print(f'shard {parameters.shard_index}/{parameters.shard_count}: {len(doc_ids)} documents', file=sys.stderr)
+        skip_patches = None
+        if parameters.doc_dedup:
+            skip_patches = plan_document_dedup(content_dir, patches_dir, doc_ids, parameters.doc_dedup_threshold,
+                                               parameters.doc_dedup_report)
+        documents = iter_store_documents(content_dir, patches_dir, doc_ids, skip_patches)
+    for content, patches in documents:
+        processor.process_patches(content, patches)
+
+    if pair_filter:
+        print(f'Sentence pairs rejected by extractors: {processor.get_rejected()}', file=sys.stderr)
+    sentence_pairs = processor.get_diffs()
 
     print(f'Selecting sentence pairs', file=sys.stderr)
 
+    perplexity_scorer = None
+    if parameters.perplexity_model:
+        perplexity_scorer = load_perplexity_scorer(parameters.perplexity_model)
+
+    deduplicator = None
+    if parameters.dedup:
+        deduplicator = Deduplicator(near_duplicates=parameters.near_dedup, threshold=parameters.near_dedup_threshold,
+                                    max_items=parameters.dedup_max_items)
+
+    if parameters.metrics_table:
+        from processing.sweep import SelectionConfig, evaluate, write_dataset, write_table
+        table = measure_sentence_pairs(
+            sentence_pairs,
+            sent_regex=SENT_REGEX,
+            perplexity_scorer=perplexity_scorer,
+            num_workers=parameters.selection_workers or num_cpus,
+            deduplicator=deduplicator
+        )
+        write_table(table, parameters.metrics_table)
+        selected, rejected = evaluate(table, SelectionConfig(
+            min_length=parameters.min_length,
+            max_length=parameters.max_length,
+            min_edit_distance=parameters.min_edit_distance,
+            max_edit_distance=parameters.max_edit_distance,
+            min_alpha_ratio=parameters.min_alpha_ratio
+        ))
+        print(f'Rejected sentence pairs: {rejected}', file=sys.stderr)
+        write_dataset(table, selected, dataset_path)
+        finish_dataset(dataset_path, parameters, int(selected.sum()), doc_ids, snapshot)
+        return
+
     sentence_pairs = select_sentence_pairs(
         sentence_pairs,
-        sent_regex=r'^[a-zA-Z][a-zA-Z@#№_();:\'"<>,.?!\s=*/+-]+[.?!;]$',
+        sent_regex=SENT_REGEX,
         min_length=parameters.min_length,
         max_length=parameters.max_length,
         min_char_levenshtein=parameters.min_edit_distance,
         max_char_levenshtein=parameters.max_edit_distance,
         min_alpha_ratio=parameters.min_alpha_ratio,
-        perplexity_scorer=None
+        perplexity_scorer=perplexity_scorer,
+        num_workers=parameters.selection_workers or num_cpus,
+        deduplicator=deduplicator
     )
 
+    import numpy as np
+    import pandas as pd
     sentence_pairs = [(i, sp.source_sent, sp.target_sent) for i, sp in enumerate(sentence_pairs)]
     df = pd.DataFrame(
-        data=np.array(sentence_pairs, dtype=np.object),
+        data=np.array(sentence_pairs, dtype=np.object).reshape(-1, 3),
         index=None,
         columns=['sent_id', 'original_sent', 'edited_sent'],
     )
     df.to_csv(dataset_path, sep='\t', index=False)
+    finish_dataset(dataset_path, parameters, len(df), doc_ids, snapshot)
+
+
+def finish_dataset(dataset_path: Path, parameters: Parameters, pairs: int, doc_ids: List[str],
+                   snapshot: Optional[str]):
+    metrics.inc('dataset_pairs', pairs)
+    write_shard_info(dataset_path, parameters.shard_index, parameters.shard_count, len(doc_ids), pairs, snapshot)
 
 
 if __name__ == '__main__':
@@ -118,7 +323,82 @@ if __name__ == '__main__':
                         help='Maximal edit distance between sentences')
     parser.add_argument('--min-alpha-ratio', type=float, default=0.65,
                         help='Minimal length of sentences')
+    parser.add_argument('--perplexity-model', type=str, default=None,
+                        help='N-gram model to compute perplexity of selected sentences')
+    parser.add_argument('--selection-workers', type=int, default=None,
+                        help='Number of processes to select sentence pairs, all cpus by default')
+    parser.add_argument('--no-prefilter', action='store_true',
+                        help='Do not apply length, regex and alphabet ratio filters inside extractors')
+    parser.add_argument('--no-dedup', action='store_true',
+                        help='Keep duplicate sentence pairs, equal up to case and whitespace')
+    parser.add_argument('--near-dedup', action='store_true',
+                        help='Also remove pairs that make the same edit in nearly the same sentences')
+    parser.add_argument('--near-dedup-threshold', type=float, default=0.8,
+                        help='Minimal estimated Jaccard similarity of word shingles of near duplicates')
+    parser.add_argument('--dedup-max-items', type=int, default=1000000,
+                        help='Number of last distinct pairs remembered for deduplication')
+    parser.add_argument('--doc-dedup', action='store_true',
+                        help='Find documents copied from earlier ones and replay only the history they do not share')
+    parser.add_argument('--doc-dedup-threshold', type=float, default=0.5,
+                        help='Minimal estimated similarity of sketches of content and patches of copies')
+    parser.add_argument('--doc-dedup-report', type=str, default=None,
+                        help='File to save groups of copied documents and the shared history of each of them')
+    parser.add_argument('--metrics-table', type=str, default=None,
+                        help='File to save metrics of all extracted sentence pairs to, sweep_selection.py selects '
+                             'datasets for many thresholds from it. Disables the prefilter')
+    parser.add_argument('--spill-dir', type=str, default=None,
+                        help='Directory for per-actor shard files with extracted sentence pairs')
+    parser.add_argument('--num-workers', type=int, default=None,
+                        help='Number of extractors, all cpus by default')
+    parser.add_argument('--backend', choices=BACKENDS, default=None,
+                        help='Where extractors run, ray for several workers and serial for one by default')
+    parser.add_argument('--scheduling', choices=['least-loaded', 'round-robin'], default='least-loaded',
+                        help='How extraction tasks are distributed between extractors')
+    parser.add_argument('--memory-budget', type=str, default=None,
+                        help='Resident memory of the driver and extractors to stay under, like 8G. '
+                             'Tasks wait for headroom, fewer of them run under pressure and large documents run alone')
+    parser.add_argument('--extractor', choices=list(EXTRACTORS), default='multiple',
+                        help='How sentence pairs are extracted from a patch group: one changed span, '
+                             'alignment of all sentences, or a path picked by the footprint of the edit '
+                             'that pairs small in place edits directly and aligns only sentences around larger ones')
+    parser.add_argument('--offline', action='store_true',
+                        help='Never download nltk resources, fail if some of them are missing')
+    parser.add_argument('--shard-index', type=int, default=0,
+                        help='Index of the shard of documents to process, see --shard-count')
+    parser.add_argument('--shard-count', type=int, default=1,
+                        help='Number of shards documents are split into by hashes of their ids, '
+                             'balanced by patch bytes. '
+                             'Datasets of all shards are combined by merge_datasets.py')
+    parser.add_argument('--from-bucket', type=str, default=None,
+                        help='Config of load_patches.py, new versions of its bucket are streamed into processing '
+                             'instead of reading the store')
+    parser.add_argument('--persist', action='store_true',
+                        help='Also save streamed versions to the store like load_patches.py, '
+                             'so the next run only processes later versions')
+    parser.add_argument('--queue-size', type=int, default=16,
+                        help='Maximal number of downloaded documents waiting for processing')
+    parser.add_argument('--metrics-file', type=str, default=None,
+                        help='File to periodically export pipeline metrics to')
+    parser.add_argument('--metrics-format', choices=['json', 'prometheus'], default='json',
+                        help='Format of the metrics file, prometheus text format can be read by node_exporter')
+    parser.add_argument('--metrics-interval', type=float, default=30.0,
+                        help='Seconds between metrics exports')
+    parser.add_argument('--profile-dir', type=str, default=None,
+                        help='Directory to save cProfile stats of the driver and of every extractor')
     args = parser.parse_args()
 
-    install_dependencies()
-    main(Path(args.dataset), Parameters(args))
+    parameters = Parameters(args)
+    exporter = None
+    if parameters.metrics_file:
+        exporter = MetricsExporter(metrics, parameters.metrics_file, parameters.metrics_interval,
+                                   parameters.metrics_format).start()
+    profiler = Profiler(parameters.profile_dir and parameters.profile_dir / 'driver.prof').start()
+
+    if not ensure_nltk_resources(['punkt', 'crubadan'], offline=args.offline) and args.offline:
+        sys.exit(1)
+    try:
+        main(Path(args.dataset), parameters)
+    finally:
+        profiler.stop()
+        if exporter:
+            exporter.stop()
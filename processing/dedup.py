@@ -0,0 +1,273 @@
+import zlib
+from collections import Counter, deque
+from hashlib import blake2b
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+import numpy as np
+
+
+# prime above 2^32, so (a * x + b) % MINHASH_PRIME of 32-bit a, b and x fits into uint64
+MINHASH_PRIME = np.uint64((1 << 32) + 15)
+
+
+def normalize_text(text: str) -> str:
+    return ' '.join(text.lower().split())
+
+
+def pair_hash(pair: Tuple[str, str]) -> int:
+    """
+    Hash of a sentence pair that ignores case and whitespace
+    """
+    key = normalize_text(pair[0]) + '\0' + normalize_text(pair[1])
+    return int.from_bytes(blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def edit_key(source_words: List[str], target_words: List[str]) -> int:
+    """
+    Hash of words deleted and inserted by an edit regardless of their context
+    """
+    source, target = Counter(source_words), Counter(target_words)
+    deleted, inserted = sorted((source - target).elements()), sorted((target - source).elements())
+    key = ' '.join(deleted) + '\0' + ' '.join(inserted)
+    return int.from_bytes(blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def shingles(words: List[str], size: int, tag: str) -> List[int]:
+    if len(words) < size:
+        return [zlib.crc32((tag + ' '.join(words)).encode('utf-8'))]
+    return [zlib.crc32((tag + ' '.join(words[i:i + size])).encode('utf-8')) for i in range(len(words) - size + 1)]
+
+
+class MinHasher:
+    """
+    MinHash signatures of sets of 32-bit shingle hashes with num_perm universal hash functions
+    """
+
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+
+    def signature(self, hashes: List[int], chunk_size: int = 4096) -> np.ndarray:
+        values = np.unique(np.array(hashes, dtype=np.uint64))
+        signature = np.full(len(self.a), MINHASH_PRIME, dtype=np.uint64)
+        for start in range(0, len(values), chunk_size):
+            chunk = values[start:start + chunk_size, None]
+            signature = np.minimum(signature, ((chunk * self.a + self.b) % MINHASH_PRIME).min(axis=0))
+        return signature.astype(np.uint32)
+
+
+class ExactDeduplicator:
+    """
+    Remembers hashes of the last max_items distinct pairs, a pair seen among them is a duplicate
+    """
+
+    def __init__(self, max_items: int = 1000000):
+        self.max_items = max_items
+        self.seen = set()
+        self.order = deque()
+
+    def is_duplicate(self, pair: Tuple[str, str]) -> bool:
+        key = pair_hash(pair)
+        if key in self.seen:
+            return True
+        self.seen.add(key)
+        self.order.append(key)
+        if len(self.order) > self.max_items:
+            self.seen.discard(self.order.popleft())
+        return False
+
+
+class NearDeduplicator:
+    """
+    Finds pairs that make the same edit in nearly the same sentences: words deleted and inserted must be equal,
+    and the estimated Jaccard similarity of word shingles of both sentences must be at least threshold.
+    Candidates come from LSH over bands of MinHash signatures, only the last max_items pairs are kept.
+    """
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 64, bands: int = 16, shingle_size: int = 3,
+                 max_items: int = 1000000, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError(f'num_perm={num_perm} is not divisible by bands={bands}')
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.max_items = max_items
+        self.hasher = MinHasher(num_perm, seed)
+        self.tables: List[Dict[bytes, int]] = [{} for _ in range(bands)]
+        self.items: Dict[int, Tuple[int, np.ndarray, List[bytes]]] = {}
+        self.order = deque()
+        self.next_id = 0
+
+    def is_duplicate(self, pair: Tuple[str, str]) -> bool:
+        source_words, target_words = normalize_text(pair[0]).split(), normalize_text(pair[1]).split()
+        key = edit_key(source_words, target_words)
+        signature = self.hasher.signature(shingles(source_words, self.shingle_size, 's:') +
+                                          shingles(target_words, self.shingle_size, 't:'))
+        band_keys = [key.to_bytes(8, 'big') + signature[i * self.rows:(i + 1) * self.rows].tobytes()
+                     for i in range(self.bands)]
+
+        for table, band_key in zip(self.tables, band_keys):
+            item_id = table.get(band_key)
+            if item_id is None:
+                continue
+            item_key, item_signature, _ = self.items[item_id]
+            if item_key == key and np.mean(item_signature == signature) >= self.threshold:
+                return True
+
+        item_id = self.next_id
+        self.next_id += 1
+        self.items[item_id] = (key, signature, band_keys)
+        for table, band_key in zip(self.tables, band_keys):
+            table[band_key] = item_id
+        self.order.append(item_id)
+        if len(self.order) > self.max_items:
+            self._evict(self.order.popleft())
+        return False
+
+    def _evict(self, item_id: int):
+        _, _, band_keys = self.items.pop(item_id)
+        for table, band_key in zip(self.tables, band_keys):
+            if table.get(band_key) == item_id:
+                del table[band_key]
+
+
+class Deduplicator:
+    """
+    Streaming removal of exact duplicates of sentence pairs and, optionally, of near duplicates,
+    the first occurrence is kept. Memory is bounded by the number of remembered pairs.
+    """
+
+    def __init__(self, near_duplicates: bool = False, threshold: float = 0.8, max_items: int = 1000000):
+        self.exact = ExactDeduplicator(max_items)
+        self.near = NearDeduplicator(threshold=threshold, max_items=max_items) if near_duplicates else None
+        self.removed = Counter()
+
+    def filter(self, sentence_pairs: Iterable[Tuple[str, str]]) -> List[Tuple[str, str]]:
+        kept = []
+        for pair in sentence_pairs:
+            if self.exact.is_duplicate(pair):
+                self.removed['duplicate'] += 1
+            elif self.near is not None and self.near.is_duplicate(pair):
+                self.removed['near_duplicate'] += 1
+            else:
+                kept.append(pair)
+        return kept
+
+    def describe(self) -> str:
+        if self.near is None:
+            return 'Removing duplicate sentence pairs'
+        return f'Removing duplicate and near duplicate sentence pairs (similarity >= {self.near.threshold})'
+
+
+def history_hashes(patches: list) -> np.ndarray:
+    """
+    Chained hashes of patch texts in the given order, equal prefixes of two histories give equal hashes
+    """
+    hashes = np.empty(len(patches), dtype=np.uint64)
+    digest = b''
+    for i, patch in enumerate(patches):
+        digest = blake2b(digest + patch.text.encode('utf-8'), digest_size=8).digest()
+        hashes[i] = int.from_bytes(digest, 'big')
+    return hashes
+
+
+def common_prefix(a: np.ndarray, b: np.ndarray) -> int:
+    n = min(len(a), len(b))
+    mismatches = np.flatnonzero(a[:n] != b[:n])
+    return int(mismatches[0]) if len(mismatches) else n
+
+
+class DocumentPlan(NamedTuple):
+    """
+    How much of a document history has to be replayed: its oldest shared_patches patches are the same
+    as in the history of source that is processed before it
+    """
+    doc_id: str
+    total_patches: int
+    shared_patches: int
+    source: Optional[str]
+
+    @property
+    def skipped(self) -> bool:
+        return 0 < self.total_patches == self.shared_patches
+
+
+class DocumentDeduplicator:
+    """
+    Fingerprints documents added one by one with a hash of the latest content, chained hashes of the patch history
+    and a MinHash sketch of word shingles of the content and of patch texts.
+    Earlier documents with the same content, the same first patch or a similar sketch are candidate copies,
+    a document has to replay only the patches after the longest history prefix it shares with one of them.
+    """
+
+    def __init__(self, threshold: float = 0.5, num_perm: int = 64, bands: int = 16, shingle_size: int = 5):
+        if num_perm % bands:
+            raise ValueError(f'num_perm={num_perm} is not divisible by bands={bands}')
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.hasher = MinHasher(num_perm)
+        self.doc_ids: List[str] = []
+        self.histories: List[np.ndarray] = []
+        self.sketches: List[np.ndarray] = []
+        self.tables: List[Dict[bytes, List[int]]] = [{} for _ in range(bands)]
+        self.by_content: Dict[bytes, List[int]] = {}
+        self.by_first_patch: Dict[int, List[int]] = {}
+        self.parents: List[int] = []
+
+    def _find(self, i: int) -> int:
+        while self.parents[i] != i:
+            self.parents[i] = self.parents[self.parents[i]]
+            i = self.parents[i]
+        return i
+
+    def _union(self, i: int, j: int):
+        i, j = self._find(i), self._find(j)
+        if i != j:
+            self.parents[max(i, j)] = min(i, j)
+
+    def add(self, doc_id: str, content: str, patches: list) -> DocumentPlan:
+        history = history_hashes(patches)
+        content_hash = blake2b(content.encode('utf-8'), digest_size=16).digest()
+        sketch = self.hasher.signature(shingles(content.split(), self.shingle_size, 'c:') +
+                                       [int(h) & 0xffffffff for h in history] or [0])
+        band_keys = [sketch[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+        copies: Set[int] = set(self.by_content.get(content_hash, []))
+        if len(history):
+            copies.update(self.by_first_patch.get(int(history[0]), []))
+        similar = {i for table, band_key in zip(self.tables, band_keys) for i in table.get(band_key, [])}
+        copies.update(i for i in similar if np.mean(self.sketches[i] == sketch) >= self.threshold)
+
+        shared, source = 0, None
+        for i in sorted(copies):
+            prefix = common_prefix(history, self.histories[i])
+            if prefix > shared:
+                shared, source = prefix, i
+
+        index = len(self.doc_ids)
+        self.doc_ids.append(doc_id)
+        self.histories.append(history)
+        self.sketches.append(sketch)
+        self.parents.append(index)
+        for i in copies:
+            self._union(index, i)
+        self.by_content.setdefault(content_hash, []).append(index)
+        if len(history):
+            self.by_first_patch.setdefault(int(history[0]), []).append(index)
+        for table, band_key in zip(self.tables, band_keys):
+            table.setdefault(band_key, []).append(index)
+
+        return DocumentPlan(doc_id=doc_id, total_patches=len(history), shared_patches=shared,
+                            source=self.doc_ids[source] if source is not None else None)
+
+    def groups(self) -> List[List[str]]:
+        """
+        Documents connected by being copies of each other, groups of one document are omitted
+        """
+        groups: Dict[int, List[str]] = {}
+        for i, doc_id in enumerate(self.doc_ids):
+            groups.setdefault(self._find(i), []).append(doc_id)
+        return [group for group in groups.values() if len(group) > 1]
@@ -0,0 +1,150 @@
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, wait
+from typing import Any, List, Optional, Sequence, Tuple
+
+
+BACKENDS = ['serial', 'threads', 'processes', 'ray']
+
+
+class WorkerPool(ABC):
+    """
+    Hosts one stateful worker object per slot, methods of a worker are executed in the order of submission.
+    submit returns a handle that is resolved by get, handles of different backends must not be mixed.
+    """
+
+    def __init__(self, worker_cls: type, worker_args: Sequence[tuple]):
+        self.worker_cls = worker_cls
+        self.num_workers = len(worker_args)
+
+    @abstractmethod
+    def submit(self, worker_id: int, method: str, *args) -> Any:
+        pass
+
+    @abstractmethod
+    def wait(self, handles: List[Any], timeout: Optional[float] = 0) -> Tuple[List[Any], List[Any]]:
+        """
+        Splits handles into finished and pending ones, timeout=None blocks until all of them are finished
+        """
+        pass
+
+    @abstractmethod
+    def get(self, handles: List[Any]) -> List[Any]:
+        pass
+
+    def shutdown(self):
+        pass
+
+
+class FuturesWorkerPool(WorkerPool, ABC):
+    def wait(self, handles: List[Future], timeout: Optional[float] = 0) -> Tuple[List[Future], List[Future]]:
+        done, _ = wait(handles, timeout=timeout)
+        return [f for f in handles if f in done], [f for f in handles if f not in done]
+
+    def get(self, handles: List[Future]) -> List[Any]:
+        return [f.result() for f in handles]
+
+
+class SerialWorkerPool(FuturesWorkerPool):
+    """
+    Runs workers in the calling thread, every call is finished on submit
+    """
+
+    def __init__(self, worker_cls: type, worker_args: Sequence[tuple]):
+        super().__init__(worker_cls, worker_args)
+        self.workers = [worker_cls(*args) for args in worker_args]
+
+    def submit(self, worker_id: int, method: str, *args) -> Future:
+        future = Future()
+        try:
+            future.set_result(getattr(self.workers[worker_id], method)(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+class ThreadWorkerPool(FuturesWorkerPool):
+    """
+    Gives every worker its own single thread, useful when workers release the GIL or wait for IO
+    """
+
+    def __init__(self, worker_cls: type, worker_args: Sequence[tuple]):
+        super().__init__(worker_cls, worker_args)
+        self.workers = [worker_cls(*args) for args in worker_args]
+        self.executors = [ThreadPoolExecutor(max_workers=1) for _ in worker_args]
+
+    def submit(self, worker_id: int, method: str, *args) -> Future:
+        return self.executors[worker_id].submit(getattr(self.workers[worker_id], method), *args)
+
+    def shutdown(self):
+        for executor in self.executors:
+            executor.shutdown()
+
+
+_process_worker = None
+
+
+def _init_process_worker(worker_cls: type, args: tuple):
+    global _process_worker
+    _process_worker = worker_cls(*args)
+
+
+def _call_process_worker(method: str, *args):
+    return getattr(_process_worker, method)(*args)
+
+
+class ProcessWorkerPool(FuturesWorkerPool):
+    """
+    Gives every worker its own process, the worker object is created once in that process
+    """
+
+    def __init__(self, worker_cls: type, worker_args: Sequence[tuple]):
+        super().__init__(worker_cls, worker_args)
+        self.executors = [ProcessPoolExecutor(max_workers=1, initializer=_init_process_worker,
+                                              initargs=(worker_cls, args)) for args in worker_args]
+
+    def submit(self, worker_id: int, method: str, *args) -> Future:
+        return self.executors[worker_id].submit(_call_process_worker, method, *args)
+
+    def shutdown(self):
+        for executor in self.executors:
+            executor.shutdown()
+
+
+class RayWorkerPool(WorkerPool):
+    """
+    Hosts workers as ray actors, ray is started on creation and stopped on shutdown
+    """
+
+    def __init__(self, worker_cls: type, worker_args: Sequence[tuple]):
+        super().__init__(worker_cls, worker_args)
+        import ray
+        self.ray = ray
+        ray.init(num_cpus=len(worker_args))
+        actor_cls = ray.remote(worker_cls)
+        self.actors = [actor_cls.remote(*args) for args in worker_args]
+
+    def submit(self, worker_id: int, method: str, *args):
+        return getattr(self.actors[worker_id], method).remote(*args)
+
+    def wait(self, handles: list, timeout: Optional[float] = 0) -> Tuple[list, list]:
+        if not handles:
+            return [], []
+        return self.ray.wait(handles, num_returns=len(handles), timeout=timeout)
+
+    def get(self, handles: list) -> List[Any]:
+        return self.ray.get(handles)
+
+    def shutdown(self):
+        self.ray.shutdown()
+
+
+def create_worker_pool(backend: str, worker_cls: type, worker_args: Sequence[tuple]) -> WorkerPool:
+    pools = {
+        'serial': SerialWorkerPool,
+        'threads': ThreadWorkerPool,
+        'processes': ProcessWorkerPool,
+        'ray': RayWorkerPool,
+    }
+    if backend not in pools:
+        raise ValueError(f'unknown backend {backend}, expected one of {BACKENDS}')
+    return pools[backend](worker_cls, worker_args)
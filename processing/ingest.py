@@ -0,0 +1,60 @@
+import queue
+import threading
+from typing import Iterable, Iterator, TypeVar
+
+from processing.instrumentation import metrics
+
+
+T = TypeVar('T')
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def prefetch(iterable: Iterable[T], max_size: int, name: str = 'ingest') -> Iterator[T]:
+    """
+    Iterates over iterable in a background thread, keeping at most max_size items ready in a bounded queue.
+    The producer blocks while the queue is full, so a slow consumer holds back downloads instead of piling them up.
+    Errors of the producer are raised in the consumer, a consumer that stops early lets the producer finish its item.
+    """
+    items = queue.Queue(maxsize=max(1, max_size))
+    stopped = threading.Event()
+
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except BaseException as error:
+            put(_Failure(error))
+            return
+        put(_DONE)
+
+    producer = threading.Thread(target=produce, name=f'{name}-producer', daemon=True)
+    producer.start()
+    try:
+        while True:
+            with metrics.timer(f'{name}_wait'):
+                item = items.get()
+            metrics.set(f'{name}_queue_size', items.qsize())
+            if item is _DONE:
+                break
+            if isinstance(item, _Failure):
+                raise item.error
+            metrics.inc(f'{name}_items')
+            yield item
+    finally:
+        stopped.set()
+        producer.join()
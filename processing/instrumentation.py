@@ -0,0 +1,140 @@
+import os
+import json
+import time
+import cProfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+
+class Metrics:
+    """
+    Thread-safe registry of counters, gauges and timers
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: Dict[str, float] = {}
+        self.gauges: Dict[str, float] = {}
+        self.timers: Dict[str, List[float]] = {}
+        self.collectors: List[Callable[['Metrics'], None]] = []
+        self.started = time.time()
+
+    def inc(self, name: str, value: float = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name: str, value: float):
+        with self.lock:
+            self.gauges[name] = value
+
+    def observe(self, name: str, seconds: float):
+        with self.lock:
+            timer = self.timers.setdefault(name, [0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+
+    @contextmanager
+    def timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def add_collector(self, collector: Callable[['Metrics'], None]):
+        """
+        Registers a function that refreshes gauges right before every export
+        """
+        self.collectors.append(collector)
+
+    def snapshot(self) -> dict:
+        for collector in self.collectors:
+            collector(self)
+        with self.lock:
+            return {
+                'uptime_seconds': time.time() - self.started,
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'timers': {name: {'count': count, 'total_seconds': total, 'max_seconds': longest}
+                           for name, (count, total, longest) in self.timers.items()}
+            }
+
+    @staticmethod
+    def to_prometheus(snapshot: dict, prefix: str = 'papeeria_') -> str:
+        lines = [f'# TYPE {prefix}uptime_seconds gauge', f'{prefix}uptime_seconds {snapshot["uptime_seconds"]}']
+        for name, value in sorted(snapshot['counters'].items()):
+            lines += [f'# TYPE {prefix}{name} counter', f'{prefix}{name} {value}']
+        for name, value in sorted(snapshot['gauges'].items()):
+            lines += [f'# TYPE {prefix}{name} gauge', f'{prefix}{name} {value}']
+        for name, timer in sorted(snapshot['timers'].items()):
+            lines += [f'# TYPE {prefix}{name}_seconds summary',
+                      f'{prefix}{name}_seconds_count {timer["count"]}',
+                      f'{prefix}{name}_seconds_sum {timer["total_seconds"]}',
+                      f'# TYPE {prefix}{name}_seconds_max gauge',
+                      f'{prefix}{name}_seconds_max {timer["max_seconds"]}']
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+class MetricsExporter:
+    """
+    Periodically writes a snapshot of metrics to a file as json or in Prometheus text format
+    """
+
+    def __init__(self, registry: Metrics, path: Path, interval: float = 30.0, fmt: str = 'json'):
+        if fmt not in ('json', 'prometheus'):
+            raise ValueError('unsupported metrics format: only "json" and "prometheus" are available')
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.fmt = fmt
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='metrics-exporter', daemon=True)
+
+    def export(self):
+        snapshot = self.registry.snapshot()
+        data = json.dumps(snapshot, indent=2) if self.fmt == 'json' else Metrics.to_prometheus(snapshot)
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        tmp_path.write_text(data)
+        os.replace(tmp_path, self.path)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.export()
+
+    def start(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.export()
+
+
+class Profiler:
+    """
+    Optional cProfile wrapper, does nothing when path is None
+    """
+
+    def __init__(self, path: Optional[Path]):
+        self.path = path
+        self.profile = cProfile.Profile() if path else None
+
+    def start(self):
+        if self.profile:
+            self.profile.enable()
+        return self
+
+    def stop(self):
+        if self.profile:
+            self.profile.disable()
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.profile.dump_stats(str(self.path))
+            self.profile = None
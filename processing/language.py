@@ -0,0 +1,107 @@
+import re
+from collections import OrderedDict
+from hashlib import blake2b
+from typing import List, Optional
+
+
+# Function words that are frequent in English prose and rare as standalone words in other latin-script languages
+ENGLISH_STOPWORDS = frozenset([
+    'the', 'and', 'of', 'is', 'are', 'was', 'were', 'be', 'been', 'being', 'which', 'that', 'this', 'these',
+    'those', 'with', 'for', 'from', 'by', 'it', 'its', 'we', 'our', 'they', 'their', 'them', 'not', 'can',
+    'has', 'have', 'had', 'than', 'such', 'also', 'there', 'where', 'when', 'how', 'what', 'will', 'would',
+    'should', 'could', 'into', 'between', 'each', 'both', 'or', 'but', 'if', 'then', 'however', 'thus',
+    'only', 'other', 'some', 'more', 'most', 'all', 'any', 'one', 'two', 'after', 'before', 'over', 'under',
+    'about', 'while', 'because', 'through', 'does', 'do', 'did', 'so', 'very', 'well', 'here', 'you', 'your'
+])
+
+
+class EnglishDetector:
+    """
+    Decides whether a sentence is english. Obvious cases are resolved by character and stopword statistics,
+    only ambiguous ones are passed to langdetect. Verdicts are memoised by sentence hash.
+    """
+
+    def __init__(self, seed: int = 0, cache_size: int = 1000000,
+                 min_stopword_ratio: float = 0.2, min_stopwords: int = 2, max_foreign_ratio: float = 0.5):
+        self.seed = seed
+        self.cache_size = cache_size
+        self.min_stopword_ratio = min_stopword_ratio
+        self.min_stopwords = min_stopwords
+        self.max_foreign_ratio = max_foreign_ratio
+
+        self.word_regex = re.compile(r'[^\W\d_]+')
+        self.cache = OrderedDict()
+
+        self.cache_hits = 0
+        self.fast_accepts = 0
+        self.fast_rejects = 0
+        self.fallbacks = 0
+
+    @staticmethod
+    def _key(sent: str) -> bytes:
+        return blake2b(sent.encode('utf-8'), digest_size=16).digest()
+
+    def _fast_verdict(self, sent: str) -> Optional[bool]:
+        words = self.word_regex.findall(sent.lower())
+        if not words:
+            return False
+
+        letters = sum(map(len, words))
+        ascii_letters = sum(len(word) for word in words if word.isascii())
+        if letters - ascii_letters > self.max_foreign_ratio * letters:
+            return False
+        if ascii_letters != letters:
+            return None
+
+        stopwords = sum(word in ENGLISH_STOPWORDS for word in words)
+        if stopwords >= self.min_stopwords and stopwords >= self.min_stopword_ratio * len(words):
+            return True
+        return None
+
+    def _full_verdict(self, sent: str) -> bool:
+        from langdetect import DetectorFactory, detect
+        DetectorFactory.seed = self.seed
+        try:
+            return detect(sent) == 'en'
+        except:
+            return False
+
+    def _remember(self, key: bytes, verdict: bool):
+        self.cache[key] = verdict
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def is_english(self, sent: str) -> bool:
+        key = self._key(sent)
+        verdict = self.cache.get(key)
+        if verdict is not None:
+            self.cache_hits += 1
+            self.cache.move_to_end(key)
+            return verdict
+
+        verdict = self._fast_verdict(sent)
+        if verdict is None:
+            self.fallbacks += 1
+            verdict = self._full_verdict(sent)
+        elif verdict:
+            self.fast_accepts += 1
+        else:
+            self.fast_rejects += 1
+
+        self._remember(key, verdict)
+        return verdict
+
+    def is_english_batch(self, sents: List[str]) -> List[bool]:
+        verdicts = {}
+        for sent in sents:
+            if sent not in verdicts:
+                verdicts[sent] = self.is_english(sent)
+        return [verdicts[sent] for sent in sents]
+
+    def statistics(self) -> dict:
+        return {
+            'cache_hits': self.cache_hits,
+            'fast_accepts': self.fast_accepts,
+            'fast_rejects': self.fast_rejects,
+            'fallbacks': self.fallbacks
+        }
@@ -0,0 +1,124 @@
+import os
+import re
+import time
+import psutil
+
+from processing.instrumentation import metrics
+
+
+SIZE_REGEX = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$', re.IGNORECASE)
+SIZE_UNITS = {'': 1, 'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30, 'T': 2 ** 40}
+
+# rough number of bytes an extraction task holds per character of its texts:
+# both texts, their diffs, sentence boundary arrays and normalised copies of sentences
+TASK_MEMORY_FACTOR = 8
+
+
+def parse_size(size: str) -> int:
+    """
+    Number of bytes in a size like 512M, 8G or 1.5GiB, plain numbers are bytes
+    """
+    match = SIZE_REGEX.match(size)
+    if not match:
+        raise ValueError(f'invalid size {size!r}, expected a number with an optional K, M, G or T suffix')
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+def process_tree_rss(pid: int) -> int:
+    """
+    Resident memory of a process and all of its descendants: pool processes, ray workers and the object store.
+    Pages shared by several processes, like copy-on-write memory of forked workers and the mmap of the object store,
+    are counted once: proportional set sizes are summed where they are available, otherwise unique set sizes
+    plus the largest shared part of a single process
+    """
+    try:
+        process = psutil.Process(pid)
+        processes = [process] + process.children(recursive=True)
+    except psutil.NoSuchProcess:
+        return 0
+    total, shared = 0, 0
+    for process in processes:
+        try:
+            info = process.memory_full_info()
+        except psutil.AccessDenied:
+            try:
+                total += process.memory_info().rss
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                pass
+            continue
+        except psutil.NoSuchProcess:
+            continue
+        if hasattr(info, 'pss'):
+            total += info.pss
+        else:
+            total += info.uss
+            shared = max(shared, info.rss - info.uss)
+    return total + shared
+
+
+class MemoryGovernor:
+    """
+    Keeps resident memory of the driver and its extractors under a budget.
+    Tasks are admitted while there is room for their estimated footprint and fewer than in_flight_limit of them run.
+    The limit is halved when memory is above high_watermark of the budget and grows by one below low_watermark.
+    Documents whose tasks on every worker at once would take more than large_share of the budget are large,
+    they are processed alone.
+    """
+
+    def __init__(self, budget: int, num_workers: int, tasks_per_worker: int = 4, high_watermark: float = 0.9,
+                 low_watermark: float = 0.7, large_share: float = 0.5, poll_interval: float = 0.2):
+        self.budget = budget
+        self.num_workers = num_workers
+        self.max_in_flight = max(1, num_workers * tasks_per_worker)
+        self.in_flight_limit = self.max_in_flight
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.large_share = large_share
+        self.poll_interval = poll_interval
+        self.pid = os.getpid()
+        self.rss = 0
+        self.peak_rss = 0
+        self.sampled = None
+
+    def sample(self) -> int:
+        """
+        Current resident memory of the process tree, measured at most once per poll_interval.
+        Adjusts in_flight_limit on every measurement.
+        """
+        now = time.perf_counter()
+        if self.sampled is not None and now - self.sampled < self.poll_interval:
+            return self.rss
+        self.sampled = now
+        self.rss = process_tree_rss(self.pid)
+        self.peak_rss = max(self.peak_rss, self.rss)
+
+        if self.rss > self.high_watermark * self.budget:
+            self.in_flight_limit = max(1, self.in_flight_limit // 2)
+        elif self.rss < self.low_watermark * self.budget:
+            self.in_flight_limit = min(self.max_in_flight, self.in_flight_limit + 1)
+        metrics.set('memory_rss_bytes', self.rss)
+        metrics.set('memory_peak_rss_bytes', self.peak_rss)
+        metrics.set('memory_in_flight_limit', self.in_flight_limit)
+        return self.rss
+
+    @staticmethod
+    def task_footprint(size: int) -> int:
+        return size * TASK_MEMORY_FACTOR
+
+    def is_large(self, text_length: int) -> bool:
+        return self.task_footprint(2 * text_length) * self.num_workers > self.large_share * self.budget
+
+    def can_start_document(self, in_flight: int) -> bool:
+        return in_flight == 0 or self.sample() < self.high_watermark * self.budget
+
+    def can_submit(self, size: int, in_flight: int) -> bool:
+        """
+        A task with texts of size characters in total is always admitted when nothing runs,
+        otherwise it has to fit into the headroom left by the budget
+        """
+        rss = self.sample()
+        if in_flight == 0:
+            return True
+        if in_flight >= self.in_flight_limit:
+            return False
+        return self.task_footprint(size) <= self.budget - rss
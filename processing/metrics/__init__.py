@@ -1,8 +1,10 @@
+from pathlib import Path
+from typing import List, Sequence, Tuple
 import numpy as np
-from nltk import word_tokenize
 
-from .levenshtein import levenshtein
+from .levenshtein import levenshtein, levenshtein_batch
 from .perplexity import NGramPerplexityScorer
+from .ngram_store import CompactNGramPerplexityScorer
 
 
 def char_edit_distance(sent1: str, sent2: str, no_digits=False, summarized=True):
@@ -19,6 +21,7 @@ def char_edit_distance(sent1: str, sent2: str, no_digits=False, summarized=True)
 
 
 def word_edit_distance(sent1: str, sent2: str, summarized=True):
+    from nltk import word_tokenize
     words1 = word_tokenize(sent1)
     words2 = word_tokenize(sent2)
     all_words = set(words1) | set(words2)
@@ -35,3 +38,90 @@ def word_edit_distance(sent1: str, sent2: str, summarized=True):
 
 def latin_alphabet_ratio(sent: str) -> float:
     return sum(map(str.isalpha, sent)) / (len(sent) + 0.5)
+
+
+def encode_sentences(sents: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Encodes sentences as one flat array of code points and an array of offsets,
+    sentence k occupies codes[offsets[k]:offsets[k + 1]]
+    """
+    lengths = np.fromiter(map(len, sents), dtype=np.int64, count=len(sents))
+    offsets = np.zeros(len(sents) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    codes = np.frombuffer(''.join(sents).encode('utf-32-le'), dtype=np.uint32).view(np.int32)
+    return codes, offsets
+
+
+def _char_class_mask(codes: np.ndarray, predicate) -> np.ndarray:
+    # ASCII is resolved with a lookup table, all other code points are checked once per unique value
+    ascii_table = np.array([predicate(chr(c)) for c in range(128)], dtype=np.bool_)
+    mask = np.zeros(len(codes), dtype=np.bool_)
+    is_ascii = codes < 128
+    mask[is_ascii] = ascii_table[codes[is_ascii]]
+    if not is_ascii.all():
+        other, inverse = np.unique(codes[~is_ascii], return_inverse=True)
+        other_table = np.fromiter((predicate(chr(c)) for c in other), dtype=np.bool_, count=len(other))
+        mask[~is_ascii] = other_table[inverse]
+    return mask
+
+
+def _segment_ids(offsets: np.ndarray) -> np.ndarray:
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def _drop_codes(codes: np.ndarray, offsets: np.ndarray, drop: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    kept = np.bincount(_segment_ids(offsets)[~drop], minlength=len(offsets) - 1)
+    new_offsets = np.zeros_like(offsets)
+    np.cumsum(kept, out=new_offsets[1:])
+    return codes[~drop], new_offsets
+
+
+def char_edit_distance_batch(sents1: Sequence[str], sents2: Sequence[str], no_digits=False, summarized=True,
+                             num_threads: int = 0) -> np.ndarray:
+    codes1, offsets1 = encode_sentences(sents1)
+    codes2, offsets2 = encode_sentences(sents2)
+    if no_digits:
+        codes1, offsets1 = _drop_codes(codes1, offsets1, _char_class_mask(codes1, str.isdigit))
+        codes2, offsets2 = _drop_codes(codes2, offsets2, _char_class_mask(codes2, str.isdigit))
+
+    result = levenshtein_batch(codes1, offsets1, codes2, offsets2, num_threads=num_threads)
+    if summarized:
+        result = result.sum(axis=1)
+    return result
+
+
+def word_edit_distance_batch(sents1: Sequence[str], sents2: Sequence[str], summarized=True,
+                             num_threads: int = 0) -> np.ndarray:
+    from nltk import word_tokenize
+    encoder = {}
+
+    def encode(sents: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        codes: List[int] = []
+        offsets = np.zeros(len(sents) + 1, dtype=np.int64)
+        for k, sent in enumerate(sents):
+            codes.extend(encoder.setdefault(word, len(encoder)) for word in word_tokenize(sent))
+            offsets[k + 1] = len(codes)
+        return np.array(codes, dtype=np.int32), offsets
+
+    codes1, offsets1 = encode(sents1)
+    codes2, offsets2 = encode(sents2)
+
+    result = levenshtein_batch(codes1, offsets1, codes2, offsets2, num_threads=num_threads)
+    if summarized:
+        result = result.sum(axis=1)
+    return result
+
+
+def latin_alphabet_ratio_batch(sents: Sequence[str]) -> np.ndarray:
+    codes, offsets = encode_sentences(sents)
+    alpha = np.bincount(_segment_ids(offsets), weights=_char_class_mask(codes, str.isalpha), minlength=len(sents))
+    return alpha / (np.diff(offsets) + 0.5)
+
+
+def load_perplexity_scorer(path: Path):
+    """
+    Loads a pickled nltk model for .pkl files and a compact memory-mapped model otherwise
+    """
+    if path.suffix == '.pkl':
+        return NGramPerplexityScorer().load(path)
+    return CompactNGramPerplexityScorer().load(path)
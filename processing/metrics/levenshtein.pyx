@@ -1,6 +1,9 @@
+import os
 import numpy as np
 cimport numpy as np
 cimport cython
+from cython.parallel cimport prange
+from libc.stdlib cimport malloc, free
 
 from typing import Tuple
 
@@ -55,6 +58,110 @@ cdef compute(int[:] s1, int[:] s2):
     return S, I, D
 
 
+# Same recurrence and backtracking as `compute`, but on raw buffers so that it can run without the GIL
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef int compute_nogil(const int* s1, Py_ssize_t sz1, const int* s2, Py_ssize_t sz2, int* out) nogil:
+    cdef Py_ssize_t width = sz2 + 1
+    cdef int* dist = <int*> malloc((sz1 + 1) * width * sizeof(int))
+    if dist == NULL:
+        return -1
+
+    cdef Py_ssize_t i, j
+    cdef int best, cand
+    cdef int S = 0
+    cdef int I = 0
+    cdef int D = 0
+
+    for i in range(sz1 + 1):
+        dist[i * width] = <int> i
+    for j in range(sz2 + 1):
+        dist[j] = <int> j
+
+    for i in range(1, sz1 + 1):
+        for j in range(1, sz2 + 1):
+            best = dist[i * width + j - 1] + 1
+            cand = dist[(i - 1) * width + j] + 1
+            if cand < best:
+                best = cand
+            cand = dist[(i - 1) * width + j - 1] + (s1[i - 1] != s2[j - 1])
+            if cand < best:
+                best = cand
+            dist[i * width + j] = best
+
+    i = sz1
+    j = sz2
+
+    while i > 0 and j > 0:
+        if dist[i * width + j] == dist[(i - 1) * width + j - 1]:
+            i -= 1
+            j -= 1
+            continue
+        if dist[i * width + j] == dist[(i - 1) * width + j - 1] + 1:
+            i -= 1
+            j -= 1
+            S += 1
+            continue
+        if dist[i * width + j] == dist[(i - 1) * width + j] + 1:
+            i -= 1
+            D += 1
+        else:
+            j -= 1
+            I += 1
+
+    D += <int> i
+    I += <int> j
+
+    out[0] = S
+    out[1] = I
+    out[2] = D
+    free(dist)
+    return 0
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef compute_batch(const int[:] codes1, const long long[:] offsets1,
+                   const int[:] codes2, const long long[:] offsets2,
+                   int num_threads):
+    cdef Py_ssize_t n = offsets1.shape[0] - 1
+    result_np = np.zeros((n, 3), dtype=np.intc)
+    cdef int[:, ::1] result = result_np
+    cdef Py_ssize_t k
+    cdef int failed = 0
+
+    cdef const int* data1 = &codes1[0] if codes1.shape[0] > 0 else NULL
+    cdef const int* data2 = &codes2[0] if codes2.shape[0] > 0 else NULL
+
+    if n == 0:
+        return result_np
+
+    for k in prange(n, nogil=True, schedule='dynamic', num_threads=num_threads):
+        if compute_nogil(data1 + offsets1[k], offsets1[k + 1] - offsets1[k],
+                         data2 + offsets2[k], offsets2[k + 1] - offsets2[k],
+                         &result[k, 0]) != 0:
+            failed += 1
+
+    if failed:
+        raise MemoryError(f'Unable to allocate distance matrices for {failed} pairs')
+    return result_np
+
+
 # Returns levenshtein distance as a tuple of 3 values: #substitutions, #insertions, #deletions
 def levenshtein(np.ndarray s1, np.ndarray s2) -> Tuple[int, int, int]:
     return compute(s1.astype(np.intc), s2.astype(np.intc))
+
+
+# Computes levenshtein distances for many pairs at once.
+# Sequences are given as flat code arrays with offsets (sequence k is codes[offsets[k]:offsets[k + 1]]),
+# returns an array of shape (n, 3) with #substitutions, #insertions, #deletions for every pair
+def levenshtein_batch(np.ndarray codes1, np.ndarray offsets1,
+                      np.ndarray codes2, np.ndarray offsets2, int num_threads=0) -> np.ndarray:
+    if offsets1.shape[0] != offsets2.shape[0]:
+        raise ValueError('offsets1 and offsets2 must describe the same number of sequences')
+    if num_threads <= 0:
+        num_threads = os.cpu_count() or 1
+    return compute_batch(np.ascontiguousarray(codes1, dtype=np.intc), np.ascontiguousarray(offsets1, dtype=np.longlong),
+                         np.ascontiguousarray(codes2, dtype=np.intc), np.ascontiguousarray(offsets2, dtype=np.longlong),
+                         num_threads)
+
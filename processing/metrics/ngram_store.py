@@ -0,0 +1,367 @@
+"""
+Character n-gram model with Laplace smoothing stored as sorted arrays of hashed n-grams.
+
+Tokens are unicode code points, sentences are padded with BOS/EOS ids the same way as nltk's pad_both_ends does,
+so perplexities are equal to the ones of nltk.lm.models.Laplace fitted on the same lines.
+Only n-grams of the highest order are stored together with the total count of each context,
+as Laplace smoothing never backs off to lower orders.
+"""
+
+import sys
+import json
+import mmap
+import shutil
+import tempfile
+from itertools import islice
+from multiprocessing import Pool
+from pathlib import Path
+from typing import List, Sequence, Tuple, Dict, Iterable, Iterator
+import numpy as np
+
+from .perplexity import PerplexityCache, perplexity_batch
+
+
+BOS = 0x110000
+EOS = 0x110001
+UNK = 0x110002
+
+FNV_OFFSET = np.uint64(0xcbf29ce484222325)
+FNV_PRIME = np.uint64(0x100000001b3)
+
+MAGIC = b'NGRAMLM1'
+ALIGNMENT = 64
+
+ARRAY_DTYPES = {
+    'vocab': np.uint32,
+    'keys': np.uint64,
+    'counts': np.uint64,
+    'context_keys': np.uint64,
+    'context_totals': np.uint64
+}
+
+
+def _mix(h: np.ndarray) -> np.ndarray:
+    # splitmix64 finalizer, spreads hashes uniformly over the whole 64-bit range
+    h = h ^ (h >> np.uint64(30))
+    h = h * np.uint64(0xbf58476d1ce4e5b9)
+    h = h ^ (h >> np.uint64(27))
+    h = h * np.uint64(0x94d049bb133111eb)
+    return h ^ (h >> np.uint64(31))
+
+
+def pad_encode(sents: Sequence[str], order: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Encodes sentences as one array of token ids padded with order - 1 BOS and EOS ids on both sides,
+    returns ids and offsets of the padded sentences
+    """
+    pad = order - 1
+    codes = np.frombuffer(''.join(sents).encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    lengths = np.fromiter(map(len, sents), dtype=np.int64, count=len(sents))
+
+    offsets = np.zeros(len(sents) + 1, dtype=np.int64)
+    np.cumsum(lengths + 2 * pad, out=offsets[1:])
+
+    ids = np.empty(offsets[-1], dtype=np.uint64)
+    char_offsets = np.zeros(len(sents), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=char_offsets[1:])
+    ids[np.repeat(offsets[:-1] + pad - char_offsets, lengths) + np.arange(len(codes))] = codes
+    if pad:
+        ids[(offsets[:-1, None] + np.arange(pad)).ravel()] = BOS
+        ids[(offsets[1:, None] - pad + np.arange(pad)).ravel()] = EOS
+    return ids, offsets
+
+
+def ngram_hashes(ids: np.ndarray, offsets: np.ndarray, order: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Hashes all n-grams of the given order that do not cross sentence boundaries,
+    returns hashes of n-grams, hashes of their contexts and the index of the sentence of every n-gram
+    """
+    windows = np.maximum(np.diff(offsets) - order + 1, 0)
+    sentence = np.repeat(np.arange(len(windows)), windows)
+    window_offsets = np.zeros(len(windows) + 1, dtype=np.int64)
+    np.cumsum(windows, out=window_offsets[1:])
+    starts = offsets[:-1][sentence] + np.arange(window_offsets[-1]) - window_offsets[:-1][sentence]
+
+    h = np.full(len(starts), FNV_OFFSET, dtype=np.uint64)
+    context = h
+    for j in range(order):
+        if j == order - 1:
+            context = h.copy()
+        h = (h ^ ids[starts + j]) * FNV_PRIME
+    return _mix(h), _mix(context), sentence
+
+
+def count_ngrams(sents: Sequence[str], order: int) -> Dict[str, np.ndarray]:
+    """
+    Counts n-grams of one chunk of training sentences, all arrays in the result are sorted by key
+    """
+    ids, offsets = pad_encode(sents, order)
+    keys, context_keys, _ = ngram_hashes(ids, offsets, order)
+    keys, counts = np.unique(keys, return_counts=True)
+    context_keys, context_totals = np.unique(context_keys, return_counts=True)
+    return {
+        'vocab': np.unique(ids).astype(np.uint32),
+        'keys': keys,
+        'counts': counts.astype(np.uint64),
+        'context_keys': context_keys,
+        'context_totals': context_totals.astype(np.uint64)
+    }
+
+
+def merge_counts(keys: List[np.ndarray], counts: List[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+    counts = np.bincount(inverse, weights=np.concatenate(counts), minlength=len(keys))
+    return keys, counts.astype(np.uint64)
+
+
+def _aligned(size: int) -> int:
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+def write_model(path: Path, order: int, arrays: Dict[str, List[np.ndarray]]):
+    """
+    Writes a model file, every array is given as a list of parts that are written one after another,
+    so parts may be memory-mapped files that do not fit in memory together
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    layout, offset = {}, 0
+    for name, dtype in ARRAY_DTYPES.items():
+        length = sum(len(part) for part in arrays[name])
+        layout[name] = {'dtype': np.dtype(dtype).str, 'length': length, 'offset': offset}
+        offset += _aligned(length * np.dtype(dtype).itemsize)
+    header = json.dumps({'order': order, 'arrays': layout}).encode('utf-8')
+    data_start = _aligned(len(MAGIC) + 8 + len(header))
+
+    with path.open('wb') as outp:
+        outp.write(MAGIC)
+        outp.write(len(header).to_bytes(8, 'little'))
+        outp.write(header)
+        for name, dtype in ARRAY_DTYPES.items():
+            outp.seek(data_start + layout[name]['offset'])
+            for part in arrays[name]:
+                outp.write(np.ascontiguousarray(part, dtype=dtype).tobytes())
+        outp.truncate(data_start + offset)
+
+
+def _partition(keys: np.ndarray, partition_bits: int) -> np.ndarray:
+    # hashes are uniform, so top bits give balanced partitions that are also ordered by key
+    return (keys >> np.uint64(64 - partition_bits)).astype(np.int64) if partition_bits else np.zeros(len(keys), np.int64)
+
+
+def _count_chunk(args: Tuple[int, List[str], int, Path, int]) -> np.ndarray:
+    chunk_index, sents, order, tmp_dir, partition_bits = args
+    counts = count_ngrams(sents, order)
+    for kind, values in [('keys', 'counts'), ('context_keys', 'context_totals')]:
+        partitions = _partition(counts[kind], partition_bits)
+        bounds = np.searchsorted(partitions, np.arange((1 << partition_bits) + 1))
+        for p in range(1 << partition_bits):
+            if bounds[p] == bounds[p + 1]:
+                continue
+            np.savez(tmp_dir / f'{kind}-{p:05d}-{chunk_index:08d}.npz',
+                     keys=counts[kind][bounds[p]:bounds[p + 1]], values=counts[values][bounds[p]:bounds[p + 1]])
+    return counts['vocab']
+
+
+def _merge_partitions(tmp_dir: Path, kind: str, partition_bits: int) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+    merged_keys, merged_values = [], []
+    for p in range(1 << partition_bits):
+        parts = sorted(tmp_dir.glob(f'{kind}-{p:05d}-*.npz'))
+        if not parts:
+            continue
+        keys, values = [], []
+        for part in parts:
+            with np.load(part) as data:
+                keys.append(data['keys'])
+                values.append(data['values'])
+            part.unlink()
+        keys, values = merge_counts(keys, values)
+        np.save(tmp_dir / f'merged-{kind}-{p:05d}.npy', keys)
+        np.save(tmp_dir / f'merged-{kind}-values-{p:05d}.npy', values)
+        merged_keys.append(np.load(tmp_dir / f'merged-{kind}-{p:05d}.npy', mmap_mode='r'))
+        merged_values.append(np.load(tmp_dir / f'merged-{kind}-values-{p:05d}.npy', mmap_mode='r'))
+    return merged_keys, merged_values
+
+
+def _chunks(lines: Iterable[str], chunk_size: int) -> Iterator[List[str]]:
+    lines = iter(lines)
+    while True:
+        chunk = list(islice(lines, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def fit_streaming(lines: Iterable[str], order: int, model_path: Path, num_workers: int = 1,
+                  chunk_size: int = 100000, partition_bits: int = 8, tmp_dir: Path = None):
+    """
+    Fits a compact model on a corpus that does not fit in memory and writes it to model_path.
+    Chunks of lines are counted by worker processes, partial counts are split into hash partitions on disk
+    and every partition is merged separately, so memory is bounded by the size of one partition.
+    """
+    tmp_dir = Path(tempfile.mkdtemp(prefix='ngram-', dir=tmp_dir))
+    try:
+        tasks = ((i, chunk, order, tmp_dir, partition_bits) for i, chunk in enumerate(_chunks(lines, chunk_size)))
+        vocab = np.zeros(0, dtype=np.uint32)
+        chunks = 0
+        with Pool(num_workers) as pool:
+            for chunk_vocab in pool.imap_unordered(_count_chunk, tasks):
+                vocab = np.union1d(vocab, chunk_vocab)
+                chunks += 1
+                print(f'Counted {chunks} chunks', file=sys.stderr)
+
+        print('Merging counts', file=sys.stderr)
+        keys, counts = _merge_partitions(tmp_dir, 'keys', partition_bits)
+        context_keys, context_totals = _merge_partitions(tmp_dir, 'context_keys', partition_bits)
+        write_model(model_path, order, {
+            'vocab': [vocab],
+            'keys': keys,
+            'counts': counts,
+            'context_keys': context_keys,
+            'context_totals': context_totals
+        })
+        print(f'Vocabulary size: {len(vocab) + 1}, {order}-grams: {sum(map(len, keys))}', file=sys.stderr)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return CompactNGramPerplexityScorer().load(model_path)
+
+
+def _lookup(keys: np.ndarray, values: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    if len(keys) == 0:
+        return np.zeros(len(queries), dtype=np.float64)
+    index = np.minimum(np.searchsorted(keys, queries), len(keys) - 1)
+    return np.where(keys[index] == queries, values[index], 0).astype(np.float64)
+
+
+class CompactNGramPerplexityScorer:
+    def __init__(self):
+        self.order = None
+        self.vocab = None
+        self.keys = None
+        self.counts = None
+        self.context_keys = None
+        self.context_totals = None
+        self.path = None
+        self.cache = PerplexityCache()
+        self._mmap = None
+
+    @property
+    def vocab_size(self) -> int:
+        # nltk counts <UNK> as a part of the vocabulary
+        return len(self.vocab) + 1
+
+    def fit(self, text: List[str], order: int):
+        print('Fitting n-gram model', file=sys.stderr)
+        return self.from_counts(count_ngrams(text, order), order)
+
+    def from_counts(self, counts: Dict[str, np.ndarray], order: int):
+        self.order = order
+        self.vocab = counts['vocab']
+        self.keys = counts['keys']
+        self.counts = counts['counts']
+        self.context_keys = counts['context_keys']
+        self.context_totals = counts['context_totals']
+        print(f'Vocabulary size: {self.vocab_size}, {order}-grams: {len(self.keys)}', file=sys.stderr)
+        return self
+
+    def from_laplace(self, model, order: int):
+        """
+        Converts a fitted nltk.lm.models.Laplace character model
+        """
+        def encode(token: str) -> int:
+            return {'<s>': BOS, '</s>': EOS, '<UNK>': UNK}.get(token) or ord(token)
+
+        vocab = np.array(sorted(encode(token) for token in model.vocab if token != model.vocab.unk_label), dtype=np.uint32)
+
+        ngrams, ngram_counts, contexts, context_totals = [], [], [], []
+        counts = model.counts[order] if order > 1 else {(): model.counts.unigrams}
+        for context, freqs in counts.items():
+            context = [encode(token) for token in context]
+            contexts.append(context)
+            context_totals.append(freqs.N())
+            for token, count in freqs.items():
+                ngrams.append(context + [encode(token)])
+                ngram_counts.append(count)
+
+        def hash_rows(rows: List[List[int]], length: int) -> np.ndarray:
+            ids = np.array(rows, dtype=np.uint64).reshape(len(rows), length)
+            h = np.full(len(rows), FNV_OFFSET, dtype=np.uint64)
+            for j in range(length):
+                h = (h ^ ids[:, j]) * FNV_PRIME
+            return _mix(h)
+
+        keys, ngram_counts = merge_counts([hash_rows(ngrams, order)], [np.array(ngram_counts, dtype=np.uint64)])
+        context_keys, context_totals = merge_counts([hash_rows(contexts, order - 1)],
+                                                    [np.array(context_totals, dtype=np.uint64)])
+        return self.from_counts({
+            'vocab': vocab,
+            'keys': keys,
+            'counts': ngram_counts,
+            'context_keys': context_keys,
+            'context_totals': context_totals
+        }, order)
+
+    def save(self, path: Path):
+        write_model(path, self.order, {
+            'vocab': [self.vocab],
+            'keys': [self.keys],
+            'counts': [self.counts],
+            'context_keys': [self.context_keys],
+            'context_totals': [self.context_totals]
+        })
+        return self
+
+    def load(self, path: Path):
+        """
+        Maps the model file into memory, pages are loaded lazily and shared between processes
+        """
+        with path.open('rb') as inp:
+            self._mmap = mmap.mmap(inp.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not a compact n-gram model')
+
+        header_len = int.from_bytes(self._mmap[len(MAGIC):len(MAGIC) + 8], 'little')
+        header = json.loads(self._mmap[len(MAGIC) + 8:len(MAGIC) + 8 + header_len].decode('utf-8'))
+        data_start = -(-(len(MAGIC) + 8 + header_len) // ALIGNMENT) * ALIGNMENT
+
+        self.order = header['order']
+        for name, array in header['arrays'].items():
+            setattr(self, name, np.frombuffer(self._mmap, dtype=np.dtype(array['dtype']), count=array['length'],
+                                              offset=data_start + array['offset']))
+        self.path = path
+        return self
+
+    def __getstate__(self):
+        if self.path is None:
+            return self.__dict__
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__()
+        if set(state) == {'path'}:
+            self.load(state['path'])
+        else:
+            self.__dict__.update(state)
+
+    def _score(self, sents: Sequence[str]) -> np.ndarray:
+        ids, offsets = pad_encode(sents, self.order)
+        index = np.minimum(np.searchsorted(self.vocab, ids), len(self.vocab) - 1)
+        ids = np.where(self.vocab[index] == ids, ids, UNK)
+
+        keys, context_keys, sentence = ngram_hashes(ids, offsets, self.order)
+        counts = _lookup(self.keys, self.counts, keys)
+        totals = _lookup(self.context_keys, self.context_totals, context_keys)
+        log_scores = np.log2((counts + 1) / (totals + self.vocab_size))
+
+        ngrams = np.bincount(sentence, minlength=len(sents))
+        entropy = -np.bincount(sentence, weights=log_scores, minlength=len(sents)) / ngrams
+        return np.power(2.0, entropy)
+
+    def perplexity(self, sent: str):
+        return float(self._score([sent])[0])
+
+    def perplexity_batch(self, sents: Sequence[str]) -> np.ndarray:
+        """
+        Scores many sentences at once, duplicates are scored once and results are cached
+        """
+        return perplexity_batch(sents, self.cache, self._score)
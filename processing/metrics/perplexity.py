@@ -1,19 +1,70 @@
 import sys
+from collections import OrderedDict
+from hashlib import blake2b
 from pathlib import Path
-from typing import List
+from typing import List, Sequence, Optional
 import pickle
+import numpy as np
 
-from nltk.lm.models import Laplace
-from nltk.lm.preprocessing import padded_everygram_pipeline, pad_both_ends
-from nltk.util import ngrams
+
+class PerplexityCache:
+    """
+    LRU cache of sentence perplexities keyed by sentence hash
+    """
+
+    def __init__(self, max_size: int = 1000000):
+        self.max_size = max_size
+        self.values = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(sent: str) -> bytes:
+        return blake2b(sent.encode('utf-8'), digest_size=16).digest()
+
+    def get(self, sent: str) -> Optional[float]:
+        key = self._key(sent)
+        value = self.values.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.values.move_to_end(key)
+        return value
+
+    def put(self, sent: str, value: float):
+        self.values[self._key(sent)] = value
+        if len(self.values) > self.max_size:
+            self.values.popitem(last=False)
+
+
+def perplexity_batch(sents: Sequence[str], cache: PerplexityCache, score_unique) -> np.ndarray:
+    """
+    Deduplicates sentences, takes known perplexities from the cache and scores the rest with score_unique
+    """
+    values = {}
+    for sent in sents:
+        if sent not in values:
+            values[sent] = cache.get(sent)
+
+    missing = [sent for sent, value in values.items() if value is None]
+    if missing:
+        for sent, value in zip(missing, score_unique(missing)):
+            value = float(value)
+            values[sent] = value
+            cache.put(sent, value)
+    return np.array([values[sent] for sent in sents], dtype=np.float64)
 
 
 class NGramPerplexityScorer:
     def __init__(self):
         self.model = None
         self.order = None
+        self.cache = PerplexityCache()
 
     def fit(self, text: List[str], order: int):
+        from nltk.lm.models import Laplace
+        from nltk.lm.preprocessing import padded_everygram_pipeline
         self.model = Laplace(order)
         self.order = order
         train_data, padded_sents = padded_everygram_pipeline(order, text)
@@ -43,6 +94,11 @@ class NGramPerplexityScorer:
         return self
 
     def perplexity(self, sent: str):
+        from nltk.lm.preprocessing import pad_both_ends
+        from nltk.util import ngrams
         text = pad_both_ends(sent, n=self.order)
         text_ngrams = ngrams(text, n=self.order)
         return self.model.perplexity(text_ngrams)
+
+    def perplexity_batch(self, sents: Sequence[str]) -> np.ndarray:
+        return perplexity_batch(sents, self.cache, lambda unique: [self.perplexity(sent) for sent in unique])
@@ -0,0 +1,119 @@
+import re
+from typing import Dict, List, Sequence
+from urllib.parse import unquote
+import numpy as np
+from diff_match_patch import patch_obj, diff_match_patch
+
+
+HEADER_REGEX = re.compile(r'^@@ -(\d+),?(\d*) \+(\d+),?(\d*) @@$')
+OPS = {'+': diff_match_patch.DIFF_INSERT, '-': diff_match_patch.DIFF_DELETE, ' ': diff_match_patch.DIFF_EQUAL}
+
+
+class PatchBatch:
+    """
+    Patches parsed from several patch texts, stored column-wise: positions and lengths of every patch,
+    operations and texts of all diffs, offsets of diffs of every patch and the index of the source text of every patch
+    """
+
+    def __init__(self, starts1: np.ndarray, lengths1: np.ndarray, starts2: np.ndarray, lengths2: np.ndarray,
+                 diff_offsets: np.ndarray, ops: np.ndarray, data: List[str], text_ids: np.ndarray):
+        self.starts1 = starts1
+        self.lengths1 = lengths1
+        self.starts2 = starts2
+        self.lengths2 = lengths2
+        self.diff_offsets = diff_offsets
+        self.ops = ops
+        self.data = data
+        self.text_ids = text_ids
+
+    def __len__(self) -> int:
+        return len(self.starts1)
+
+    def to_patch_objs(self, inverted: bool = False) -> List[patch_obj]:
+        """
+        Same objects as patch_fromText of every text concatenated, or as invert_patches of them with inverted
+        """
+        starts1, lengths1 = self.starts1.tolist(), self.lengths1.tolist()
+        starts2, lengths2 = self.starts2.tolist(), self.lengths2.tolist()
+        offsets = self.diff_offsets.tolist()
+        diffs = list(zip((-self.ops if inverted else self.ops).tolist(), self.data))
+
+        patches = []
+        for i in (reversed(range(len(starts1))) if inverted else range(len(starts1))):
+            patch = patch_obj()
+            if inverted:
+                patch.start1, patch.start2 = starts2[i], starts1[i]
+                patch.length1, patch.length2 = lengths2[i], lengths1[i]
+            else:
+                patch.start1, patch.start2 = starts1[i], starts2[i]
+                patch.length1, patch.length2 = lengths1[i], lengths2[i]
+            patch.diffs = diffs[offsets[i]:offsets[i + 1]]
+            patches.append(patch)
+        return patches
+
+
+def _range(start: str, length: str) -> (int, int):
+    if length == '':
+        return int(start) - 1, 1
+    elif length == '0':
+        return int(start), 0
+    return int(start) - 1, int(length)
+
+
+def parse_patches(texts: Sequence[str]) -> PatchBatch:
+    """
+    Parses texts produced by patch_toText with the same results and errors as patch_fromText,
+    every distinct escaped line is url-decoded once per batch
+    """
+    starts1, lengths1, starts2, lengths2, text_ids = [], [], [], [], []
+    diff_offsets, ops, data = [0], [], []
+    decoded: Dict[str, str] = {}
+
+    for text_id, text in enumerate(texts):
+        if not text:
+            continue
+        lines = text.split('\n')
+        i, n = 0, len(lines)
+        while i < n:
+            match = HEADER_REGEX.match(lines[i])
+            if not match:
+                raise ValueError('Invalid patch string: ' + lines[i])
+            start1, length1 = _range(match.group(1), match.group(2))
+            start2, length2 = _range(match.group(3), match.group(4))
+            starts1.append(start1)
+            lengths1.append(length1)
+            starts2.append(start2)
+            lengths2.append(length2)
+            text_ids.append(text_id)
+            i += 1
+
+            while i < n:
+                line = lines[i]
+                sign = line[:1]
+                if sign == '@':
+                    break
+                i += 1
+                if not sign:
+                    continue
+                value = line[1:]
+                if '%' in value:
+                    if value not in decoded:
+                        decoded[value] = unquote(value)
+                    value = decoded[value]
+                op = OPS.get(sign)
+                if op is None:
+                    raise ValueError("Invalid patch mode: '%s'\n%s" % (sign, value))
+                ops.append(op)
+                data.append(value)
+            diff_offsets.append(len(ops))
+
+    return PatchBatch(
+        starts1=np.array(starts1, dtype=np.int64),
+        lengths1=np.array(lengths1, dtype=np.int64),
+        starts2=np.array(starts2, dtype=np.int64),
+        lengths2=np.array(lengths2, dtype=np.int64),
+        diff_offsets=np.array(diff_offsets, dtype=np.int64),
+        ops=np.array(ops, dtype=np.int8),
+        data=data,
+        text_ids=np.array(text_ids, dtype=np.int64)
+    )
@@ -1,15 +1,24 @@
 import re
 import sys
+import time
+import shutil
+import tempfile
+from collections import Counter
 from abc import ABC, abstractmethod
-from typing import List, Tuple, Optional, Iterable
+from pathlib import Path
+from typing import Callable, List, Tuple, Optional, Iterable
 from diff_match_patch import patch_obj, diff_match_patch
-from nltk import sent_tokenize, word_tokenize
-from nltk.translate.bleu_score import sentence_bleu, SmoothingFunction
-import ray
 import numpy as np
 
-from .patch import merge_patches, invert_patches
+from .patch import merge_patches
+from .patch_parser import parse_patches
 from .tools.latex2text import LatexMarkupProcessor
+from .selector import PairFilter
+from .sink import DiffSink, MemorySink, ShardSink, read_shards
+from .instrumentation import metrics, Profiler
+from .executors import create_worker_pool
+from .scheduler import LeastLoadedScheduler, task_cost
+from .memory import MemoryGovernor
 from cosmas.generated.cosmas_pb2 import Patch
 
 
@@ -77,15 +86,19 @@ def sent_join(sents: List[str]):
 
 
 def sent_normalize(sent: str) -> str:
+    from nltk import word_tokenize
     return ' '.join(word_tokenize(sent))
 
 
-def extract_one_diff(text_before: str, text_after: str) -> Optional[Tuple[str, str]]:
-    text_before = ' '.join(filter(len, text_before.split()))
-    text_after = ' '.join(filter(len, text_after.split()))
+def split_sentences(text: str) -> List[str]:
+    from nltk import sent_tokenize
+    text = ' '.join(filter(len, text.split()))
+    return list(filter(lambda sent: len(sent) >= 5, sent_join(sent_tokenize(text))))
+
 
-    sents_before = list(filter(lambda sent: len(sent) >= 5, sent_join(sent_tokenize(text_before))))
-    sents_after = list(filter(lambda sent: len(sent) >= 5, sent_join(sent_tokenize(text_after))))
+def extract_one_diff(text_before: str, text_after: str) -> Optional[Tuple[str, str]]:
+    sents_before = split_sentences(text_before)
+    sents_after = split_sentences(text_after)
 
     prefix_len = 0
     while prefix_len < min(len(sents_before), len(sents_after)) and sents_before[prefix_len] == sents_after[prefix_len]:
@@ -104,15 +117,23 @@ def extract_one_diff(text_before: str, text_after: str) -> Optional[Tuple[str, s
     return ' '.join(sents_before[prefix_len:-suffix_len]), ' '.join(sents_after[prefix_len:-suffix_len])
 
 
+ALIGNMENT_WINDOW = 10
+
+
 def extract_multiple_diffs(text_before: str, text_after: str) -> List[Tuple[str, str]]:
-    text_before = ' '.join(filter(len, text_before.split()))
-    text_after = ' '.join(filter(len, text_after.split()))
+    sents_before = list(map(sent_normalize, split_sentences(text_before)))
+    sents_after = list(map(sent_normalize, split_sentences(text_after)))
+    return align_sentences(sents_before, sents_after)
 
-    sents_before = list(map(sent_normalize, filter(lambda sent: len(sent) >= 5, sent_join(sent_tokenize(text_before)))))
-    sents_after = list(map(sent_normalize, filter(lambda sent: len(sent) >= 5, sent_join(sent_tokenize(text_after)))))
 
+def align_sentences(sents_before: List[str], sents_after: List[str]) -> List[Tuple[str, str]]:
+    """
+    Pairs every sentence before that has no equal sentence after within the window
+    with the span of sentences after that has the best BLEU score
+    """
+    from nltk.translate.bleu_score import sentence_bleu, SmoothingFunction
     n, m = len(sents_before), len(sents_after)
-    if abs(n - m) > 10:
+    if abs(n - m) > ALIGNMENT_WINDOW:
         return []
 
     chencherry = SmoothingFunction()
@@ -121,7 +142,7 @@ def extract_multiple_diffs(text_before: str, text_after: str) -> List[Tuple[str,
     diffs = []
     while i < n:
         has_equal = False
-        for j in range(i - 10, i + 10):
+        for j in range(i - ALIGNMENT_WINDOW, i + ALIGNMENT_WINDOW):
             if j < 0 or j >= m:
                 continue
             if sents_before[i] == sents_after[j]:
@@ -132,7 +153,7 @@ def extract_multiple_diffs(text_before: str, text_after: str) -> List[Tuple[str,
             continue
 
         best_j, best_bleu = None, None
-        for j in range(i - 10, i + 10):
+        for j in range(i - ALIGNMENT_WINDOW, i + ALIGNMENT_WINDOW):
             if j < 0 or j >= m:
                 continue
 
@@ -175,47 +196,204 @@ def extract_multiple_diffs(text_before: str, text_after: str) -> List[Tuple[str,
     return diffs
 
 
+# share of characters of a sentence an edit may change for it to be paired without the alignment
+IN_PLACE_MAX_CHANGE = 0.3
+
+
+def changed_chars(text_before: str, text_after: str) -> int:
+    """
+    Length of the longer of the spans left after removing the common prefix and suffix
+    """
+    prefix = 0
+    while prefix < min(len(text_before), len(text_after)) and text_before[prefix] == text_after[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < min(len(text_before), len(text_after)) - prefix \
+            and text_before[-suffix - 1] == text_after[-suffix - 1]:
+        suffix += 1
+    return max(len(text_before), len(text_after)) - prefix - suffix
+
+
+def extract_adaptive_diffs(text_before: str, text_after: str) -> Tuple[List[Tuple[str, str]], str]:
+    """
+    Diffs of extract_multiple_diffs by a path picked from the footprint of the edit. Sentences are compared
+    as they are to find the changed region like extract_one_diff does. Small edits of separate sentences
+    that keep the number of sentences are paired directly, otherwise only sentences the alignment can reach
+    from the region are normalised and aligned.
+    Returns diffs and the path taken: unchanged, unaligned (too many sentences inserted or deleted), in_place,
+    local or full (the reachable sentences are the whole text). All paths but in_place give exactly the same diffs.
+    """
+    if text_before == text_after:
+        return [], 'unchanged'
+    raw_before, raw_after = split_sentences(text_before), split_sentences(text_after)
+    n, m = len(raw_before), len(raw_after)
+    shift = m - n
+    if abs(shift) > ALIGNMENT_WINDOW:
+        return [], 'unaligned'
+
+    prefix_len = 0
+    while prefix_len < min(n, m) and raw_before[prefix_len] == raw_after[prefix_len]:
+        prefix_len += 1
+    suffix_len = 0
+    while suffix_len < min(n, m) - prefix_len and raw_before[n - suffix_len - 1] == raw_after[m - suffix_len - 1]:
+        suffix_len += 1
+
+    # sentences of the prefix and of the suffix have equal sentences within the window, so they are skipped
+    if prefix_len + suffix_len == n and -ALIGNMENT_WINDOW <= shift < ALIGNMENT_WINDOW:
+        return [], 'unchanged'
+
+    # sentences edited in place are what the alignment pairs with themselves, unless they are rewritten,
+    # repeated nearby or next to each other so that spans of two sentences may match better
+    if n == m:
+        changed = [i for i in range(prefix_len, n - suffix_len) if raw_before[i] != raw_after[i]]
+        if all(j - i > 1 for i, j in zip(changed, changed[1:])) and all(
+                changed_chars(raw_before[i], raw_after[i]) <= IN_PLACE_MAX_CHANGE * len(raw_before[i])
+                and raw_before[i] not in raw_after[max(0, i - ALIGNMENT_WINDOW):i + ALIGNMENT_WINDOW]
+                for i in changed):
+            diffs = [(sent_normalize(raw_before[i]), sent_normalize(raw_after[i])) for i in changed]
+            return [(sent_before, sent_after) for sent_before, sent_after in diffs if sent_before != sent_after], \
+                'in_place'
+
+    # changed sentences look for equal and similar sentences after within the window and one sentence beyond it,
+    # a slice with the same offset on both sides keeps the relative positions of everything they can reach.
+    # When the shift is the window itself, sentences of the suffix are out of reach of their equals and are aligned too
+    begin = max(0, prefix_len - ALIGNMENT_WINDOW - 1)
+    end_before, end_after = n, m
+    if shift < ALIGNMENT_WINDOW:
+        end_before = min(n, n - suffix_len + 2 * ALIGNMENT_WINDOW + 2)
+        end_after = min(m, m - suffix_len + 2 * ALIGNMENT_WINDOW + 2)
+    if begin == 0 and end_before == n:
+        return align_sentences(list(map(sent_normalize, raw_before)), list(map(sent_normalize, raw_after))), 'full'
+
+    sents_before = list(map(sent_normalize, raw_before[begin:end_before]))
+    sents_after = list(map(sent_normalize, raw_after[begin:end_after]))
+    return align_sentences(sents_before, sents_after), 'local'
+
+
 class DiffExtractor(ABC):
     @abstractmethod
-    def extract_diff(self, text_before: str, text_after: str):
+    def extract_diff(self, text_before: str, text_after: str) -> Tuple[float, int, int]:
+        """
+        Returns time spent on the task in seconds, number of kept diffs and number of rejected diffs
+        """
         pass
 
     @abstractmethod
     def get_diffs(self) -> Iterable[Tuple[str, str]]:
         pass
 
+    def get_rejected(self) -> int:
+        return 0
+
+    def get_statistics(self) -> dict:
+        return {}
+
+    def close(self):
+        pass
+
+
+def create_sink(shard_path: Optional[Path]) -> DiffSink:
+    return ShardSink(shard_path) if shard_path else MemorySink()
+
 
-@ray.remote
 class OneDiffExtractor(DiffExtractor):
-    def __init__(self):
+    def __init__(self, pair_filter: Optional[PairFilter] = None, shard_path: Optional[Path] = None,
+                 profile_path: Optional[Path] = None):
         self.markup_processor = LatexMarkupProcessor()
-        self.diffs = []
+        self.pair_filter = pair_filter
+        self.sink = create_sink(shard_path)
+        self.rejected = 0
+        self.profiler = Profiler(profile_path).start()
 
-    def extract_diff(self, text_before: str, text_after: str):
+    def extract_diff(self, text_before: str, text_after: str) -> Tuple[float, int, int]:
+        start = time.perf_counter()
         text_before = self.markup_processor.remove_markup(text_before)
         text_after = self.markup_processor.remove_markup(text_after)
         diff = extract_one_diff(text_before, text_after)
-        if diff:
-            self.diffs.append(diff)
+        if diff and self.pair_filter and not self.pair_filter(diff):
+            self.rejected += 1
+            return time.perf_counter() - start, 0, 1
+        elif diff:
+            self.sink.write([diff])
+            return time.perf_counter() - start, 1, 0
+        return time.perf_counter() - start, 0, 0
 
     def get_diffs(self) -> Iterable[Tuple[str, str]]:
-        return self.diffs.copy()
+        return self.sink.drain()
+
+    def get_rejected(self) -> int:
+        return self.rejected
+
+    def close(self):
+        self.sink.close()
+        self.profiler.stop()
 
 
-@ray.remote
 class MultipleDiffExtractor(DiffExtractor):
-    def __init__(self):
+    def __init__(self, pair_filter: Optional[PairFilter] = None, shard_path: Optional[Path] = None,
+                 profile_path: Optional[Path] = None):
         self.markup_processor = LatexMarkupProcessor()
-        self.diffs = []
+        self.pair_filter = pair_filter
+        self.sink = create_sink(shard_path)
+        self.rejected = 0
+        self.profiler = Profiler(profile_path).start()
 
-    def extract_diff(self, text_before: str, text_after: str):
+    def extract_diff(self, text_before: str, text_after: str) -> Tuple[float, int, int]:
+        start = time.perf_counter()
         text_before = self.markup_processor.remove_markup(text_before)
         text_after = self.markup_processor.remove_markup(text_after)
         diffs = extract_multiple_diffs(text_before, text_after)
-        self.diffs.extend(diffs)
+        total = len(diffs)
+        if self.pair_filter:
+            diffs = list(filter(self.pair_filter, diffs))
+            self.rejected += total - len(diffs)
+        self.sink.write(diffs)
+        return time.perf_counter() - start, len(diffs), total - len(diffs)
 
     def get_diffs(self) -> Iterable[Tuple[str, str]]:
-        return self.diffs.copy()
+        return self.sink.drain()
+
+    def get_rejected(self) -> int:
+        return self.rejected
+
+    def close(self):
+        self.sink.close()
+        self.profiler.stop()
+
+
+class AdaptiveDiffExtractor(MultipleDiffExtractor):
+    """
+    Extracts the same diffs as MultipleDiffExtractor, but normalises and aligns only sentences around the edit,
+    counts how often every path of extract_adaptive_diffs is taken
+    """
+
+    def __init__(self, pair_filter: Optional[PairFilter] = None, shard_path: Optional[Path] = None,
+                 profile_path: Optional[Path] = None):
+        super().__init__(pair_filter, shard_path, profile_path)
+        self.paths = Counter()
+
+    def extract_diff(self, text_before: str, text_after: str) -> Tuple[float, int, int]:
+        start = time.perf_counter()
+        text_before = self.markup_processor.remove_markup(text_before)
+        text_after = self.markup_processor.remove_markup(text_after)
+        diffs, path = extract_adaptive_diffs(text_before, text_after)
+        self.paths[path] += 1
+        total = len(diffs)
+        if self.pair_filter:
+            diffs = list(filter(self.pair_filter, diffs))
+            self.rejected += total - len(diffs)
+        self.sink.write(diffs)
+        return time.perf_counter() - start, len(diffs), total - len(diffs)
+
+    def get_statistics(self) -> dict:
+        return dict(self.paths)
+
+
+EXTRACTORS = {
+    'one': OneDiffExtractor,
+    'multiple': MultipleDiffExtractor,
+    'adaptive': AdaptiveDiffExtractor,
+}
 
 
 class ArticleDetector:
@@ -225,6 +403,7 @@ class ArticleDetector:
         self.beamer_regex = re.compile(r'\\begin\{frame\}.*?\\end\{frame\}')
 
     def is_probably_article(self, text: str) -> bool:
+        from nltk import sent_tokenize
         if self.bibtex_regex.search(text) is not None or self.beamer_regex.search(text):
             return False
 
@@ -247,50 +426,291 @@ class ArticleDetector:
 
 
 class AdvancedPatchProcessor:
-    def __init__(self, num_cpus):
+    def __init__(self, num_cpus, pair_filter: Optional[PairFilter] = None,
+                 spill_dir: Optional[Path] = None, drain_every: int = 10000, profile_dir: Optional[Path] = None,
+                 backend: str = 'ray', scheduling: str = 'least-loaded',
+                 memory_governor: Optional[MemoryGovernor] = None, extractor: str = 'multiple'):
+        """
+        Extracted diffs are either written by each extractor to its own shard file in spill_dir,
+        or kept by extractors in memory and drained every drain_every tasks, drained chunks are written
+        to files in a temporary folder of the driver as soon as they arrive and read back by get_diffs.
+        With profile_dir every extractor saves its cProfile stats to actor-<i>.prof on close.
+        Extractors are hosted by the given backend, see processing.executors.
+        Tasks go to the extractor with the least estimated outstanding work, or round-robin.
+        With memory_governor documents and tasks wait for memory headroom and large documents are processed alone.
+        extractor is one of EXTRACTORS.
+        """
         self.patcher = diff_match_patch()
         self.article_detector = ArticleDetector()
 
-        ray.init(num_cpus=num_cpus)
         self.num_cpus = num_cpus
-        # self.actors = [OneDiffExtractor.remote() for _ in range(num_cpus)]
-        self.actors = [MultipleDiffExtractor.remote() for _ in range(num_cpus)]
+        self.shard_paths = [spill_dir / f'diffs-{i}.jsonl' for i in range(num_cpus)] if spill_dir else [None] * num_cpus
+        profile_paths = [profile_dir / f'actor-{i}.prof' for i in range(num_cpus)] if profile_dir else [None] * num_cpus
+        if extractor not in EXTRACTORS:
+            raise ValueError(f'unknown extractor {extractor}, expected one of {list(EXTRACTORS)}')
+        self.pool = create_worker_pool(backend, EXTRACTORS[extractor],
+                                       [(pair_filter, shard_path, profile_path)
+                                        for shard_path, profile_path in zip(self.shard_paths, profile_paths)])
         self.index = 0
+        self.drain_every = drain_every
+        self.drained = []
+        self.drained_paths = []
+        self.drain_dir = None if spill_dir else Path(tempfile.mkdtemp(prefix='drained-diffs-'))
+        self.pending = [[] for _ in range(num_cpus)]
+        self.scheduler = LeastLoadedScheduler(num_cpus)
+        self.round_robin = scheduling == 'round-robin'
+        self.governor = memory_governor
+
+    def submit_all(self, method: str) -> list:
+        return [self.pool.submit(worker_id, method) for worker_id in range(self.num_cpus)]
+
+    def collect_finished(self, wait: bool = False, timeout: float = 0):
+        """
+        Accounts finished extraction tasks in metrics and updates queue depth of every extractor,
+        waits up to timeout for tasks of all extractors at once or until all of them are finished with wait.
+        Spills drained chunks that are ready
+        """
+        tasks = {handle: (actor_id, cost) for actor_id, actor_tasks in enumerate(self.pending)
+                 for handle, cost in actor_tasks}
+        if tasks:
+            ready, _ = self.pool.wait(list(tasks), timeout=None if wait else timeout)
+            for handle, (seconds, kept, rejected) in zip(ready, self.pool.get(ready)):
+                actor_id, cost = tasks[handle]
+                self.scheduler.finish(actor_id, cost, seconds)
+                metrics.observe('extraction_task', seconds)
+                metrics.inc('extraction_tasks_done')
+                metrics.inc('extracted_pairs', kept)
+                metrics.inc('extractor_rejected_pairs', rejected)
+            ready = set(ready)
+            self.pending = [[(handle, cost) for handle, cost in actor_tasks if handle not in ready]
+                            for actor_tasks in self.pending]
+        for actor_id, actor_tasks in enumerate(self.pending):
+            metrics.set(f'actor_{actor_id}_queue_depth', len(actor_tasks))
+        metrics.set('queue_depth', sum(map(len, self.pending)))
+        self.spill_drained()
+
+    def spill_drained(self, wait: bool = False):
+        """
+        Writes chunks of diffs drained from extractors that are ready, or all of them with wait, to the drain folder
+        """
+        if not self.drained:
+            return
+        ready, self.drained = self.pool.wait(self.drained, timeout=None if wait else 0)
+        for diffs in self.pool.get(ready):
+            if not diffs:
+                continue
+            path = self.drain_dir / f'drained-{len(self.drained_paths)}.jsonl'
+            sink = ShardSink(path)
+            sink.write(diffs)
+            sink.close()
+            self.drained_paths.append(path)
+            metrics.inc('drained_pairs', len(diffs))
+
+    def in_flight(self) -> int:
+        return sum(map(len, self.pending))
+
+    def wait_for_memory(self, admit: Callable[[int], bool]):
+        """
+        Collects finished tasks until admit accepts the number of tasks still in flight
+        """
+        self.collect_finished()
+        if admit(self.in_flight()):
+            return
+        metrics.inc('memory_throttled')
+        with metrics.timer('memory_wait'):
+            while not admit(self.in_flight()):
+                self.collect_finished(timeout=self.governor.poll_interval)
 
     def process_patches(self, text: str, patches: List[Patch]):
+        metrics.inc('documents')
+        metrics.inc('document_bytes', len(text))
         if not self.article_detector.is_probably_article(text):
+            metrics.inc('documents_rejected_not_article')
             return
 
-        patcher = diff_match_patch()
+        with metrics.timer('patch_parse'):
+            batch = parse_patches([patch.text for patch in patches])
+        metrics.inc('patches', len(batch))
 
-        patch_objs, timestamps = [], []
-        for patch in patches:
-            new_patch_objs = patcher.patch_fromText(patch.text)
-            patch_objs.extend(new_patch_objs)
-            timestamps.extend(patch.timestamp for _ in new_patch_objs)
+        with metrics.timer('patch_inversion'):
+            inverted_patch_objs = batch.to_patch_objs(inverted=True)
+            timestamps = [patches[i].timestamp for i in batch.text_ids[::-1].tolist()]
 
-        inverted_patch_objs = invert_patches(patch_objs)
-        timestamps.reverse()
+        with metrics.timer('patch_grouping'):
+            similar_patch_objs = group_similar_patches_by_timestamps_and_distance(inverted_patch_objs, timestamps)
+        metrics.inc('patch_groups', len(similar_patch_objs))
 
-        similar_patch_objs = group_similar_patches_by_timestamps_and_distance(inverted_patch_objs, timestamps)
+        large = False
+        if self.governor:
+            large = self.governor.is_large(len(text))
+            if large:
+                metrics.inc('documents_large')
+                self.collect_finished(wait=True)
+            else:
+                self.wait_for_memory(self.governor.can_start_document)
 
         for patch_group in similar_patch_objs:
-            text_before = self.patcher.patch_apply(patch_group, text)[0]
-            self.actors[self.index % self.num_cpus].extract_diff.remote(text_before, text)
+            with metrics.timer('patch_apply'):
+                text_before = self.patcher.patch_apply(patch_group, text)[0]
+            if self.index % self.num_cpus == 0:
+                self.collect_finished()
+            cost = task_cost(text_before, text)
+            if self.governor:
+                size = len(text_before) + len(text)
+                self.wait_for_memory(lambda in_flight: self.governor.can_submit(size, in_flight))
+            actor_id = self.scheduler.assign(cost, self.index % self.num_cpus if self.round_robin else None)
+            self.pending[actor_id].append((self.pool.submit(actor_id, 'extract_diff', text_before, text), cost))
             self.index += 1
             text = text_before
 
+            if self.drain_every and self.index % self.drain_every == 0:
+                self.drained.extend(self.submit_all('get_diffs'))
+
+        if large:
+            self.collect_finished(wait=True)
+
     def get_diffs(self) -> Iterable[Tuple[str, str]]:
-        results = ray.get([actor.get_diffs.remote() for actor in self.actors])
-        for result in results:
-            for diff in result:
-                yield diff
+        self.drained.extend(self.submit_all('get_diffs'))
+        self.spill_drained(wait=True)
+        if self.drain_dir is not None:
+            yield from read_shards(self.drained_paths)
+            shutil.rmtree(self.drain_dir, ignore_errors=True)
+
+        self.collect_finished(wait=True)
+        extractor_statistics = Counter()
+        for worker_statistics in self.pool.get(self.submit_all('get_statistics')):
+            extractor_statistics.update(worker_statistics)
+        for name, count in extractor_statistics.items():
+            metrics.set(f'extractor_path_{name}', count)
+        if extractor_statistics:
+            print(f'Extraction paths: {dict(extractor_statistics)}', file=sys.stderr)
+        self.pool.get(self.submit_all('close'))
+        self.pool.shutdown()
+        statistics = self.scheduler.statistics()
+        for actor_id, utilisation in enumerate(statistics['utilisation']):
+            metrics.set(f'actor_{actor_id}_utilisation', utilisation)
+        print(f'Extractors: {statistics}', file=sys.stderr)
+        if self.shard_paths[0] is not None:
+            yield from read_shards(path for path in self.shard_paths if path.exists())
+
+    def get_rejected(self) -> int:
+        return sum(self.pool.get(self.submit_all('get_rejected')))
+
+
+COMPARE_BLOCK = 4096
+
+
+def common_prefix_length(a: str, b: str) -> int:
+    """
+    Compares blocks of both strings in C and bisects the first block that differs
+    """
+    n = min(len(a), len(b))
+    lo, hi = 0, 0
+    while lo < n:
+        hi = min(lo + COMPARE_BLOCK, n)
+        if not a.startswith(b[lo:hi], lo):
+            break
+        lo = hi
+    else:
+        return n
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if a.startswith(b[lo:mid], lo):
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+
+def common_suffix_length(a: str, b: str, limit: int) -> int:
+    n = min(len(a), len(b), limit)
+
+    def same(i: int, j: int) -> bool:
+        return a.endswith(b[len(b) - j:len(b) - i], 0, len(a) - i)
+
+    lo, hi = 0, 0
+    while lo < n:
+        hi = min(lo + COMPARE_BLOCK, n)
+        if not same(lo, hi):
+            break
+        lo = hi
+    else:
+        return n
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if same(lo, mid):
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+
+class SentenceBoundaryIndex:
+    """
+    Sorted offsets of sentence terminators of a text as understood by SimplePatchProcessor:
+    one of .?!; that is not followed by an alphanumeric character and does not end i.e, e.g, etc or et al.
+    An index for an edited text is derived by rescanning only the edited region.
+    """
+
+    eos_regex = re.compile(r'[.?!;]')
+    context_before = 5
+    context_after = 1
+
+    def __init__(self, text: str, bounds: Optional[np.ndarray] = None):
+        self.text = text
+        self.bounds = bounds if bounds is not None else np.array(self._scan(text, 0, len(text)), dtype=np.int64)
+
+    @classmethod
+    def _scan(cls, text: str, begin: int, end: int) -> List[int]:
+        bounds = []
+        for match in cls.eos_regex.finditer(text, begin, end):
+            i = match.start()
+            if i + 1 < len(text) and text[i + 1].isalnum():
+                continue
+            if i - 3 >= 0 and text[i - 3:i] in ['i.e', 'e.g', 'etc']:
+                continue
+            if i - 5 >= 0 and text[i - 5:i] in ['et al']:
+                continue
+            bounds.append(i)
+        return bounds
+
+    def updated(self, new_text: str) -> 'SentenceBoundaryIndex':
+        old_text = self.text
+        prefix = common_prefix_length(old_text, new_text)
+        suffix = common_suffix_length(old_text, new_text, min(len(old_text), len(new_text)) - prefix)
+
+        # terminators depend on one character after and five characters before them
+        begin = max(prefix - self.context_after, 0)
+        old_end = len(old_text) - suffix + self.context_before
+        new_end = min(len(new_text) - suffix + self.context_before, len(new_text))
+        delta = len(new_text) - len(old_text)
+
+        bounds = np.concatenate([
+            self.bounds[:np.searchsorted(self.bounds, begin)],
+            np.array(self._scan(new_text, begin, new_end), dtype=np.int64),
+            self.bounds[np.searchsorted(self.bounds, old_end):] + delta
+        ])
+        return SentenceBoundaryIndex(new_text, bounds)
+
+    def sentence_span(self, ind_l: int, ind_r: int) -> Tuple[int, int]:
+        """
+        Moves ind_l left to the closest terminator (or -1) and ind_r right to the closest terminator
+        (or the end of the text), the sentence is text[ind_l + 1:ind_r + 1]
+        """
+        if ind_l >= 0:
+            if ind_l >= len(self.text):
+                raise IndexError('sentence start is out of text')
+            i = int(np.searchsorted(self.bounds, ind_l, side='right'))
+            ind_l = int(self.bounds[i - 1]) if i > 0 else -1
+        if ind_r + 1 < len(self.text):
+            i = int(np.searchsorted(self.bounds, ind_r, side='left'))
+            ind_r = int(self.bounds[i]) if i < len(self.bounds) and self.bounds[i] < len(self.text) - 1 else len(self.text) - 1
+        return ind_l, ind_r
 
 
 class SimplePatchProcessor:
     def __init__(self):
         self.patcher = diff_match_patch()
-        self.eos_regex = re.compile(r'([.?!;])')
         self.total_successes = 0
         self.total_errors = 0
 
@@ -299,7 +719,7 @@ class SimplePatchProcessor:
         self.equation3_regex = re.compile(r'(^.*?(\\end\{equation\}|\\\])|(\\begin\{equation\}|\\\[).*?$)')
         self.comment_regex = re.compile(r'(^|[^\\])%.*?(\n|$)')
         self.percent_regex = re.compile(r'\\%')
-        self.quote_regex = re.compile(r'[\'"`]')
+        self.quote_table = str.maketrans({'\'': '\\\'', '"': '\\\'', '`': '\\\''})
         self.prerequisite_regex = re.compile(r'(\\document.*?(\n|$)|\\usepackage.*?(\n|$)|\\(re)?newcommand.*?(\n|$)|\\let.*?(\n|$))')
         self.label_regex = re.compile(r'\\?label\{(.*?)\}')
         self.cite_regex = re.compile(r'\\?cite.*?\{(.*?)\}')
@@ -340,77 +760,70 @@ class SimplePatchProcessor:
 
         return before_span, after_span
 
-    def _extract_sentence(self, text: str, ind_l: int, ind_r: int) -> Tuple[str, int]:
+    @staticmethod
+    def _extract_sentence(index: SentenceBoundaryIndex, ind_l: int, ind_r: int) -> Tuple[str, int]:
         try:
-            if len(text) == 0:
+            if len(index.text) == 0:
                 return '', 0
-            while ind_l >= 0:
-                if not self.eos_regex.match(text[ind_l]):
-                    ind_l -= 1
-                elif ind_l + 1 < len(text) and text[ind_l + 1].isalnum():
-                    ind_l -= 1
-                elif ind_l - 3 >= 0 and text[ind_l - 3:ind_l] in ['i.e', 'e.g', 'etc']:
-                    ind_l -= 1
-                elif ind_l - 5 >= 0 and text[ind_l - 5:ind_l] in ['et al']:
-                    ind_l -= 1
-                else:
-                    break
-            while ind_r + 1 < len(text):
-                if not self.eos_regex.match(text[ind_r]):
-                    ind_r += 1
-                elif text[ind_r + 1].isalnum():
-                    ind_r += 1
-                elif ind_r - 3 >= 0 and text[ind_r - 3:ind_r] in ['i.e', 'e.g', 'etc']:
-                    ind_r += 1
-                elif ind_r - 5 >= 0 and text[ind_r - 5:ind_r] in ['et al']:
-                    ind_r += 1
-                else:
-                    break
-            sentence = text[ind_l + 1:ind_r + 1]
+            ind_l, ind_r = index.sentence_span(ind_l, ind_r)
+            sentence = index.text[ind_l + 1:ind_r + 1]
             return sentence.strip(), 0
         except:
             return '', 1
 
     def _normalize_sentence(self, text: str) -> str:
-        text = self.equation1_regex.sub(' _MATH_ ', text)
-        text = self.equation2_regex.sub(' _MATH_ ', text)
-        text = self.equation3_regex.sub(' _MATH_ ', text)
-        text = self.comment_regex.sub(r' ', text)
-        text = self.percent_regex.sub(r' % ', text)
-        text = self.quote_regex.sub(r'\'', text)
-        text = self.prerequisite_regex.sub(r' ', text)
-        text = self.label_regex.sub(r' ', text)
-        text = self.cite_regex.sub(r' _REF_ ', text)
-        text = self.href_regex.sub(' ', text)
-        text = self.textcolor_regex.sub(r' \1 ', text)
-        text = self.text_regex.sub(r' \1 ', text)
-        text = self.includegraphics_regex.sub(r' ', text)
-        text = self.url_regex.sub(r' ', text)
-        text = self.section_regex.sub(r' ', text)
-        text = self.braces_regex.sub(r' \1 ', text)
-        text = self.cmd_regex.sub(r' ', text)
+        # only the quote substitution introduces backslashes, other substitutions never introduce $, %, { or backslashes,
+        # so stages that need them are skipped when they are absent
+        has_math = '$' in text
+        has_command = '\\' in text
+        has_braces = '{' in text
+        if has_math:
+            text = self.equation1_regex.sub(' _MATH_ ', text)
+        if has_math or has_command:
+            text = self.equation2_regex.sub(' _MATH_ ', text)
+        if has_command:
+            text = self.equation3_regex.sub(' _MATH_ ', text)
+        if '%' in text:
+            text = self.comment_regex.sub(r' ', text)
+            text = self.percent_regex.sub(r' % ', text)
+        text = text.translate(self.quote_table)
+        has_command = '\\' in text
+        if has_command:
+            text = self.prerequisite_regex.sub(r' ', text)
+        if has_braces:
+            text = self.label_regex.sub(r' ', text)
+            text = self.cite_regex.sub(r' _REF_ ', text)
+        if has_command and has_braces:
+            text = self.href_regex.sub(' ', text)
+        if has_braces:
+            text = self.textcolor_regex.sub(r' \1 ', text)
+            text = self.text_regex.sub(r' \1 ', text)
+        if has_command and has_braces:
+            text = self.includegraphics_regex.sub(r' ', text)
+            text = self.url_regex.sub(r' ', text)
+            text = self.section_regex.sub(r' ', text)
+        if has_braces:
+            text = self.braces_regex.sub(r' \1 ', text)
+        if has_command:
+            text = self.cmd_regex.sub(r' ', text)
         text = text.replace('\n', ' ').strip()
         text = self.spaces_regex.sub(r' ', text)
         return text
 
     def process_patches(self, text: str, patches: List[Patch]):
-        patcher = diff_match_patch()
-
-        patch_objs = []
-        for patch in patches:
-            patch_objs.extend(patcher.patch_fromText(patch.text))
-
-        inverted_patch_objs = invert_patches(patch_objs)
+        inverted_patch_objs = parse_patches([patch.text for patch in patches]).to_patch_objs(inverted=True)
 
         similar_patch_objs = group_similar_patches_by_distance(inverted_patch_objs)
 
         edited_pieces = []
+        index = SentenceBoundaryIndex(text)
         for patch_group in similar_patch_objs:
             before_span, after_span = self._determine_spans(text, patch_group)
             new_text = self.patcher.patch_apply(patch_group, text)[0]
+            new_index = index.updated(new_text)
 
-            piece_before, err0 = self._extract_sentence(text, before_span[0], before_span[1])
-            piece_after, err1 = self._extract_sentence(new_text, after_span[0], after_span[1])
+            piece_before, err0 = self._extract_sentence(index, before_span[0], before_span[1])
+            piece_after, err1 = self._extract_sentence(new_index, after_span[0], after_span[1])
 
             self.total_successes += 2 - err0 - err1
             self.total_errors += err0 + err1
@@ -420,7 +833,7 @@ class SimplePatchProcessor:
                     piece_before,
                     piece_after
                 ))
-            text = new_text
+            text, index = new_text, new_index
 
         self.diffs.extend((self._normalize_sentence(text_after), self._normalize_sentence(text_before))
                           for text_before, text_after in reversed(edited_pieces))
@@ -0,0 +1,57 @@
+import sys
+import ssl
+from contextlib import contextmanager
+from typing import Iterable, List
+
+
+NLTK_RESOURCES = {
+    'punkt': 'tokenizers/punkt',
+    'crubadan': 'corpora/crubadan',
+}
+
+
+def missing_nltk_resources(names: Iterable[str]) -> List[str]:
+    """
+    Returns resources that are not found in any of the local nltk data directories
+    """
+    import nltk
+    missing = []
+    for name in names:
+        try:
+            nltk.data.find(NLTK_RESOURCES[name])
+        except LookupError:
+            missing.append(name)
+    return missing
+
+
+@contextmanager
+def unverified_ssl():
+    default_context = ssl._create_default_https_context
+    ssl._create_default_https_context = ssl._create_unverified_context
+    try:
+        yield
+    finally:
+        ssl._create_default_https_context = default_context
+
+
+def ensure_nltk_resources(names: Iterable[str], offline: bool = False) -> bool:
+    """
+    Downloads only missing nltk resources, never touches the network when all of them are present or offline is set
+    """
+    missing = missing_nltk_resources(names)
+    if not missing:
+        return True
+    if offline:
+        print(f'Missing nltk resources {missing}, run without --offline once to download them', file=sys.stderr)
+        return False
+
+    import nltk
+    try:
+        with unverified_ssl():
+            for name in missing:
+                print(f'Installing nltk.{name}', file=sys.stderr)
+                nltk.download(name, raise_on_error=True)
+    except Exception:
+        print('Unable to download some of dependencies, check your internet connection', file=sys.stderr)
+        return False
+    return True
@@ -0,0 +1,65 @@
+import time
+from typing import List, Optional
+
+
+# characters a sentence is worth in task_cost: every sentence is tokenized and compared within the alignment window
+SENTENCE_COST = 100
+
+
+def sentence_count(text: str) -> int:
+    return text.count('.') + text.count('?') + text.count('!')
+
+
+def task_cost(text_before: str, text_after: str) -> int:
+    """
+    Estimated cost of extracting diffs from a pair of texts: markup removal is linear in the length of both texts,
+    normalisation and BLEU alignment grow with the number of sentences, estimated by counting terminators
+    """
+    return len(text_before) + len(text_after) + \
+        SENTENCE_COST * (sentence_count(text_before) + sentence_count(text_after))
+
+
+class LeastLoadedScheduler:
+    """
+    Assigns every task to the worker with the smallest estimated cost of unfinished tasks,
+    ties are broken by the lowest worker id. Finished tasks must be reported with finish.
+    """
+
+    def __init__(self, num_workers: int):
+        self.num_workers = num_workers
+        self.outstanding = [0] * num_workers
+        self.assigned = [0] * num_workers
+        self.completed = [0] * num_workers
+        self.busy_seconds = [0.0] * num_workers
+        self.started = time.perf_counter()
+
+    def assign(self, cost: int, worker_id: Optional[int] = None) -> int:
+        """
+        Returns the worker for a task, worker_id forces the choice and only accounts the task
+        """
+        if worker_id is None:
+            worker_id = min(range(self.num_workers), key=self.outstanding.__getitem__)
+        self.outstanding[worker_id] += cost
+        self.assigned[worker_id] += 1
+        return worker_id
+
+    def finish(self, worker_id: int, cost: int, seconds: float):
+        self.outstanding[worker_id] -= cost
+        self.completed[worker_id] += 1
+        self.busy_seconds[worker_id] += seconds
+
+    def utilisation(self) -> List[float]:
+        """
+        Share of wall time since creation each worker spent on finished tasks
+        """
+        elapsed = time.perf_counter() - self.started
+        return [busy / elapsed if elapsed else 0.0 for busy in self.busy_seconds]
+
+    def statistics(self) -> dict:
+        utilisation = self.utilisation()
+        return {
+            'tasks': self.assigned,
+            'busy_seconds': [round(busy, 3) for busy in self.busy_seconds],
+            'utilisation': [round(u, 3) for u in utilisation],
+            'mean_utilisation': round(sum(utilisation) / self.num_workers, 3),
+        }
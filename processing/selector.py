@@ -1,10 +1,17 @@
 import sys
 import re
-from typing import List, Tuple
+from collections import Counter
+from itertools import chain, islice
+from multiprocessing import Pool
+from typing import List, Tuple, Iterable, Iterator, Optional
+import numpy as np
 from tqdm import tqdm
-from langdetect import detect
 
 from .metrics import char_edit_distance, word_edit_distance, latin_alphabet_ratio, NGramPerplexityScorer
+from .metrics import char_edit_distance_batch, word_edit_distance_batch, latin_alphabet_ratio_batch
+from .language import EnglishDetector
+from .instrumentation import metrics
+from .dedup import Deduplicator
 
 
 class SentencePair:
@@ -22,6 +29,40 @@ class SentencePair:
         self.source_perplexity = 0 if perplexity_scorer is None else perplexity_scorer.perplexity(source_sent)
         self.target_perplexity = 0 if perplexity_scorer is None else perplexity_scorer.perplexity(target_sent)
 
+    @classmethod
+    def batch(cls, sentence_pairs: List[Tuple[str, str]], perplexity_scorer=None,
+              num_threads: int = 0) -> List['SentencePair']:
+        """
+        Metrics of all pairs at once, edit distances run on num_threads OpenMP threads, 0 means all cpus
+        """
+        if not sentence_pairs:
+            return []
+        source_sents = [pair[0] for pair in sentence_pairs]
+        target_sents = [pair[1] for pair in sentence_pairs]
+
+        char_distances = char_edit_distance_batch(source_sents, target_sents, no_digits=True, summarized=True,
+                                                  num_threads=num_threads)
+        alpha_ratios = np.minimum(latin_alphabet_ratio_batch(source_sents), latin_alphabet_ratio_batch(target_sents))
+        word_distances = word_edit_distance_batch(source_sents, target_sents, summarized=False,
+                                                  num_threads=num_threads)
+        if perplexity_scorer is not None:
+            perplexities = perplexity_scorer.perplexity_batch(source_sents + target_sents)
+
+        result = []
+        for k, (source_sent, target_sent) in enumerate(sentence_pairs):
+            sp = cls.__new__(cls)
+            sp.source_sent = source_sent
+            sp.target_sent = target_sent
+            sp.char_distance = int(char_distances[k])
+            sp.alpha_ratio = float(alpha_ratios[k])
+            sp.word_substitutions = int(word_distances[k, 0])
+            sp.word_insertions = int(word_distances[k, 1])
+            sp.word_deletions = int(word_distances[k, 2])
+            sp.source_perplexity = 0 if perplexity_scorer is None else float(perplexities[k])
+            sp.target_perplexity = 0 if perplexity_scorer is None else float(perplexities[len(sentence_pairs) + k])
+            result.append(sp)
+        return result
+
     def print_formatted(self):
         print(f'source sentence: {self.source_sent}\n'
               f'target sentence: {self.target_sent}\n'
@@ -31,49 +72,270 @@ class SentencePair:
 
 
 def is_probably_english(sent: str):
+    from langdetect import detect
     try:
         return detect(sent) == 'en'
     except:
         return False
 
 
-def select_sentence_pairs(sentence_pairs: List[Tuple[str, str]], sent_regex: str = None,
+def english_mask(sentence_pairs: List[SentencePair], detector: EnglishDetector) -> List[bool]:
+    """
+    Whether the source or, if it is not, the target sentence of every pair is english
+    """
+    is_english = detector.is_english_batch([sp.source_sent for sp in sentence_pairs])
+    rest = [sp for sp, english in zip(sentence_pairs, is_english) if not english]
+    rest_is_english = iter(detector.is_english_batch([sp.target_sent for sp in rest]))
+    return [bool(english or next(rest_is_english)) for english in is_english]
+
+
+def select_english(sentence_pairs: List[SentencePair], detector: EnglishDetector) -> List[SentencePair]:
+    return [sp for sp, english in zip(sentence_pairs, english_mask(sentence_pairs, detector)) if english]
+
+
+def batched(items: Iterable, batch_size: int) -> Iterator[list]:
+    items = iter(items)
+    while True:
+        batch = list(islice(items, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+class PairFilter:
+    """
+    Cheap stateless checks of raw sentence pairs that do not need any metrics or models.
+    Used by the selector and, as a pre-filter, inside extractor workers.
+    """
+
+    def __init__(self, sent_regex: str = None, min_length: int = None, max_length: int = None,
+                 min_alpha_ratio: float = None, drop_identical: bool = False):
+        self.sent_regex = re.compile(sent_regex) if sent_regex else None
+        self.min_length = min_length or 0
+        self.max_length = max_length or int(1e9)
+        self.min_alpha_ratio = min_alpha_ratio or 0.0
+        self.drop_identical = drop_identical
+
+    def length_ok(self, pair: Tuple[str, str]) -> bool:
+        return self.min_length <= min(len(pair[0]), len(pair[1])) and max(len(pair[0]), len(pair[1])) <= self.max_length
+
+    def regex_ok(self, pair: Tuple[str, str]) -> bool:
+        return self.sent_regex is None or bool(self.sent_regex.fullmatch(pair[0]) and self.sent_regex.fullmatch(pair[1]))
+
+    def alpha_ratio_ok(self, pair: Tuple[str, str]) -> bool:
+        return min(latin_alphabet_ratio(pair[0]), latin_alphabet_ratio(pair[1])) >= self.min_alpha_ratio
+
+    def identical_ok(self, pair: Tuple[str, str]) -> bool:
+        return not self.drop_identical or pair[0] != pair[1]
+
+    def __call__(self, pair: Tuple[str, str]) -> bool:
+        return self.identical_ok(pair) and self.length_ok(pair) and self.regex_ok(pair) and self.alpha_ratio_ok(pair)
+
+
+class PairSelector:
+    def __init__(self, sent_regex: str = None,
+                 min_length: int = None, max_length: int = None,
+                 min_char_levenshtein: int = None, max_char_levenshtein: int = None,
+                 min_alpha_ratio: float = None,
+                 perplexity_scorer: NGramPerplexityScorer = None,
+                 language_detector: EnglishDetector = None):
+        self.pair_filter = PairFilter(sent_regex=sent_regex, min_length=min_length, max_length=max_length)
+        self.sent_regex = self.pair_filter.sent_regex
+        self.min_length = self.pair_filter.min_length
+        self.max_length = self.pair_filter.max_length
+        self.min_char_levenshtein = min_char_levenshtein or -1
+        self.max_char_levenshtein = max_char_levenshtein or int(1e9)
+        self.min_alpha_ratio = min_alpha_ratio or 0.0
+        self.perplexity_scorer = perplexity_scorer
+        self.language_detector = language_detector or EnglishDetector()
+        self.num_threads = 0
+
+    def describe(self):
+        print(f'Filtering sentence pairs by length [{self.min_length}, {self.max_length}]', file=sys.stderr)
+        if self.sent_regex:
+            print(f'Filtering sentence pairs with regex: {self.sent_regex.pattern}', file=sys.stderr)
+        print(f'Filtering sentence pairs by levenshtein distance '
+              f'[{self.min_char_levenshtein}, {self.max_char_levenshtein}]', file=sys.stderr)
+        print(f'Filtering sentence pairs by alphabetic symbols ratio >= {self.min_alpha_ratio}', file=sys.stderr)
+        print('Filtering english sentences', file=sys.stderr)
+
+    def select(self, sentence_pairs: List[Tuple[str, str]]) -> Tuple[List[SentencePair], Counter]:
+        """
+        Runs all filters over one batch of pairs, returns selected pairs and the number of pairs rejected by each filter
+        """
+        rejected = Counter()
+
+        def count(name: str, before: int, after: list):
+            rejected[name] += before - len(after)
+            return after
+
+        pairs = count('length', len(sentence_pairs), list(filter(self.pair_filter.length_ok, sentence_pairs)))
+        if self.sent_regex:
+            pairs = count('regex', len(pairs), list(filter(self.pair_filter.regex_ok, pairs)))
+
+        sps = SentencePair.batch(pairs, perplexity_scorer=self.perplexity_scorer, num_threads=self.num_threads)
+        sps = count('levenshtein', len(sps), [
+            sp for sp in sps if self.min_char_levenshtein <= sp.char_distance <= self.max_char_levenshtein
+        ])
+        sps = count('alpha_ratio', len(sps), [sp for sp in sps if sp.alpha_ratio >= self.min_alpha_ratio])
+        sps = count('language', len(sps), select_english(sps, self.language_detector))
+        return sps, rejected
+
+    def measure(self, sentence_pairs: List[Tuple[str, str]]) -> dict:
+        """
+        Columns of all metrics and filter verdicts of one batch of pairs, no pair is filtered out
+        """
+        sps = SentencePair.batch(sentence_pairs, perplexity_scorer=self.perplexity_scorer,
+                                 num_threads=self.num_threads)
+        columns = {
+            'original_sent': [sp.source_sent for sp in sps],
+            'edited_sent': [sp.target_sent for sp in sps],
+            'min_length': [min(len(sp.source_sent), len(sp.target_sent)) for sp in sps],
+            'max_length': [max(len(sp.source_sent), len(sp.target_sent)) for sp in sps],
+            'regex_ok': [self.pair_filter.regex_ok(pair) for pair in sentence_pairs],
+            'char_distance': [sp.char_distance for sp in sps],
+            'word_substitutions': [sp.word_substitutions for sp in sps],
+            'word_insertions': [sp.word_insertions for sp in sps],
+            'word_deletions': [sp.word_deletions for sp in sps],
+            'alpha_ratio': [sp.alpha_ratio for sp in sps],
+            'english': english_mask(sps, self.language_detector),
+        }
+        if self.perplexity_scorer is not None:
+            columns['source_perplexity'] = [sp.source_perplexity for sp in sps]
+            columns['target_perplexity'] = [sp.target_perplexity for sp in sps]
+        return columns
+
+
+_worker_selector: Optional[PairSelector] = None
+
+
+def _init_worker(selector: PairSelector, num_threads: int):
+    global _worker_selector
+    _worker_selector = selector
+    _worker_selector.num_threads = num_threads
+
+
+def _select_in_worker(sentence_pairs: List[Tuple[str, str]]) -> Tuple[int, List[SentencePair], Counter]:
+    selected, rejected = _worker_selector.select(sentence_pairs)
+    return len(sentence_pairs), selected, rejected
+
+
+def _measure_in_worker(sentence_pairs: List[Tuple[str, str]]) -> dict:
+    return _worker_selector.measure(sentence_pairs)
+
+
+def _map_batches(selector: PairSelector, function, batches: Iterable[list], num_workers: int) -> Iterator:
+    """
+    Applies a worker function to batches in order, on a process pool with num_workers > 1
+    unless there is a single batch. Pool workers compute edit distances on one thread each,
+    otherwise they would start num_workers times cpu count threads
+    """
+    batches = iter(batches)
+    first = list(islice(batches, 2))
+    if num_workers > 1 and len(first) > 1:
+        with Pool(num_workers, initializer=_init_worker, initargs=(selector, 1)) as pool:
+            yield from pool.imap(function, chain(first, batches))
+    else:
+        _init_worker(selector, 0)
+        yield from map(function, chain(first, batches))
+
+
+def _deduplicated(batches: Iterable[list], deduplicator: Deduplicator, rejected: Counter, progress) -> Iterator[list]:
+    for batch in batches:
+        removed = Counter(deduplicator.removed)
+        with metrics.timer('dedup'):
+            kept = deduplicator.filter(batch)
+        removed = deduplicator.removed - removed
+        rejected.update(removed)
+        progress.update(len(batch) - len(kept))
+        metrics.inc('selection_pairs', len(batch) - len(kept))
+        for name, count in removed.items():
+            metrics.inc(f'selection_rejected_{name}', count)
+        yield kept
+
+
+def select_sentence_pairs(sentence_pairs: Iterable[Tuple[str, str]], sent_regex: str = None,
                           min_length: int = None, max_length: int = None,
                           min_char_levenshtein: int = None, max_char_levenshtein: int = None,
                           min_alpha_ratio: float = None,
-                          perplexity_scorer: NGramPerplexityScorer = None) -> List[SentencePair]:
-    if not min_length:
-        min_length = 0
-    if not max_length:
-        max_length = int(1e9)
-    if not min_char_levenshtein:
-        min_char_levenshtein = -1
-    if not max_char_levenshtein:
-        max_char_levenshtein = int(1e9)
-    if not min_alpha_ratio:
-        min_alpha_ratio = 0.0
+                          perplexity_scorer: NGramPerplexityScorer = None,
+                          language_detector: EnglishDetector = None,
+                          batch_size: int = 10000, num_workers: int = 1,
+                          deduplicator: Optional[Deduplicator] = None) -> List[SentencePair]:
+    """
+    Selects sentence pairs that pass all filters, keeping the input order.
+    With num_workers > 1 batches are processed on a process pool, each worker holds its own copy
+    of the perplexity scorer and the language detector that is created once per worker.
+    With deduplicator duplicates are removed from every batch before any metrics are computed.
+    """
+    selector = PairSelector(sent_regex=sent_regex, min_length=min_length, max_length=max_length,
+                            min_char_levenshtein=min_char_levenshtein, max_char_levenshtein=max_char_levenshtein,
+                            min_alpha_ratio=min_alpha_ratio, perplexity_scorer=perplexity_scorer,
+                            language_detector=language_detector)
+    selector.describe()
+    if deduplicator:
+        print(deduplicator.describe(), file=sys.stderr)
 
-    print(f'Filtering sentence pairs by length [{min_length}, {max_length}]', file=sys.stderr)
-    sentence_pairs = filter(lambda pair: min_length <= min(len(pair[0]), len(pair[1])), sentence_pairs)
-    sentence_pairs = filter(lambda pair: max(len(pair[0]), len(pair[1])) <= max_length, sentence_pairs)
+    batches = batched(sentence_pairs, batch_size)
+    progress = tqdm(unit='pairs', file=sys.stderr)
+    rejected = Counter()
+    result = []
 
-    if sent_regex:
-        print(f'Filtering sentence pairs with regex: {sent_regex}', file=sys.stderr)
-        sent_regex = re.compile(sent_regex)
-        sentence_pairs = filter(lambda pair: sent_regex.fullmatch(pair[0]) and sent_regex.fullmatch(pair[1]), sentence_pairs)
+    if deduplicator:
+        batches = _deduplicated(batches, deduplicator, rejected, progress)
 
-    sentence_pairs = map(lambda pair: SentencePair(*pair, perplexity_scorer=perplexity_scorer), sentence_pairs)
+    def collect(processed: int, selected: List[SentencePair], batch_rejected: Counter):
+        result.extend(selected)
+        rejected.update(batch_rejected)
+        progress.update(processed)
+        metrics.inc('selection_pairs', processed)
+        metrics.inc('selection_selected', len(selected))
+        for name, count in batch_rejected.items():
+            metrics.inc(f'selection_rejected_{name}', count)
 
-    print(f'Filtering sentence pairs by levenshtein distance [{min_char_levenshtein}, {max_char_levenshtein}]', file=sys.stderr)
-    sentence_pairs = filter(lambda sp: min_char_levenshtein <= sp.char_distance <= max_char_levenshtein, sentence_pairs)
+    with metrics.timer('selection'):
+        for processed, selected, batch_rejected in _map_batches(selector, _select_in_worker, batches, num_workers):
+            collect(processed, selected, batch_rejected)
+    progress.close()
 
-    print(f'Filtering sentence pairs by alphabetic symbols ratio >= {min_alpha_ratio}', file=sys.stderr)
-    sentence_pairs = filter(lambda sp: sp.alpha_ratio >= min_alpha_ratio, sentence_pairs)
+    print(f'Rejected sentence pairs: {dict(rejected)}', file=sys.stderr)
+    if num_workers <= 1:
+        print(f'Language detection: {selector.language_detector.statistics()}', file=sys.stderr)
+    print('Done', file=sys.stderr)
+    return result
 
-    print('Filtering english sentences', file=sys.stderr)
-    sentence_pairs = filter(lambda sp: is_probably_english(sp.source_sent) or is_probably_english(sp.target_sent), sentence_pairs)
 
-    sentence_pairs = list(sentence_pairs)
+def measure_sentence_pairs(sentence_pairs: Iterable[Tuple[str, str]], sent_regex: str = None,
+                           perplexity_scorer: NGramPerplexityScorer = None,
+                           language_detector: EnglishDetector = None,
+                           batch_size: int = 10000, num_workers: int = 1,
+                           deduplicator: Optional[Deduplicator] = None):
+    """
+    Computes every metric select_sentence_pairs filters by for all pairs once and returns them as a data frame
+    in the input order, selections with any thresholds are then masks over its columns, see processing.sweep
+    """
+    import pandas as pd
+    selector = PairSelector(sent_regex=sent_regex, perplexity_scorer=perplexity_scorer,
+                            language_detector=language_detector)
+    if deduplicator:
+        print(deduplicator.describe(), file=sys.stderr)
 
-    print('Done', file=sys.stderr)
-    return sentence_pairs
+    batches = batched(sentence_pairs, batch_size)
+    progress = tqdm(unit='pairs', file=sys.stderr)
+    rejected = Counter()
+    if deduplicator:
+        batches = _deduplicated(batches, deduplicator, rejected, progress)
+
+    tables = []
+    with metrics.timer('metrics_table'):
+        for columns in _map_batches(selector, _measure_in_worker, batches, num_workers):
+            tables.append(pd.DataFrame(columns))
+            progress.update(len(tables[-1]))
+            metrics.inc('metrics_table_pairs', len(tables[-1]))
+    progress.close()
+    if rejected:
+        print(f'Removed sentence pairs: {dict(rejected)}', file=sys.stderr)
+
+    if not tables:
+        return pd.DataFrame(selector.measure([]))
+    return pd.concat(tables, ignore_index=True)
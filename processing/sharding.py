@@ -0,0 +1,93 @@
+import os
+import json
+import heapq
+from hashlib import blake2b
+from pathlib import Path
+from typing import Dict, List, Optional
+
+VIRTUAL_BUCKETS = 1024
+
+
+def stable_hash(doc_id: str) -> int:
+    """
+    Hash that is the same on every machine and every run, unlike the builtin hash of str
+    """
+    return int.from_bytes(blake2b(doc_id.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def document_sizes(patches_dir: Path, doc_ids: List[str]) -> Dict[str, int]:
+    """
+    Total size in bytes of patch files of every document
+    """
+    sizes = {}
+    for doc_id in doc_ids:
+        doc_dir = patches_dir / doc_id
+        sizes[doc_id] = sum(entry.stat().st_size for entry in os.scandir(doc_dir) if entry.is_file()) \
+            if doc_dir.is_dir() else 0
+    return sizes
+
+
+def virtual_bucket(doc_id: str) -> int:
+    """
+    Fixed bucket of a document by the stable hash of its id, buckets are the units shards are balanced with
+    """
+    return stable_hash(doc_id) % VIRTUAL_BUCKETS
+
+
+def assign_buckets(sizes: Dict[str, int], shard_count: int) -> List[int]:
+    """
+    Shard of every virtual bucket, buckets go largest first by total patch bytes to the least loaded shard,
+    ties are broken by bucket id and shard index. It depends only on the snapshot of the store,
+    so every node that sees the same snapshot computes the same assignment
+    """
+    bucket_sizes = [0] * VIRTUAL_BUCKETS
+    for doc_id, size in sizes.items():
+        bucket_sizes[virtual_bucket(doc_id)] += size
+    loads = [(0, shard) for shard in range(shard_count)]
+    shards = [0] * VIRTUAL_BUCKETS
+    for bucket in sorted(range(VIRTUAL_BUCKETS), key=lambda b: (-bucket_sizes[b], b)):
+        load, shard = heapq.heappop(loads)
+        shards[bucket] = shard
+        heapq.heappush(loads, (load + bucket_sizes[bucket], shard))
+    return shards
+
+
+def store_snapshot(content_dir: Path, patches_dir: Path) -> str:
+    """
+    Digest of sorted ids and patch sizes of all documents, datasets built from different snapshots of the store
+    have different digests and are not merged
+    """
+    doc_ids = sorted(path.name for path in content_dir.iterdir() if path.is_dir())
+    sizes = document_sizes(patches_dir, doc_ids)
+    digest = blake2b(digest_size=16)
+    for doc_id in doc_ids:
+        digest.update(f'{doc_id}\t{sizes[doc_id]}\n'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def shard_doc_ids(content_dir: Path, patches_dir: Path, shard_index: int, shard_count: int) -> List[str]:
+    """
+    Sorted ids of documents of content_dir that belong to the given shard
+    """
+    doc_ids = sorted(path.name for path in content_dir.iterdir() if path.is_dir())
+    shards = assign_buckets(document_sizes(patches_dir, doc_ids), shard_count)
+    return [doc_id for doc_id in doc_ids if shards[virtual_bucket(doc_id)] == shard_index]
+
+
+def shard_info_path(dataset_path: Path) -> Path:
+    return dataset_path.with_name(dataset_path.name + '.shard.json')
+
+
+def write_shard_info(dataset_path: Path, shard_index: int, shard_count: int, documents: int, pairs: int,
+                     snapshot: Optional[str]):
+    """
+    Saves which shard of which snapshot of the store a dataset was built from next to it,
+    merge_datasets.py checks that no shard is missing and all of them come from the same snapshot
+    """
+    info = {'shard_index': shard_index, 'shard_count': shard_count, 'documents': documents, 'pairs': pairs,
+            'snapshot': snapshot}
+    shard_info_path(dataset_path).write_text(json.dumps(info, indent=2))
+
+
+def read_shard_info(dataset_path: Path) -> dict:
+    return json.loads(shard_info_path(dataset_path).read_text())
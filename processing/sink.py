@@ -0,0 +1,66 @@
+import json
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import List, Tuple, Iterable, Iterator
+
+
+class DiffSink(ABC):
+    @abstractmethod
+    def write(self, diffs: Iterable[Tuple[str, str]]):
+        pass
+
+    @abstractmethod
+    def drain(self) -> List[Tuple[str, str]]:
+        pass
+
+    def close(self):
+        pass
+
+
+class MemorySink(DiffSink):
+    """
+    Keeps diffs in memory until they are drained, every diff is handed out exactly once
+    """
+
+    def __init__(self):
+        self.diffs = []
+
+    def write(self, diffs: Iterable[Tuple[str, str]]):
+        self.diffs.extend(diffs)
+
+    def drain(self) -> List[Tuple[str, str]]:
+        diffs, self.diffs = self.diffs, []
+        return diffs
+
+
+class ShardSink(DiffSink):
+    """
+    Appends diffs to a shard file as json lines, so that memory usage does not grow with the number of diffs
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = path.open('w', encoding='utf-8')
+
+    def write(self, diffs: Iterable[Tuple[str, str]]):
+        for diff in diffs:
+            self.file.write(json.dumps(diff, ensure_ascii=False))
+            self.file.write('\n')
+
+    def drain(self) -> List[Tuple[str, str]]:
+        self.file.flush()
+        return []
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+def read_shards(paths: Iterable[Path]) -> Iterator[Tuple[str, str]]:
+    for path in paths:
+        with path.open('r', encoding='utf-8') as inp:
+            for line in inp:
+                if line.strip():
+                    before, after = json.loads(line)
+                    yield before, after
@@ -0,0 +1,155 @@
+import os
+import sys
+import sqlite3
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+from google.protobuf.message import DecodeError
+from cosmas.generated.cosmas_pb2 import PatchList
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    file_id TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    patch_count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS patches (
+    path TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    file_id TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    user_id TEXT NOT NULL,
+    user_name TEXT NOT NULL,
+    text_size INTEGER NOT NULL,
+    PRIMARY KEY (path, idx)
+);
+CREATE INDEX IF NOT EXISTS files_file_id ON files (file_id, timestamp);
+CREATE INDEX IF NOT EXISTS patches_file_id ON patches (file_id, timestamp);
+CREATE INDEX IF NOT EXISTS patches_user_id ON patches (user_id, timestamp);
+CREATE INDEX IF NOT EXISTS patches_user_name ON patches (user_name, timestamp);
+CREATE INDEX IF NOT EXISTS patches_timestamp ON patches (timestamp);
+'''
+
+
+class PatchStoreIndex:
+    """
+    Persistent sqlite index over the patch store written by load_patches.py
+    (<store>/patches/<fileId>/<timestamp> and <store>/content/<fileId>/<timestamp>).
+    Files are only parsed when they are new or their size or modification time changed.
+    """
+
+    def __init__(self, store_dir: Path, index_path: Optional[Path] = None):
+        self.store_dir = store_dir
+        self.index_path = index_path or store_dir / 'index.sqlite'
+        self.connection = sqlite3.connect(str(self.index_path))
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def _scan(self, kind: str, file_id: Optional[str] = None) -> Iterator[Tuple[str, str, int, os.stat_result]]:
+        kind_dir = self.store_dir / kind
+        if not kind_dir.exists():
+            return
+        if file_id is not None:
+            doc_dirs = [(file_id, str(kind_dir / file_id))] if (kind_dir / file_id).is_dir() else []
+        else:
+            doc_dirs = [(entry.name, entry.path) for entry in os.scandir(kind_dir) if entry.is_dir()]
+        for doc_id, doc_dir in doc_dirs:
+            for entry in os.scandir(doc_dir):
+                if entry.is_file() and entry.name.isdigit():
+                    yield entry.path, doc_id, int(entry.name), entry.stat()
+
+    def update(self, file_id: Optional[str] = None) -> Tuple[int, int]:
+        """
+        Brings the index up to date with the store, or only with files of one document,
+        returns the number of indexed and removed files. Patch lists that cannot be parsed are reported and left out
+        """
+        where, params = self._conditions(file_id=file_id)
+        known = {path: (size, mtime)
+                 for path, size, mtime in self.connection.execute('SELECT path, size, mtime FROM files' + where, params)}
+        seen, indexed = set(), 0
+
+        with self.connection:
+            for kind in ['patches', 'content']:
+                for path, doc_id, timestamp, stat in self._scan(kind, file_id):
+                    seen.add(path)
+                    if known.get(path) == (stat.st_size, stat.st_mtime):
+                        continue
+
+                    rows = []
+                    if kind == 'patches':
+                        patch_list = PatchList()
+                        try:
+                            patch_list.ParseFromString(Path(path).read_bytes())
+                        except DecodeError as e:
+                            print(f'Skipping {path}: {e}', file=sys.stderr)
+                            seen.discard(path)
+                            continue
+                        rows = [(path, i, doc_id, patch.timestamp, patch.userId, patch.userName, len(patch.text))
+                                for i, patch in enumerate(patch_list.patches)]
+                        self.connection.execute('DELETE FROM patches WHERE path = ?', (path,))
+                        self.connection.executemany('INSERT INTO patches VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+                    self.connection.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                            (path, kind, doc_id, timestamp, stat.st_size, stat.st_mtime, len(rows)))
+                    indexed += 1
+
+            removed = [(path,) for path in known if path not in seen]
+            self.connection.executemany('DELETE FROM patches WHERE path = ?', removed)
+            self.connection.executemany('DELETE FROM files WHERE path = ?', removed)
+        return indexed, len(removed)
+
+    @staticmethod
+    def _conditions(file_id: Optional[str] = None, user: Optional[str] = None,
+                    since: Optional[int] = None, until: Optional[int] = None) -> Tuple[str, list]:
+        conditions, params = [], []
+        if file_id is not None:
+            conditions.append('file_id = ?')
+            params.append(file_id)
+        if user is not None:
+            conditions.append('(user_id = ? OR user_name = ?)')
+            params.extend([user, user])
+        if since is not None:
+            conditions.append('timestamp >= ?')
+            params.append(since)
+        if until is not None:
+            conditions.append('timestamp < ?')
+            params.append(until)
+        return (' WHERE ' + ' AND '.join(conditions)) if conditions else '', params
+
+    def patches(self, **filters) -> List[tuple]:
+        where, params = self._conditions(**filters)
+        return self.connection.execute(
+            'SELECT path, idx, file_id, timestamp, user_id, user_name, text_size FROM patches'
+            + where + ' ORDER BY file_id, timestamp, path, idx', params).fetchall()
+
+    def files(self, file_id: Optional[str] = None, since: Optional[int] = None, until: Optional[int] = None) -> List[tuple]:
+        where, params = self._conditions(file_id=file_id, since=since, until=until)
+        return self.connection.execute(
+            'SELECT path, kind, file_id, timestamp, size, patch_count FROM files'
+            + where + ' ORDER BY file_id, kind, timestamp', params).fetchall()
+
+    def stats(self, group_by: Optional[str] = None, **filters) -> List[tuple]:
+        """
+        Aggregates patch count, patch text bytes, number of documents and time range, optionally per user or document
+        """
+        columns = {None: None, 'user': 'user_name', 'file': 'file_id',
+                   'day': "date(timestamp / 1000, 'unixepoch')"}[group_by]
+        where, params = self._conditions(**filters)
+        select = (columns + ', ' if columns else '') + \
+            'COUNT(*), SUM(text_size), COUNT(DISTINCT file_id), MIN(timestamp), MAX(timestamp) FROM patches'
+        query = 'SELECT ' + select + where
+        if columns:
+            query += f' GROUP BY {columns} ORDER BY COUNT(*) DESC'
+        return self.connection.execute(query, params).fetchall()
+
+    def document_sizes(self) -> List[Tuple[str, int]]:
+        """
+        Total size in bytes of stored patch lists of every document
+        """
+        return self.connection.execute(
+            "SELECT file_id, SUM(size) FROM files WHERE kind = 'patches' GROUP BY file_id ORDER BY file_id").fetchall()
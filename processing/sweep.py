@@ -0,0 +1,83 @@
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from itertools import product
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+import pandas as pd
+
+
+FILTERS = ['length', 'regex', 'levenshtein', 'alpha_ratio', 'language']
+
+
+@dataclass
+class SelectionConfig:
+    """
+    Thresholds of select_sentence_pairs, unset and zero values disable a bound like there
+    """
+    min_length: Optional[int] = 1
+    max_length: Optional[int] = None
+    min_edit_distance: Optional[int] = 1
+    max_edit_distance: Optional[int] = 25
+    min_alpha_ratio: Optional[float] = 0.65
+
+    @property
+    def name(self) -> str:
+        return '_'.join(f'{key}-{"none" if value is None else value}' for key, value in asdict(self).items())
+
+
+def filter_masks(table: pd.DataFrame, config: SelectionConfig) -> Dict[str, np.ndarray]:
+    """
+    Boolean mask of pairs passing every filter of select_sentence_pairs, in the order they are applied there
+    """
+    min_length = config.min_length or 0
+    max_length = config.max_length or int(1e9)
+    min_edit_distance = config.min_edit_distance or -1
+    max_edit_distance = config.max_edit_distance or int(1e9)
+    min_alpha_ratio = config.min_alpha_ratio or 0.0
+
+    char_distance = table['char_distance'].to_numpy()
+    return OrderedDict([
+        ('length', (table['min_length'].to_numpy() >= min_length) & (table['max_length'].to_numpy() <= max_length)),
+        ('regex', table['regex_ok'].to_numpy(dtype=bool)),
+        ('levenshtein', (min_edit_distance <= char_distance) & (char_distance <= max_edit_distance)),
+        ('alpha_ratio', table['alpha_ratio'].to_numpy() >= min_alpha_ratio),
+        ('language', table['english'].to_numpy(dtype=bool)),
+    ])
+
+
+def evaluate(table: pd.DataFrame, config: SelectionConfig) -> (np.ndarray, Dict[str, int]):
+    """
+    Mask of selected pairs and the number of pairs rejected by every filter, counted like select_sentence_pairs does:
+    a pair is rejected by the first filter it fails
+    """
+    selected = np.ones(len(table), dtype=bool)
+    rejected = {}
+    for name, mask in filter_masks(table, config).items():
+        passed = selected & mask
+        rejected[name] = int(selected.sum() - passed.sum())
+        selected = passed
+    return selected, rejected
+
+
+def config_grid(min_lengths: Sequence, max_lengths: Sequence, min_edit_distances: Sequence,
+                max_edit_distances: Sequence, min_alpha_ratios: Sequence) -> List[SelectionConfig]:
+    return [SelectionConfig(*values)
+            for values in product(min_lengths, max_lengths, min_edit_distances, max_edit_distances, min_alpha_ratios)]
+
+
+def write_dataset(table: pd.DataFrame, selected: np.ndarray, path: Path):
+    """
+    Saves selected pairs in the format of process_patches.py
+    """
+    dataset = table.loc[selected, ['original_sent', 'edited_sent']].reset_index(drop=True)
+    dataset.insert(0, 'sent_id', np.arange(len(dataset)))
+    dataset.to_csv(path, sep='\t', index=False)
+
+
+def read_table(path: Path) -> pd.DataFrame:
+    return pd.read_csv(path, sep='\t', keep_default_na=False)
+
+
+def write_table(table: pd.DataFrame, path: Path):
+    table.to_csv(path, sep='\t', index=False)
@@ -0,0 +1,107 @@
+import sys
+import argparse
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+from urllib.parse import unquote
+from cosmas.generated.cosmas_pb2 import PatchList
+from processing.store import PatchStoreIndex
+
+
+def parse_time(value: Optional[str]) -> Optional[int]:
+    """
+    Accepts milliseconds since epoch or an ISO date, returns milliseconds since epoch
+    """
+    if value is None:
+        return None
+    if value.isdigit():
+        return int(value)
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp() * 1000)
+
+
+def format_time(timestamp: Optional[int]) -> str:
+    if timestamp is None:
+        return '-'
+    return datetime.fromtimestamp(timestamp / 1000, tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def print_patches(index: PatchStoreIndex, filters: dict, show_text: bool):
+    rows = index.patches(**filters)
+    patch_lists = {}
+    for path, idx, file_id, timestamp, user_id, user_name, text_size in rows:
+        print(f'{file_id}\t{format_time(timestamp)}\t{user_id}\t{user_name}\t{text_size}\t{path}#{idx}')
+        if show_text:
+            if path not in patch_lists:
+                patch_lists.clear()
+                patch_lists[path] = PatchList()
+                patch_lists[path].ParseFromString(Path(path).read_bytes())
+            print(unquote(patch_lists[path].patches[idx].text))
+    print(f'{len(rows)} patches', file=sys.stderr)
+
+
+def print_files(index: PatchStoreIndex, filters: dict):
+    rows = index.files(file_id=filters['file_id'], since=filters['since'], until=filters['until'])
+    for path, kind, file_id, timestamp, size, patch_count in rows:
+        print(f'{file_id}\t{kind}\t{format_time(timestamp)}\t{size}\t{patch_count}\t{path}')
+    print(f'{len(rows)} files', file=sys.stderr)
+
+
+def print_stats(index: PatchStoreIndex, filters: dict, group_by: Optional[str]):
+    for row in index.stats(group_by=group_by, **filters):
+        key, (patches, size, docs, first, last) = (row[0], row[1:]) if group_by else ('total', row)
+        print(f'{key}\tpatches={patches}\tbytes={size or 0}\tdocuments={docs}\t'
+              f'first={format_time(first)}\tlast={format_time(last)}')
+
+
+def main():
+    """
+    Answers queries about the patch store from a persistent index, only files matching the query are read.
+    The index is brought up to date by the index command, or before a query with --update
+    (only files of the document with --file-id)
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['index', 'patches', 'files', 'stats'])
+    parser.add_argument('--store', type=str, default='resources',
+                        help='Folder with patches and content written by load_patches.py')
+    parser.add_argument('--index', type=str, default=None,
+                        help='Index file, <store>/index.sqlite by default')
+    parser.add_argument('--update', action='store_true',
+                        help='Bring the index up to date before answering the query, '
+                             'only for the document of --file-id if it is given')
+    parser.add_argument('--file-id', type=str, default=None)
+    parser.add_argument('--user', type=str, default=None,
+                        help='User id or user name')
+    parser.add_argument('--since', type=str, default=None,
+                        help='Milliseconds since epoch or ISO date, inclusive')
+    parser.add_argument('--until', type=str, default=None,
+                        help='Milliseconds since epoch or ISO date, exclusive')
+    parser.add_argument('--text', action='store_true',
+                        help='Print texts of matched patches')
+    parser.add_argument('--group-by', choices=['user', 'file', 'day'], default=None)
+    args = parser.parse_args()
+
+    index = PatchStoreIndex(Path(args.store), args.index and Path(args.index))
+    if args.command == 'index' or args.update:
+        indexed, removed = index.update(file_id=args.file_id)
+        print(f'Indexed {indexed} files, removed {removed} files', file=sys.stderr)
+
+    filters = {
+        'file_id': args.file_id,
+        'user': args.user,
+        'since': parse_time(args.since),
+        'until': parse_time(args.until)
+    }
+    if args.command == 'patches':
+        print_patches(index, filters, args.text)
+    elif args.command == 'files':
+        print_files(index, filters)
+    elif args.command == 'stats':
+        print_stats(index, filters, args.group_by)
+    index.close()
+
+
+if __name__ == '__main__':
+    main()
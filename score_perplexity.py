@@ -0,0 +1,62 @@
+import sys
+import argparse
+import psutil
+import pandas as pd
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Optional
+from processing.metrics import load_perplexity_scorer
+
+
+_scorer = None
+
+
+def _init_worker(model_path: Path):
+    global _scorer
+    _scorer = load_perplexity_scorer(model_path)
+
+
+def _score_chunk(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.copy()
+    perplexities = _scorer.perplexity_batch(df['original_sent'].tolist() + df['edited_sent'].tolist())
+    df['original_ppl'] = perplexities[:len(df)]
+    df['edited_ppl'] = perplexities[len(df):]
+    return df
+
+
+def main(dataset_path: Path, output_path: Path, model_path: Path, num_workers: int, chunk_size: int,
+         max_ppl: Optional[float]):
+    """
+    Adds perplexities of original and edited sentences to an existing dataset, optionally dropping pairs
+    with a perplexity above the threshold
+    """
+    chunks = pd.read_csv(dataset_path, sep='\t', chunksize=chunk_size, keep_default_na=False)
+
+    rows, kept = 0, 0
+    with Pool(num_workers, initializer=_init_worker, initargs=(model_path,)) as pool:
+        for i, df in enumerate(pool.imap(_score_chunk, chunks)):
+            rows += len(df)
+            if max_ppl is not None:
+                df = df[(df['original_ppl'] <= max_ppl) & (df['edited_ppl'] <= max_ppl)]
+            kept += len(df)
+            df.to_csv(output_path, sep='\t', index=False, mode='w' if i == 0 else 'a', header=i == 0)
+            print(f'Scored {rows} sentence pairs', file=sys.stderr)
+
+    print(f'Kept {kept} of {rows} sentence pairs', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dataset', type=str, required=True,
+                        help='Dataset produced by process_patches.py')
+    parser.add_argument('--output', type=str, required=True,
+                        help='File to save dataset with perplexities')
+    parser.add_argument('--model-path', type=str, default='resources/ppl_scorers/ngram_model.ngram')
+    parser.add_argument('--num-workers', type=int, default=psutil.cpu_count(logical=True))
+    parser.add_argument('--chunk-size', type=int, default=10000,
+                        help='Number of sentence pairs scored by a worker at once')
+    parser.add_argument('--max-ppl', type=float, default=None,
+                        help='Drop sentence pairs with a larger perplexity of any of sentences')
+    args = parser.parse_args()
+    main(Path(args.dataset), Path(args.output), Path(args.model_path), args.num_workers, args.chunk_size,
+         args.max_ppl)
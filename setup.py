@@ -1,12 +1,18 @@
 import numpy
 from pathlib import Path
 from distutils.core import setup
+from distutils.extension import Extension
 from Cython.Build import cythonize
 
 
 setup(
     ext_modules=cythonize([
-        str(Path('processing', 'metrics', 'levenshtein.pyx'))
+        Extension(
+            'processing.metrics.levenshtein',
+            sources=[str(Path('processing', 'metrics', 'levenshtein.pyx'))],
+            extra_compile_args=['-fopenmp'],
+            extra_link_args=['-fopenmp']
+        )
     ], annotate=True),
     include_dirs=[numpy.get_include()]
 )
@@ -0,0 +1,52 @@
+import sys
+import time
+import argparse
+from dataclasses import asdict
+from pathlib import Path
+import pandas as pd
+
+from processing.sweep import FILTERS, config_grid, evaluate, read_table, write_dataset
+
+
+def main(table_path: Path, output_dir: Path, configs: list):
+    """
+    Evaluates every selection config as masks over the metrics table written by process_patches.py --metrics-table,
+    saves a dataset per config and a summary of pair counts
+    """
+    start = time.perf_counter()
+    table = read_table(table_path)
+    print(f'{len(table)} sentence pairs in {table_path}, {len(configs)} configs', file=sys.stderr)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    summary = []
+    for config in configs:
+        selected, rejected = evaluate(table, config)
+        dataset_path = output_dir / f'{config.name}.tsv'
+        write_dataset(table, selected, dataset_path)
+        summary.append({**asdict(config), 'pairs': int(selected.sum()),
+                        **{f'rejected_{name}': rejected[name] for name in FILTERS}, 'dataset': str(dataset_path)})
+        print(f'{config.name}: {summary[-1]["pairs"]} pairs', file=sys.stderr)
+
+    pd.DataFrame(summary).to_csv(output_dir / 'summary.tsv', sep='\t', index=False)
+    print(f'Done in {time.perf_counter() - start:.2f}s', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--table', type=str, required=True,
+                        help='Metrics table saved by process_patches.py --metrics-table')
+    parser.add_argument('--output-dir', type=str, required=True,
+                        help='Folder to save a dataset per config and summary.tsv to')
+    parser.add_argument('--min-length', type=int, nargs='+', default=[1],
+                        help='Minimal lengths of sentences to try, 0 disables the bound')
+    parser.add_argument('--max-length', type=int, nargs='+', default=[0],
+                        help='Maximal lengths of sentences to try, 0 disables the bound')
+    parser.add_argument('--min-edit-dist', type=int, nargs='+', default=[1],
+                        help='Minimal edit distances between sentences to try, 0 disables the bound')
+    parser.add_argument('--max-edit-dist', type=int, nargs='+', default=[25],
+                        help='Maximal edit distances between sentences to try, 0 disables the bound')
+    parser.add_argument('--min-alpha-ratio', type=float, nargs='+', default=[0.65],
+                        help='Minimal alphabetic symbols ratios to try')
+    args = parser.parse_args()
+    main(Path(args.table), Path(args.output_dir),
+         config_grid(args.min_length, args.max_length, args.min_edit_dist, args.max_edit_dist, args.min_alpha_ratio))